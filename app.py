@@ -1,13 +1,42 @@
-from flask import Flask, render_template, request, jsonify
+import time
+# Startup time is measured from here, so it includes importing Flask and the modules below
+IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, render_template, request, jsonify, g, send_file, url_for, make_response
+import click
 import os
 from datetime import datetime
 import json
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import hashlib
+import hmac
+import uuid
+import io
+import pstats
+import threading
 from dotenv import load_dotenv
 import logging
 import re
 import math
+from sheets_client import SheetsClientPool, wrap_service_requests
+from sheet_metadata import SpreadsheetMetadataCache
+from leaderboard import LeaderboardIndex, LeaderboardSheetWriter, apply_leaderboard_delta, normalize_player_name, parse_float
+from player_history import PlayerHistoryIndex
+from score_distribution import ScoreDistribution
+from positions import DIFFICULTY_LEVELS, PositionPools
+from submission_queue import SubmissionQueue, SubmissionFlusher
+from storage import SheetsStorage, ShardedSheetsStorage, SQLiteStorage
+import trial_verifier
+from trial_payload import TrialColumns, TrialPayloadError, decompress_body
+from backfill import MetricsBackfill, DEFAULT_PAGE_SIZE
+from sheets_fake import FakeSheetsBackend
+from instrumentation import MetricsRegistry, instrument_service
+from request_profiler import RequestProfiler
+from sheets_scheduler import SheetsScheduler
+from assets import AssetPipeline, IMMUTABLE_CACHE_CONTROL, PIECES_BUNDLE
+from leaderboard_stream import RESYNC, EventLog, EventHub
+from shared_cache import SharedCache
+from idempotency import IdempotencyStore, IdempotencyConflict, MAX_KEY_LENGTH, payload_fingerprint
+from trial_analytics import TrialAnalytics, AnalyticsQueryError, DIMENSIONS as TRIAL_DIMENSIONS, check_query, parse_label
 
 app = Flask(__name__)
 
@@ -16,6 +45,100 @@ load_dotenv()
 
 # Google Sheets API setup
 SHEET_ID = "1M2TjhCmjLX6w3POBNoTLlC1QXOeZxXIPaKjTPrdECeo"  # Replace with your existing sheet ID
+SHEET_METADATA_TTL_SECONDS = int(os.environ.get("SHEET_METADATA_TTL_SECONDS", 300))
+
+# Storage backend: "sheets" (Google Sheets only) or "sqlite" (local primary store, Sheets as async replica)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sheets").lower()
+SQLITE_DATABASE_PATH = os.environ.get("SQLITE_DATABASE_PATH", os.path.join(app.instance_path, "pontifex.sqlite3"))
+# Offline Google Sheets stand-in for development and load tests: "" (off), "memory" or "file" (shared by all workers)
+SHEETS_FAKE = os.environ.get("SHEETS_FAKE", "").lower()
+SHEETS_FAKE_PATH = os.environ.get("SHEETS_FAKE_PATH", os.path.join(app.instance_path, "sheets_fake.json"))
+SHEETS_FAKE_LATENCY_MS = float(os.environ.get("SHEETS_FAKE_LATENCY_MS", 0))
+SHEETS_FAKE_JITTER_MS = float(os.environ.get("SHEETS_FAKE_JITTER_MS", 0))
+SHEETS_FAKE_QUOTA_PER_MINUTE = int(os.environ.get("SHEETS_FAKE_QUOTA_PER_MINUTE", 0))
+SHEETS_FAKE_QUOTA_ERROR_RATE = float(os.environ.get("SHEETS_FAKE_QUOTA_ERROR_RATE", 0))
+SHEETS_FAKE_FAILURE_RATE = float(os.environ.get("SHEETS_FAKE_FAILURE_RATE", 0))
+SHEETS_FAKE_SEED = os.environ.get("SHEETS_FAKE_SEED")
+# Split the Data and Trials sheets into one sheet per "month" or "year" (listed in a Shards sheet); "" keeps single sheets
+SHEETS_SHARDING = os.environ.get("SHEETS_SHARDING", "").lower()
+SHEETS_REPLICA = os.environ.get("SHEETS_REPLICA", "1" if "GOOGLE_SHEET_CREDENTIALS" in os.environ or SHEETS_FAKE else "0").lower() in ("1", "true", "yes")
+
+# Reload the leaderboard index from storage after this many seconds (0 = only on demand)
+LEADERBOARD_INDEX_MAX_AGE_SECONDS = int(os.environ.get("LEADERBOARD_INDEX_MAX_AGE_SECONDS", 300))
+LEADERBOARD_WRITE_DEBOUNCE_SECONDS = float(os.environ.get("LEADERBOARD_WRITE_DEBOUNCE_SECONDS", 0))
+# "best" ranks each player's best session, "combined" ranks the combined score of all their sessions
+LEADERBOARD_RANKING = os.environ.get("LEADERBOARD_RANKING", "best").lower()
+# Browser caching of /get_leaderboard; responses carry an ETag, so max-age 0 means "revalidate every time"
+LEADERBOARD_CACHE_MAX_AGE_SECONDS = int(os.environ.get("LEADERBOARD_CACHE_MAX_AGE_SECONDS", 0))
+# Server-Sent Events of ranking changes on /leaderboard/stream, passed between workers through an event log file
+LEADERBOARD_STREAM = os.environ.get("LEADERBOARD_STREAM", "1").lower() in ("1", "true", "yes")
+LEADERBOARD_EVENTS_PATH = os.environ.get("LEADERBOARD_EVENTS_PATH", os.path.join(app.instance_path, "leaderboard_events.jsonl"))
+LEADERBOARD_STREAM_BUFFER_SIZE = int(os.environ.get("LEADERBOARD_STREAM_BUFFER_SIZE", 64))
+LEADERBOARD_STREAM_HEARTBEAT_SECONDS = float(os.environ.get("LEADERBOARD_STREAM_HEARTBEAT_SECONDS", 15))
+# Streams end after this long and the browser reconnects, so a worker thread is never held for good
+LEADERBOARD_STREAM_MAX_SECONDS = float(os.environ.get("LEADERBOARD_STREAM_MAX_SECONDS", 300))
+# Open streams per worker; each one holds a gunicorn thread (see gunicorn.conf.py)
+LEADERBOARD_STREAM_MAX_CLIENTS = int(os.environ.get("LEADERBOARD_STREAM_MAX_CLIENTS", 24))
+POSITION_POOL_SIZE = int(os.environ.get("POSITION_POOL_SIZE", 500))
+POSITION_BATCH_MAX = int(os.environ.get("POSITION_BATCH_MAX", 200))
+# Key that signs served positions so answers are only replayed on positions this server issued;
+# created on first start and shared by every worker
+POSITION_SIGNING_KEY_PATH = os.environ.get("POSITION_SIGNING_KEY_PATH", os.path.join(app.instance_path, "position_signing.key"))
+PLAYER_HISTORY_WINDOW = int(os.environ.get("PLAYER_HISTORY_WINDOW", 5))
+PLAYER_HISTORY_EW_ALPHA = float(os.environ.get("PLAYER_HISTORY_EW_ALPHA", 0.3))
+# Reload the player history from storage after this many seconds (0 = load once, then only add new sessions).
+# Each worker only adds the sessions it stores, so set it when several workers share the Sheets backend.
+PLAYER_HISTORY_MAX_AGE_SECONDS = int(os.environ.get("PLAYER_HISTORY_MAX_AGE_SECONDS", 0))
+# Largest /submit_results body accepted once inflated (Content-Encoding: gzip)
+SUBMIT_MAX_INFLATED_BYTES = int(os.environ.get("SUBMIT_MAX_INFLATED_BYTES", 16 * 1024 * 1024))
+# Retried submissions (same Idempotency-Key header, or same payload) get the first response instead of being stored twice
+SUBMIT_IDEMPOTENCY = os.environ.get("SUBMIT_IDEMPOTENCY", "1").lower() in ("1", "true", "yes")
+SUBMIT_IDEMPOTENCY_PATH = os.environ.get("SUBMIT_IDEMPOTENCY_PATH", os.path.join(app.instance_path, "idempotency.sqlite3"))
+SUBMIT_IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("SUBMIT_IDEMPOTENCY_TTL_SECONDS", 3600))
+SUBMIT_IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("SUBMIT_IDEMPOTENCY_MAX_ENTRIES", 2000))
+# Write-behind mode: submissions are queued locally and flushed to Sheets in batches
+SUBMISSION_WRITE_BEHIND = os.environ.get("SUBMISSION_WRITE_BEHIND", "").lower() in ("1", "true", "yes")
+SUBMISSION_QUEUE_PATH = os.environ.get("SUBMISSION_QUEUE_PATH", os.path.join(app.instance_path, "submission_queue.jsonl"))
+SUBMISSION_FLUSH_INTERVAL_SECONDS = float(os.environ.get("SUBMISSION_FLUSH_INTERVAL_SECONDS", 5))
+
+# Sheets API quota shared by all workers (per-user quota of the service account), 429/5xx retries
+SHEETS_SCHEDULER = os.environ.get("SHEETS_SCHEDULER", "1").lower() in ("1", "true", "yes")
+SHEETS_READS_PER_MINUTE = float(os.environ.get("SHEETS_READS_PER_MINUTE", 60))
+SHEETS_WRITES_PER_MINUTE = float(os.environ.get("SHEETS_WRITES_PER_MINUTE", 60))
+SHEETS_QUOTA_BURST = int(os.environ.get("SHEETS_QUOTA_BURST", 10))
+SHEETS_QUOTA_STATE_PATH = os.environ.get("SHEETS_QUOTA_STATE_PATH", os.path.join(app.instance_path, "sheets_quota"))
+SHEETS_MAX_RETRIES = int(os.environ.get("SHEETS_MAX_RETRIES", 5))
+
+# Cache shared by all workers (SQLite): leaderboard snapshots, sheet metadata and player summaries
+SHARED_CACHE = os.environ.get("SHARED_CACHE", "1").lower() in ("1", "true", "yes")
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH", os.path.join(app.instance_path, "shared_cache.sqlite3"))
+SHARED_CACHE_MAX_ENTRIES = int(os.environ.get("SHARED_CACHE_MAX_ENTRIES", 1000))
+SHARED_CACHE_TTL_SECONDS = int(os.environ.get("SHARED_CACHE_TTL_SECONDS", 300))
+# Per-condition trial statistics (/analytics/trials): each worker's in-memory trial table is reloaded
+# once older than this, and query results are shared by all workers for ANALYTICS_CACHE_SECONDS
+ANALYTICS_TABLE_MAX_AGE_SECONDS = int(os.environ.get("ANALYTICS_TABLE_MAX_AGE_SECONDS", 900))
+ANALYTICS_CACHE_SECONDS = int(os.environ.get("ANALYTICS_CACHE_SECONDS", 300))
+
+# Prometheus metrics: every worker writes its counts here and /metrics merges them
+METRICS_DIRECTORY = os.environ.get("METRICS_DIRECTORY", os.path.join(app.instance_path, "metrics"))
+METRICS_FLUSH_INTERVAL_SECONDS = float(os.environ.get("METRICS_FLUSH_INTERVAL_SECONDS", 2))
+
+# Token for the admin endpoints (/admin/cache), sent as X-Admin-Token; unset turns them off.
+# Separate from PROFILER_ADMIN_TOKEN, which also installs the profiling hooks
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# Request profiling: requests carrying X-Profile-Token: <PROFILER_ADMIN_TOKEN>, plus a random
+# PROFILER_SAMPLE_RATE share of all requests. Off (no hooks installed) when neither is set.
+PROFILER_ADMIN_TOKEN = os.environ.get("PROFILER_ADMIN_TOKEN", "")
+PROFILER_SAMPLE_RATE = float(os.environ.get("PROFILER_SAMPLE_RATE", 0))
+PROFILER_MODE = os.environ.get("PROFILER_MODE", "cprofile").lower()
+PROFILER_DIRECTORY = os.environ.get("PROFILER_DIRECTORY", os.path.join(app.instance_path, "profiles"))
+PROFILER_MAX_PROFILES = int(os.environ.get("PROFILER_MAX_PROFILES", 50))
+# Content-hashed, precompressed copies of the static files, served from /assets/ with immutable caching
+ASSET_PIPELINE = os.environ.get("ASSET_PIPELINE", "1").lower() in ("1", "true", "yes")
+ASSET_DIRECTORY = os.environ.get("ASSET_DIRECTORY", os.path.join(app.instance_path, "assets"))
+# Warm-up after start (gunicorn.conf.py, first /ping or /health): Sheets client, headers, indexes, numpy
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "1").lower() in ("1", "true", "yes")
 
 DATA_SHEET_HEADERS = [
     'Date', 'Time', 'Patient Name', 'Difficulty', 'Duration',
@@ -28,7 +151,8 @@ DATA_SHEET_HEADERS = [
     'Lapse Rate 1st Third (%)', 'Lapse Rate 2nd Third (%)', 'Lapse Rate 3rd Third (%)',
     'RT Decrement (%)', 'Accuracy Decrement (%)', 'IES Decrement (%)',
     'RT Slope', 'Success Slope', 'IES Slope', 'Error Rate Slope',
-    'Post-Error RT Delta (s)', 'Post-Error Accuracy Delta (pp)', 'RT-Success Correlation'
+    'Post-Error RT Delta (s)', 'Post-Error Accuracy Delta (pp)', 'RT-Success Correlation',
+    'Answer Mismatch Rate (%)', 'Session ID'
 ]
 
 TRIALS_SHEET_HEADERS = [
@@ -390,205 +514,480 @@ def calculate_ies(trial_data, duration):
     )
 
 
+def build_data_row(current_date, current_time, patient_name, display_difficulty, duration, board_display_time, metrics, verification=None, session_id=''):
+    """Summary row for the Data sheet, in DATA_SHEET_HEADERS order."""
+    extra_metrics = metrics['extra_metrics']
+    return [
+        current_date,
+        current_time,
+        patient_name,
+        display_difficulty,
+        duration,
+        board_display_time,
+        metrics['overall_ies'],
+        metrics['ies1'],
+        metrics['ies2'],
+        metrics['ies3'],
+        metrics['focus_drift'],
+        metrics['focus_stability'],
+        extra_metrics.get('overall_accuracy_pct', ''),
+        extra_metrics.get('overall_median_rt', ''),
+        extra_metrics.get('overall_rt_cv', ''),
+        extra_metrics.get('overall_lapse_rate_pct', ''),
+        extra_metrics.get('accuracy_first_pct', ''),
+        extra_metrics.get('accuracy_second_pct', ''),
+        extra_metrics.get('accuracy_third_pct', ''),
+        extra_metrics.get('median_rt_first', ''),
+        extra_metrics.get('median_rt_second', ''),
+        extra_metrics.get('median_rt_third', ''),
+        extra_metrics.get('rt_cv_first', ''),
+        extra_metrics.get('rt_cv_second', ''),
+        extra_metrics.get('rt_cv_third', ''),
+        extra_metrics.get('lapse_rate_first_pct', ''),
+        extra_metrics.get('lapse_rate_second_pct', ''),
+        extra_metrics.get('lapse_rate_third_pct', ''),
+        extra_metrics.get('rt_decrement_pct', ''),
+        extra_metrics.get('accuracy_decrement_pct', ''),
+        extra_metrics.get('ies_decrement_pct', ''),
+        extra_metrics.get('rt_slope', ''),
+        extra_metrics.get('success_slope', ''),
+        extra_metrics.get('ies_slope', ''),
+        extra_metrics.get('error_rate_slope', ''),
+        extra_metrics.get('post_error_rt_delta', ''),
+        extra_metrics.get('post_error_accuracy_delta_pp', ''),
+        extra_metrics.get('rt_success_correlation', ''),
+        verification['mismatch_rate_pct'] if verification else '',
+        session_id
+    ]
+
+
+def build_trial_rows(current_date, current_time, patient_name, trial_data):
+    """One Trials sheet row per trial, in TRIALS_SHEET_HEADERS order."""
+    trial_rows = []
+    for trial in trial_data:
+        trial_rows.append([
+            current_date,
+            current_time,
+            patient_name,
+            trial.get('trial', ''),
+            trial.get('trialTime', ''),
+            trial.get('attackingPiece', ''),
+            trial.get('attackingPosition', ''),
+            trial.get('attackedPieces', ''),
+            trial.get('responseTime', ''),
+            trial.get('success', ''),
+            trial.get('responsePosition', '')
+        ])
+    return trial_rows
+
+
 def ensure_sheet_header(service, sheet_name, headers):
-    service.spreadsheets().values().update(
-        spreadsheetId=SHEET_ID,
-        range=f"{sheet_name}!A1",
-        valueInputOption="RAW",
-        body={"values": [headers]}
-    ).execute()
+    """Create sheet_name if needed and reconcile its header row; returns the actual sheet title."""
+    return sheet_metadata_cache.ensure_sheet(service, sheet_name, headers)
+
+
+def reconcile_sheet_headers(service):
+    """Make sure the Data and Trials sheets exist with the current headers (no-op once reconciled)."""
+    return sheets_storage.reconcile_headers(service)
+
+# Request, Sheets call and leaderboard latencies, aggregated across workers on /metrics
+metrics_registry = MetricsRegistry(METRICS_DIRECTORY, flush_interval_seconds=METRICS_FLUSH_INTERVAL_SECONDS)
+metrics_registry.describe("pontifex_http_requests_total", "counter", "HTTP requests by route, method and status.")
+metrics_registry.describe("pontifex_http_request_duration_seconds", "histogram", "HTTP request latency by route and method.")
+metrics_registry.describe("pontifex_http_errors_total", "counter", "HTTP requests answered with a 5xx status, by route.")
+metrics_registry.describe("pontifex_sheets_requests_total", "counter", "Google Sheets API calls by operation.")
+metrics_registry.describe("pontifex_sheets_request_duration_seconds", "histogram", "Google Sheets API call latency by operation.")
+metrics_registry.describe("pontifex_sheets_errors_total", "counter", "Failed Google Sheets API calls by operation and HTTP status.")
+metrics_registry.describe("pontifex_sheets_queue_wait_seconds", "histogram", "Time Sheets requests waited for a read or write quota token.")
+metrics_registry.describe("pontifex_sheets_retries_total", "counter", "Sheets requests retried after a 429 or transient error, by operation and status.")
+metrics_registry.describe("pontifex_sheets_coalesced_total", "counter", "Sheets requests answered by an identical queued request instead of being sent.")
+metrics_registry.describe("pontifex_function_duration_seconds", "histogram", "Latency of instrumented steps (metrics computation, leaderboard updates and rebuilds).")
+metrics_registry.describe("pontifex_function_errors_total", "counter", "Exceptions raised by instrumented steps.")
+metrics_registry.describe("pontifex_warmup_errors_total", "counter", "Warm-up steps that failed, by step.")
+metrics_registry.describe("pontifex_shared_cache_requests_total", "counter", "Shared cache lookups by namespace and result (hit or miss).")
+metrics_registry.describe("pontifex_submission_duplicates_total", "counter", "Repeated submissions answered from the idempotency store, by outcome.")
+metrics_registry.describe("pontifex_leaderboard_events_total", "counter", "Leaderboard deltas published to the live streams, by difficulty.")
+
+# Every Sheets request waits for a quota token and is retried on 429s and transient errors
+if SHEETS_SCHEDULER:
+    sheets_scheduler = SheetsScheduler(
+        reads_per_minute=SHEETS_READS_PER_MINUTE,
+        writes_per_minute=SHEETS_WRITES_PER_MINUTE,
+        burst=SHEETS_QUOTA_BURST,
+        state_path=SHEETS_QUOTA_STATE_PATH,
+        max_retries=SHEETS_MAX_RETRIES,
+        registry=metrics_registry
+    )
+else:
+    sheets_scheduler = None
+
+# Offline Sheets stand-in, used instead of the real API when SHEETS_FAKE is set
+if SHEETS_FAKE:
+    sheets_fake = FakeSheetsBackend(
+        path=SHEETS_FAKE_PATH if SHEETS_FAKE == "file" else None,
+        latency_ms=SHEETS_FAKE_LATENCY_MS,
+        jitter_ms=SHEETS_FAKE_JITTER_MS,
+        quota_per_minute=SHEETS_FAKE_QUOTA_PER_MINUTE,
+        quota_error_rate=SHEETS_FAKE_QUOTA_ERROR_RATE,
+        failure_rate=SHEETS_FAKE_FAILURE_RATE,
+        seed=SHEETS_FAKE_SEED
+    )
+else:
+    sheets_fake = None
+
+# Process-wide pool of Sheets clients, built once per worker and reused across requests
+sheets_client_pool = SheetsClientPool()
+
+# Versioned entries shared by all workers on the host, invalidated when a submission lands
+if SHARED_CACHE:
+    shared_cache = SharedCache(
+        SHARED_CACHE_PATH,
+        max_entries=SHARED_CACHE_MAX_ENTRIES,
+        ttl_seconds=SHARED_CACHE_TTL_SECONDS,
+        registry=metrics_registry
+    )
+else:
+    shared_cache = None
 
-# Function to get Google Sheets service
-def get_sheets_service():
+# Leaderboard snapshot in the shared cache, kept current by every submission
+LEADERBOARD_SHARED_NAMESPACE = "leaderboard"
+LEADERBOARD_SHARED_KEY = f"leaderboard:{LEADERBOARD_RANKING}"
+
+
+def shared_cache_call(method, *args):
+    """Call a shared cache method, or return None when the cache is off or failing (the caller computes the value)."""
+    if shared_cache is None:
+        return None
     try:
-        if "GOOGLE_SHEET_CREDENTIALS" in os.environ:
-            credentials_json = os.environ["GOOGLE_SHEET_CREDENTIALS"]
-            try:
-                credentials_info = json.loads(credentials_json)
-            except json.JSONDecodeError as e:
-                safe_log('error', f"Error decoding JSON: {e}")
-                raise  # Re-raise the exception to handle it later
-        else:
-            safe_log('error', "No credentials found!")
-            raise ValueError("GOOGLE_SHEET_CREDENTIALS is not set.")
+        return getattr(shared_cache, method)(*args)
+    except Exception as e:
+        safe_log('warning', f"Shared cache {method} failed: {str(e)}")
+        return None
+
+# Sheet titles and reconciled header rows, shared by all requests of this worker (and the other workers)
+sheet_metadata_cache = SpreadsheetMetadataCache(SHEET_ID, ttl_seconds=SHEET_METADATA_TTL_SECONDS, shared_cache=shared_cache)
+
+# Best session per player and difficulty, plus the diffing writer for the Leaderboard sheet
+leaderboard_index = LeaderboardIndex()
+leaderboard_writer = LeaderboardSheetWriter(
+    SHEET_ID,
+    debounce_seconds=LEADERBOARD_WRITE_DEBOUNCE_SECONDS,
+    service_factory=lambda: get_sheets_service()
+)
+
+# Leaderboard deltas for the live streams, shared with the other workers through the event log
+if LEADERBOARD_STREAM:
+    leaderboard_hub = EventHub(
+        EventLog(LEADERBOARD_EVENTS_PATH),
+        buffer_size=LEADERBOARD_STREAM_BUFFER_SIZE,
+        on_event=lambda event: apply_leaderboard_event(event)
+    )
+    leaderboard_hub.ensure_started()
+else:
+    leaderboard_hub = None
+
+# Every player's sessions with running aggregates per difficulty (best, rolling mean, EW IES)
+player_history = PlayerHistoryIndex(
+    window=PLAYER_HISTORY_WINDOW,
+    ew_alpha=PLAYER_HISTORY_EW_ALPHA,
+    session_id_column=DATA_SHEET_HEADERS.index('Session ID')
+)
+
+# IES of every session in sorted arrays per difficulty / board display time / duration bucket
+score_distribution = ScoreDistribution()
+
+# Pre-generated chess positions per difficulty, refilled in the background
+position_pools = PositionPools(pool_size=POSITION_POOL_SIZE)
+position_pools.ensure_started()
+position_signer = trial_verifier.PositionSigner.from_key_file(POSITION_SIGNING_KEY_PATH)
 
-        creds = service_account.Credentials.from_service_account_info(credentials_info, scopes=["https://www.googleapis.com/auth/spreadsheets"])
+# Hashed asset names for the templates; the plain static files are used when the pipeline is off
+asset_pipeline = AssetPipeline(app.static_folder, ASSET_DIRECTORY) if ASSET_PIPELINE else None
 
-        service = build("sheets", "v4", credentials=creds)
 
-        # Return the service object directly, not service.spreadsheets()
+@app.template_global()
+def asset_url(name):
+    """URL of a static asset (a name relative to static/, or PIECES_BUNDLE), or None if it is not available."""
+    if asset_pipeline is not None:
+        try:
+            hashed_path = asset_pipeline.url_path(name)
+        except Exception as e:
+            safe_log('error', f"Error building static assets: {str(e)}")
+            hashed_path = None
+        if hashed_path is not None:
+            return url_for('hashed_asset', filename=hashed_path)
+    if name == PIECES_BUNDLE:
+        return None
+    return url_for('static', filename=name)
+
+# Google Sheets storage is either the primary store or the asynchronous replica of the local store
+if SHEETS_SHARDING:
+    sheets_storage = ShardedSheetsStorage(
+        SHEET_ID,
+        lambda: get_sheets_service(),
+        sheet_metadata_cache,
+        DATA_SHEET_HEADERS,
+        TRIALS_SHEET_HEADERS,
+        period=SHEETS_SHARDING
+    )
+else:
+    sheets_storage = SheetsStorage(
+        SHEET_ID,
+        lambda: get_sheets_service(),
+        sheet_metadata_cache,
+        DATA_SHEET_HEADERS,
+        TRIALS_SHEET_HEADERS
+    )
+if STORAGE_BACKEND == "sqlite":
+    storage_backend = SQLiteStorage(SQLITE_DATABASE_PATH, DATA_SHEET_HEADERS, TRIALS_SHEET_HEADERS)
+else:
+    storage_backend = sheets_storage
+
+# Every stored trial in columnar arrays for the per-condition statistics, read on the first query
+trial_analytics = TrialAnalytics(storage_backend, max_age_seconds=ANALYTICS_TABLE_MAX_AGE_SECONDS)
+ANALYTICS_SHARED_NAMESPACE = "analytics"
+
+# Function to get Google Sheets service
+def get_sheets_service():
+    try:
+        if sheets_fake is not None:
+            service = sheets_fake.service()
+        else:
+            if "GOOGLE_SHEET_CREDENTIALS" not in os.environ:
+                safe_log('error', "No credentials found!")
+                raise ValueError("GOOGLE_SHEET_CREDENTIALS is not set.")
+            service = sheets_client_pool.get_service()
+
+        # Return the service object directly, not service.spreadsheets(); every request it builds is
+        # timed per attempt, and scheduled within quota around those attempts
+        service = instrument_service(metrics_registry, service)
+        if sheets_scheduler is not None:
+            service = wrap_service_requests(service, sheets_scheduler.execute)
         return service
+    except json.JSONDecodeError as e:
+        safe_log('error', f"Error decoding JSON: {e}")
+        raise  # Re-raise the exception to handle it later
     except Exception as e:
         safe_log('error', f"Error loading credentials or creating service: {str(e)}")
         raise  # Re-raise the exception for further handling
 
+@metrics_registry.timed("load_session_indexes")
+def load_session_indexes():
+    """Rebuild the player history, score distribution and leaderboard indexes from one read of every stored session."""
+    shared_version = shared_cache_call('version', LEADERBOARD_SHARED_NAMESPACE)
+    rows = [row for _, row in storage_backend.read_sessions()]
+    player_history.load_rows(rows)
+    score_distribution.load_sessions(player_history.all_sessions())
+
+    if LEADERBOARD_RANKING == "combined":
+        leaderboard_index.load_entries(player_history.leaderboard_entries())
+    else:
+        leaderboard_index.load_rows(rows)
+    leaderboard_writer.reset()
+    # Refused if a submission landed during the read; the next reload shares it then
+    shared_cache_call('put', LEADERBOARD_SHARED_NAMESPACE, LEADERBOARD_SHARED_KEY,
+                      format_leaderboard_data(leaderboard_index.to_sheet_rows()), shared_version)
+    safe_log('info', f"Session indexes loaded from {len(rows)} sessions.")
+
+
+def current_player_history():
+    if player_history.is_stale(PLAYER_HISTORY_MAX_AGE_SECONDS):
+        load_session_indexes()
+    return player_history
+
+
+def current_player_summary(name, limit=None):
+    """A player's history summary (PlayerHistoryIndex.player_summary), read through the storage backend."""
+    if storage_backend.is_local:
+        # One indexed query, which sees every worker's submissions
+        history = PlayerHistoryIndex(window=PLAYER_HISTORY_WINDOW, ew_alpha=PLAYER_HISTORY_EW_ALPHA)
+        history.load_rows(storage_backend.query_user_history(name))
+        return history.player_summary(name, limit=limit)
+    return current_player_history().player_summary(name, limit=limit)
+
+
+def session_percentiles(ies, difficulty, board_time=None, duration=None):
+    """Percentile rank of an IES among all sessions of the difficulty, and among those with the same settings."""
+    return {
+        'difficulty': score_distribution.percentile_rank(ies, difficulty),
+        'bucket': score_distribution.percentile_rank(ies, difficulty, board_time, duration)
+    }
+
+
+def record_session(data_row):
+    """Add a freshly stored session to the player history and score distribution (a later reload picks it up otherwise)."""
+    shared_cache_call('invalidate', player_cache_namespace(data_row[2]))
+    if player_history.loaded:
+        # Sessions already recorded (submit path, then write-behind flush) return None
+        session = player_history.add_row(data_row)
+        if session is not None:
+            score_distribution.add_session(session)
+
+
+def add_leaderboard_entry(entry):
+    """Add a session to the leaderboard index according to LEADERBOARD_RANKING, publishing any ranking change."""
+    if LEADERBOARD_RANKING == "combined":
+        entry = player_history.leaderboard_entry(entry['name'], entry['difficulty'])
+        if entry is None:
+            return False
+        ranks = leaderboard_index.place_entry(**entry, replace=True)
+    else:
+        ranks = leaderboard_index.place_entry(**entry)
+    if ranks is None:
+        return False
+
+    share_leaderboard_delta(leaderboard_delta(entry['difficulty'].lower(), entry['name'], *ranks))
+    return True
+
+
+def announce_reloaded_entry(difficulty, name, ies, previous_rank):
+    """Share the ranking change of a submission that a reload of the index already picked up."""
+    entry = leaderboard_index.entry_of(difficulty, name)
+    # With "best" ranking a session that is not the player's best changes nothing
+    if entry is None or (LEADERBOARD_RANKING != "combined" and entry['ies'] != parse_float(ies, None)):
+        return
+    share_leaderboard_delta(leaderboard_delta(difficulty, name, previous_rank, leaderboard_index.rank_of(difficulty, name)))
+
+
+def share_leaderboard_delta(delta):
+    if delta is None:
+        return
+    # The other workers' snapshot is updated in place rather than dropped, so none of them has to reload
+    shared_cache_call('apply', LEADERBOARD_SHARED_NAMESPACE, LEADERBOARD_SHARED_KEY,
+                      lambda leaderboard: apply_leaderboard_delta(leaderboard, delta))
+    publish_leaderboard_delta(delta)
+
+
+def leaderboard_delta(difficulty, name, previous_rank, rank):
+    """The entry a submission inserted or moved, as sent to the leaderboard streams."""
+    entry = leaderboard_index.entry_of(difficulty, name)
+    if entry is None:
+        return None
+    return {
+        'difficulty': difficulty,
+        'change': 'moved' if previous_rank >= 0 else 'inserted',
+        'rank': rank + 1,
+        'previous_rank': previous_rank + 1 if previous_rank >= 0 else None,
+        'entry': {
+            'rank': rank + 1,
+            'name': entry['name'],
+            'score': entry['ies'],
+            'drift': entry['drift'],
+            'stability': entry['stability']
+        },
+        'board_time': entry['board_time']
+    }
+
+
+def publish_leaderboard_delta(delta):
+    """Send a leaderboard delta to every leaderboard stream, on all workers."""
+    if leaderboard_hub is None:
+        return
+    # Streams are best effort: the session is stored whatever happens here
+    try:
+        leaderboard_hub.publish('delta', delta)
+        metrics_registry.inc("pontifex_leaderboard_events_total", difficulty=delta['difficulty'])
+    except Exception as e:
+        safe_log('error', f"Error publishing leaderboard delta: {str(e)}")
+
+
+def player_cache_namespace(name):
+    return f"player:{normalize_player_name(name)}"
+
+
+def apply_leaderboard_event(event):
+    """Add a delta published by another worker to this worker's index, so /get_leaderboard agrees with the streams."""
+    if event['type'] != 'delta' or event['origin'] == os.getpid() or not leaderboard_index.loaded:
+        return
+    delta = event['data']
+    entry = delta['entry']
+    leaderboard_index.add_entry(
+        entry['name'], delta['difficulty'], entry['score'], entry['drift'], entry['stability'],
+        delta.get('board_time', 0), replace=LEADERBOARD_RANKING == "combined"
+    )
+
+
+def current_leaderboard_data():
+    """Leaderboard grid for display, read through the storage backend."""
+    if storage_backend.is_local and LEADERBOARD_RANKING != "combined":
+        # Local queries take milliseconds and see every worker's submissions
+        index = LeaderboardIndex()
+        index.load_entries(storage_backend.query_leaderboard())
+        return index.to_sheet_rows()
+
+    if leaderboard_index.is_stale(LEADERBOARD_INDEX_MAX_AGE_SECONDS):
+        load_session_indexes()
+    return leaderboard_index.to_sheet_rows()
+
+# Formatted leaderboard of the last index version served, shared by /get_leaderboard requests
+leaderboard_snapshot = {'version': None, 'leaderboard': None}
+leaderboard_snapshot_lock = threading.Lock()
+
+def current_leaderboard_snapshot():
+    """Formatted leaderboard, reformatted only when the ranking changed since the last request."""
+    if storage_backend.is_local and LEADERBOARD_RANKING != "combined":
+        return format_leaderboard_data(current_leaderboard_data())
+
+    if leaderboard_index.is_stale(LEADERBOARD_INDEX_MAX_AGE_SECONDS):
+        # Another worker's snapshot spares this one a full read of the stored sessions
+        shared_snapshot = shared_cache_call('get', LEADERBOARD_SHARED_NAMESPACE, LEADERBOARD_SHARED_KEY)
+        if shared_snapshot is not None:
+            return shared_snapshot
+        load_session_indexes()
+
+    with leaderboard_snapshot_lock:
+        version = leaderboard_index.version
+        if leaderboard_snapshot['version'] != version:
+            leaderboard_snapshot['leaderboard'] = format_leaderboard_data(leaderboard_index.to_sheet_rows())
+            leaderboard_snapshot['version'] = version
+        return leaderboard_snapshot['leaderboard']
+
+def current_leaderboard_kwargs(leaderboard_entry):
+    """update_leaderboard keyword arguments for a freshly submitted session."""
+    return {
+        'current_user': leaderboard_entry['name'],
+        'current_difficulty': leaderboard_entry['difficulty'],
+        'current_ies': leaderboard_entry['ies'],
+        'current_board_time': leaderboard_entry['board_time'],
+        'current_drift': leaderboard_entry['drift'],
+        'current_stability': leaderboard_entry['stability']
+    }
+
 # update leaderboard automatically
-def update_leaderboard(service, current_user=None, current_difficulty=None, current_ies=None, current_board_time=None, current_drift=None, current_stability=None):
+@metrics_registry.timed("update_leaderboard")
+def update_leaderboard(service, current_user=None, current_difficulty=None, current_ies=None, current_board_time=None, current_drift=None, current_stability=None, rebuild=False):
     try:
         safe_log('info', "Updating leaderboard...")
 
-        # Get current spreadsheet
-        spreadsheet = service.spreadsheets().get(spreadsheetId=SHEET_ID).execute()
-        sheet_titles = [s['properties']['title'] for s in spreadsheet['sheets']]
-        leaderboard_sheet_name = "Leaderboard"
-
-        # Find existing leaderboard sheet (case-insensitive)
-        existing_leaderboard = None
-        for sheet in sheet_titles:
-            if sheet.lower() == leaderboard_sheet_name.lower():
-                existing_leaderboard = sheet
-                break
-        
-        # Use existing sheet if found, otherwise create new one
-        if existing_leaderboard:
-            leaderboard_sheet_name = existing_leaderboard
-        elif leaderboard_sheet_name not in sheet_titles:
-            service.spreadsheets().batchUpdate(spreadsheetId=SHEET_ID, body={
-                "requests": [{
-                    "addSheet": {
-                        "properties": {"title": leaderboard_sheet_name}
-                    }
-                }]
-            }).execute()
-
-        # Organize entries by difficulty
-        easy_entries = []
-        medium_entries = []
-        hard_entries = []
+        submitted = current_user and current_difficulty and current_ies is not None and current_drift is not None and current_stability is not None
+
+        # The index is loaded from storage once, then kept up to date incrementally
+        previous_rank = None
+        if rebuild or leaderboard_index.is_stale(LEADERBOARD_INDEX_MAX_AGE_SECONDS):
+            if submitted:
+                previous_rank = leaderboard_index.rank_of(current_difficulty.lower(), current_user)
+            load_session_indexes()
 
         # Add current user if provided
-        if current_user and current_difficulty and current_ies is not None and current_drift is not None and current_stability is not None:
-            if current_difficulty.lower() == "easy":
-                easy_entries.append([current_user, current_ies, current_drift, current_stability, current_difficulty, current_board_time])
-            elif current_difficulty.lower() == "medium":
-                medium_entries.append([current_user, current_ies, current_drift, current_stability, current_difficulty, current_board_time])
-            elif current_difficulty.lower() == "hard":
-                hard_entries.append([current_user, current_ies, current_drift, current_stability, current_difficulty, current_board_time])
-
-        # Collect existing entries from Data sheet
-        data_sheet_name = "Data"
-        if data_sheet_name in sheet_titles:
-            try:
-                # Get all data rows from Data sheet (skip header row)
-                values = service.spreadsheets().values().get(
-                    spreadsheetId=SHEET_ID, 
-                    range=f"{data_sheet_name}!A2:L10000"  # Columns A-L, starting from row 2
-                ).execute().get("values", [])
-                
-                # Data sheet columns: Date, Time, Patient Name, Difficulty, Duration, 
-                # Board Display Time, Overall IES Score, IES1, IES2, IES3, Focus Drift, Focus Stability
-                for row in values:
-                    if len(row) < 7:  # Need at least Date, Time, Patient Name, Difficulty, Duration, Board Display Time, Overall IES Score
-                        continue
-                    
-                    try:
-                        patient_name = row[2] if len(row) > 2 else ""
-                        difficulty = row[3] if len(row) > 3 else "N/A"
-                        
-                        # Skip current user's entry if it's being added separately
-                        if current_user and patient_name == current_user:
-                            continue
-                        
-                        # Extract IES
-                        ies_str = row[6] if len(row) > 6 else "999999"
-                        try:
-                            ies = float(ies_str)
-                        except (ValueError, TypeError):
-                            ies = 999999
-                        
-                        # Extract board time
-                        board_time_str = row[5] if len(row) > 5 else "0"
-                        try:
-                            board_time = float(board_time_str)
-                        except (ValueError, TypeError):
-                            board_time = 0
-                        
-                        # Extract drift and stability
-                        drift_str = row[10] if len(row) > 10 else "0"
-                        stability_str = row[11] if len(row) > 11 else "0"
-                        try:
-                            drift = float(drift_str)
-                            stability = float(stability_str)
-                        except (ValueError, TypeError):
-                            drift = 0
-                            stability = 0
-                        
-                        entry = [patient_name, ies, drift, stability, difficulty, board_time]
-                        
-                        # Add to appropriate difficulty list
-                        if difficulty.lower() == "easy":
-                            easy_entries.append(entry)
-                        elif difficulty.lower() == "medium":
-                            medium_entries.append(entry)
-                        elif difficulty.lower() == "hard":
-                            hard_entries.append(entry)
-                    except Exception as e:
-                        safe_log('warning', f"Skipping data row due to error: {e}")
-                        continue
-            except Exception as e:
-                safe_log('warning', f"Error reading from Data sheet: {e}")
-            
-        # Sort each difficulty group by IES (ascending)
-        easy_entries = sorted(easy_entries, key=lambda x: float(x[1]))
-        medium_entries = sorted(medium_entries, key=lambda x: float(x[1]))
-        hard_entries = sorted(hard_entries, key=lambda x: float(x[1]))
-
-        # Track current user's position in each difficulty
-        current_user_easy_pos = next((i for i, entry in enumerate(easy_entries) if entry[0] == current_user), -1)
-        current_user_medium_pos = next((i for i, entry in enumerate(medium_entries) if entry[0] == current_user), -1)
-        current_user_hard_pos = next((i for i, entry in enumerate(hard_entries) if entry[0] == current_user), -1)
-
-        # Prepare the leaderboard data with headers for Google Sheets
-        leaderboard_data = [
-            ["Easy Difficulty", "", "", "", "", "Medium Difficulty", "", "", "", "", "Hard Difficulty", "", "", ""],
-            ["Rank", "Name", "IES (s)", "Drift", "Stability", 
-             "Rank", "Name", "IES (s)", "Drift", "Stability", 
-             "Rank", "Name", "IES (s)", "Drift", "Stability"]
-        ]
+        if submitted:
+            changed = add_leaderboard_entry({
+                'name': current_user,
+                'difficulty': current_difficulty,
+                'ies': current_ies,
+                'drift': current_drift,
+                'stability': current_stability,
+                'board_time': current_board_time
+            })
+            if not changed and previous_rank is not None:
+                # The reload already read the submitted session, leaving nothing for add_leaderboard_entry to change
+                announce_reloaded_entry(current_difficulty.lower(), current_user, current_ies, previous_rank)
 
-        # Calculate the maximum number of entries across all difficulties
-        max_entries = max(len(easy_entries), len(medium_entries), len(hard_entries))
-        
-        # Add all entries to the Google Sheet
-        # Each row contains entries from all three difficulties side by side
-        for i in range(max_entries):
-            row = []
-            
-            # Easy difficulty column (columns 0-4)
-            if i < len(easy_entries):
-                entry = easy_entries[i]
-                row.extend([i + 1, entry[0], entry[1], entry[2], entry[3]])  # Rank, Name, IES, Drift, Stability
-            else:
-                row.extend(["", "", "", "", ""])
-            
-            # Medium difficulty column (columns 5-9)
-            if i < len(medium_entries):
-                entry = medium_entries[i]
-                row.extend([i + 1, entry[0], entry[1], entry[2], entry[3]])  # Rank, Name, IES, Drift, Stability
-            else:
-                row.extend(["", "", "", "", ""])
-            
-            # Hard difficulty column (columns 10-14)
-            if i < len(hard_entries):
-                entry = hard_entries[i]
-                row.extend([i + 1, entry[0], entry[1], entry[2], entry[3]])  # Rank, Name, IES, Drift, Stability
-            else:
-                row.extend(["", "", "", "", ""])
-            
-            leaderboard_data.append(row)
-        
-        # Clear the leaderboard sheet and write new data
-        service.spreadsheets().values().clear(
-            spreadsheetId=SHEET_ID, 
-            range=f"{leaderboard_sheet_name}!A1:O1000"
-        ).execute()
-        
-        service.spreadsheets().values().update(
-            spreadsheetId=SHEET_ID,
-            range=f"{leaderboard_sheet_name}!A1",
-            valueInputOption="RAW",
-            body={"values": leaderboard_data}
-        ).execute()
+        # Prepare the leaderboard data with headers for Google Sheets and write only what changed
+        leaderboard_data = leaderboard_index.to_sheet_rows()
+        if service is not None:
+            # Find existing leaderboard sheet (case-insensitive), creating it if needed
+            leaderboard_sheet_name = sheet_metadata_cache.ensure_sheet(service, "Leaderboard")
+            leaderboard_writer.write(service, leaderboard_sheet_name, leaderboard_data)
 
         safe_log('info', "Leaderboard updated successfully.")
         
@@ -600,66 +999,600 @@ def update_leaderboard(service, current_user=None, current_difficulty=None, curr
         raise
 
 
-def get_sheet_title_case_insensitive(sheet_titles, target_title):
-    """Return the sheet title matching target_title, case-insensitively."""
-    target_lower = target_title.lower()
-    return next((title for title in sheet_titles if title.lower() == target_lower), None)
+def queued_submission_writers():
+    """Writers used by the submission flusher: one append per sheet for the whole batch."""
+    service = get_sheets_service()
+
+    def write_data(records):
+        data_rows = [row for record in records for row in record['rows']['data']]
+        sheets_storage.append_sessions(data_rows)
+
+        # The rows are already committed to the Data sheet, so a leaderboard failure must not fail the batch
+        try:
+            for row in data_rows:
+                record_session(row)
+            if leaderboard_index.loaded:
+                for record in records:
+                    entry = record['meta'].get('leaderboard_entry')
+                    if entry:
+                        add_leaderboard_entry(entry)
+            update_leaderboard(service)
+        except Exception as e:
+            safe_log('error', f"Error updating leaderboard after flush: {str(e)}")
+
+    def write_trials(records):
+        sheets_storage.append_trials([row for record in records for row in record['rows']['trials']])
+
+    return {'data': write_data, 'trials': write_trials}
+
+
+# The queue feeds Google Sheets in the background: write-behind mode, or replication of the local store
+if SUBMISSION_WRITE_BEHIND or (storage_backend.is_local and SHEETS_REPLICA):
+    submission_queue = SubmissionQueue(SUBMISSION_QUEUE_PATH)
+    submission_flusher = SubmissionFlusher(
+        submission_queue,
+        queued_submission_writers,
+        interval_seconds=SUBMISSION_FLUSH_INTERVAL_SECONDS
+    )
+    # Start flushing right away so submissions queued before a restart are not left behind
+    submission_flusher.ensure_started()
+else:
+    submission_queue = None
+    submission_flusher = None
+
+# Completed and in-flight submissions by idempotency key, shared by all workers
+if SUBMIT_IDEMPOTENCY:
+    submission_idempotency = IdempotencyStore(
+        SUBMIT_IDEMPOTENCY_PATH,
+        ttl_seconds=SUBMIT_IDEMPOTENCY_TTL_SECONDS,
+        max_entries=SUBMIT_IDEMPOTENCY_MAX_ENTRIES
+    )
+else:
+    submission_idempotency = None
+
+# Cold start: building the Sheets client, reconciling the headers, loading the indexes and importing
+# numpy happen once per worker in the background instead of inside the first player's request
+warmup_state = {
+    'status': 'pending' if WARMUP_ENABLED else 'disabled',
+    'pid': None,
+    'import_seconds': None,
+    'seconds': None,
+    'steps': {},
+    'errors': {}
+}
+warmup_lock = threading.Lock()
+
+
+def sheets_configured():
+    return sheets_fake is not None or "GOOGLE_SHEET_CREDENTIALS" in os.environ
+
+
+def warm_up():
+    """Do this worker's expensive first-use work now; a failed step is simply done again lazily by requests."""
+    started = time.perf_counter()
+
+    def step(name, function):
+        step_started = time.perf_counter()
+        try:
+            function()
+        except Exception as e:
+            warmup_state['errors'][name] = str(e)
+            metrics_registry.inc("pontifex_warmup_errors_total", step=name)
+            safe_log('error', f"Warm-up step {name} failed: {str(e)}")
+        finally:
+            warmup_state['steps'][name] = round(time.perf_counter() - step_started, 4)
+
+    def import_metrics_engine():
+        import metrics_engine
+
+    step('metrics_engine', import_metrics_engine)
+    if sheets_configured():
+        step('sheets_client', lambda: reconcile_sheet_headers(get_sheets_service()))
+    if storage_backend.is_local or sheets_configured():
+        step('leaderboard', current_leaderboard_snapshot)
+    step('positions', position_pools.ensure_started)
+    step('templates', lambda: app.jinja_env.get_template('index.html'))
+    if asset_pipeline is not None:
+        step('assets', asset_pipeline.manifest)
+
+    warmup_state['seconds'] = round(time.perf_counter() - started, 4)
+    warmup_state['status'] = 'degraded' if warmup_state['errors'] else 'ready'
+    safe_log('info', f"Warm-up {warmup_state['status']} in {warmup_state['seconds']:.3f}s: {warmup_state['steps']}")
+
+
+def start_warm_up():
+    """Start warm_up in a background thread, once per process (fork-safe)."""
+    if not WARMUP_ENABLED or warmup_state['pid'] == os.getpid():
+        return
+    with warmup_lock:
+        if warmup_state['pid'] == os.getpid():
+            return
+        warmup_state.update(status='running', pid=os.getpid(), seconds=None, steps={}, errors={})
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+def startup_phase_seconds():
+    phases = dict(warmup_state['steps'])
+    if warmup_state['import_seconds'] is not None:
+        phases['import'] = warmup_state['import_seconds']
+    return {(('phase', phase),): seconds for phase, seconds in phases.items()}
+
+# Queue depths, read whenever a worker writes its metrics
+metrics_registry.gauge(
+    "pontifex_submission_queue_depth",
+    "Submissions waiting to be written to Google Sheets.",
+    lambda: submission_queue.depth() if submission_queue is not None else None
+)
+metrics_registry.gauge(
+    "pontifex_sheets_queue_depth",
+    "Sheets requests of this worker waiting for a read or write quota token.",
+    lambda: {(('bucket', name),): depth for name, depth in sheets_scheduler.queue_depths().items()} if sheets_scheduler is not None else None
+)
+metrics_registry.gauge(
+    "pontifex_startup_seconds",
+    "Seconds this worker spent importing the app and in each warm-up step.",
+    lambda: startup_phase_seconds()
+)
+metrics_registry.gauge(
+    "pontifex_leaderboard_stream_clients",
+    "Open /leaderboard/stream connections of this worker.",
+    lambda: leaderboard_hub.subscriber_count() if leaderboard_hub is not None else None
+)
+metrics_registry.gauge(
+    "pontifex_position_pool_size",
+    "Pre-generated chess positions ready to serve, by difficulty.",
+    lambda: {(('difficulty', difficulty),): size for difficulty, size in position_pools.sizes().items()}
+)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics_registry.inc("pontifex_http_requests_total", route=route, method=request.method, status=response.status_code)
+        metrics_registry.observe("pontifex_http_request_duration_seconds", time.perf_counter() - started, route=route, method=request.method)
+        if response.status_code >= 500:
+            metrics_registry.inc("pontifex_http_errors_total", route=route)
+    return response
+
+
+# cProfile or stack samples of single requests, stored on disk for the admin endpoints below
+request_profiler = RequestProfiler(
+    PROFILER_DIRECTORY,
+    max_profiles=PROFILER_MAX_PROFILES,
+    sample_rate=PROFILER_SAMPLE_RATE,
+    admin_token=PROFILER_ADMIN_TOKEN,
+    default_mode=PROFILER_MODE
+)
+
+
+def start_request_profile():
+    # Browsing the profiles must not evict them
+    if request.path.startswith('/admin/profiles'):
+        return
+    mode = request_profiler.requested_mode(request.headers)
+    if mode is not None:
+        g.request_profile = request_profiler.start(mode)
+
+
+def finish_request_profile(response):
+    capture = g.pop('request_profile', None)
+    if capture is not None:
+        try:
+            profile_id = request_profiler.finish(capture, {
+                'method': request.method,
+                'path': request.path,
+                'route': request.url_rule.rule if request.url_rule is not None else None,
+                'status': response.status_code
+            })
+            response.headers['X-Profile-Id'] = profile_id
+        except Exception as e:
+            safe_log('error', f"Error storing request profile: {str(e)}")
+    return response
+
+
+def stop_request_profile(error=None):
+    # Requests that failed before after_request still have their profiler running
+    capture = g.pop('request_profile', None)
+    if capture is not None:
+        request_profiler.stop(capture)
+
+
+if request_profiler.enabled:
+    app.before_request(start_request_profile)
+    app.after_request(finish_request_profile)
+    app.teardown_request(stop_request_profile)
+
+
+def profiler_admin_authorized():
+    # Header only: a token in the query string ends up in access logs, proxies and browser history
+    return request_profiler.is_admin(request.headers.get('X-Profile-Token'))
+
+
+@app.route('/admin/profiles')
+def list_request_profiles():
+    if not profiler_admin_authorized():
+        return jsonify({"success": False, "message": "Not found"}), 404
+    return jsonify({"success": True, "profiles": request_profiler.list_profiles()})
+
+
+@app.route('/admin/profiles/<profile_id>')
+def download_request_profile(profile_id):
+    """The raw .pstats or .collapsed file; ?format=text renders a cProfile capture as a pstats report."""
+    if not profiler_admin_authorized():
+        return jsonify({"success": False, "message": "Not found"}), 404
+    found = request_profiler.profile_path(profile_id)
+    if found is None:
+        return jsonify({"success": False, "message": "Unknown profile"}), 404
+    path, profile_format = found
+
+    if request.args.get('format') == 'text' and profile_format == 'pstats':
+        sort = request.args.get('sort', 'cumulative')
+        if sort not in pstats.Stats.sort_arg_dict_default:
+            sort = 'cumulative'
+        report = io.StringIO()
+        pstats.Stats(path, stream=report).sort_stats(sort).print_stats(request.args.get('limit', 60, type=int))
+        return report.getvalue(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+    mimetype = 'text/plain' if profile_format == 'collapsed' else 'application/octet-stream'
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=os.path.basename(path))
+
+
+def admin_authorized():
+    token = request.headers.get('X-Admin-Token')
+    return bool(ADMIN_TOKEN and token and hmac.compare_digest(token, ADMIN_TOKEN))
+
+
+@app.route('/admin/cache')
+def shared_cache_stats():
+    """Hit and miss counts of every shared cache key, over all workers."""
+    if not admin_authorized():
+        return jsonify({"success": False, "message": "Not found"}), 404
+    if shared_cache is None:
+        return jsonify({"success": False, "message": "The shared cache is disabled"}), 404
+    return jsonify({"success": True, "entries": shared_cache.size(), "keys": shared_cache.stats()})
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return metrics_registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/assets/<path:filename>')
+def hashed_asset(filename):
+    """A fingerprinted asset, brotli or gzip encoded when the client accepts it, cacheable forever."""
+    if asset_pipeline is None:
+        return jsonify({"success": False, "message": "Asset pipeline is disabled"}), 404
+    resolved = asset_pipeline.resolve(filename, request.headers.get('Accept-Encoding'))
+    if resolved is None:
+        return jsonify({"success": False, "message": "Unknown asset"}), 404
+
+    path, encoding, mimetype = resolved
+    response = send_file(path, mimetype=mimetype, conditional=True, etag=filename + (f".{encoding}" if encoding else ""))
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
+
 #health check
 @app.route('/health')
 def health():
-    return "OK", 200
+    """Liveness plus this worker's warm-up progress; ?ready=1 answers 503 until the warm-up finished."""
+    start_warm_up()
+    ready = warmup_state['status'] in ('ready', 'degraded', 'disabled')
+    body = {"success": True, "ready": ready, "pid": os.getpid(), "warmup": {
+        key: warmup_state[key] for key in ('status', 'import_seconds', 'seconds', 'steps', 'errors')
+    }}
+    if not ready and request.args.get('ready', '').lower() in ("1", "true", "yes"):
+        return jsonify(body), 503
+    return jsonify(body), 200
 
 #add a ping return
 @app.route("/ping")
 def ping():
+    start_warm_up()
     return "pong", 200
 
+@app.route('/fake-sheets/stats')
+def fake_sheets_stats():
+    """Calls and injected errors of the offline Sheets stand-in; ?reset=1 starts counting afresh."""
+    if sheets_fake is None:
+        return jsonify({"success": False, "message": "The offline Sheets stand-in is not enabled"}), 404
+    stats = sheets_fake.stats()
+    if request.args.get('reset', '').lower() in ("1", "true", "yes"):
+        sheets_fake.reset_stats()
+    return jsonify({"success": True, "mode": SHEETS_FAKE, **stats})
+
+def leaderboard_slice_args():
+    """(difficulty, offset, limit) of a leaderboard request, or an error message."""
+    difficulty = request.args.get('difficulty', '').lower()
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', type=int)
+    if difficulty and difficulty not in ('easy', 'medium', 'hard'):
+        return None, "Unknown difficulty"
+    if offset < 0 or (limit is not None and limit < 0):
+        return None, "Invalid offset or limit"
+    return (difficulty, offset, limit), None
+
+
+def leaderboard_slice(formatted_data, difficulty, offset=0, limit=None):
+    """The requested part of a formatted leaderboard, with the full length of each difficulty."""
+    difficulties = [difficulty] if difficulty else list(formatted_data)
+    end = offset + limit if limit is not None else None
+    return {
+        "leaderboard": {key: formatted_data[key][offset:end] for key in difficulties},
+        "total": {key: len(formatted_data[key]) for key in difficulties}
+    }
+
+
 @app.route('/get_leaderboard')
 def get_leaderboard():
     try:
         safe_log('info', "Fetching leaderboard data...")
-        
-        # Create service
-        service = get_sheets_service()
-        
-        # Resolve leaderboard sheet name case-insensitively
-        spreadsheet = service.spreadsheets().get(spreadsheetId=SHEET_ID).execute()
-        sheet_titles = [s['properties']['title'] for s in spreadsheet['sheets']]
-        leaderboard_sheet_name = get_sheet_title_case_insensitive(sheet_titles, "Leaderboard")
-
-        if not leaderboard_sheet_name:
-            safe_log('warning', "Leaderboard sheet not found")
-            return jsonify({"success": True, "leaderboard": {"easy": [], "medium": [], "hard": []}})
-
-        # Get leaderboard data
-        result = service.spreadsheets().values().get(
-            spreadsheetId=SHEET_ID,
-            range=f"{leaderboard_sheet_name}!A1:O1000"
-        ).execute()
-        
-        leaderboard_data = result.get('values', [])        
-        # Format the data for frontend display
-        formatted_data = format_leaderboard_data(leaderboard_data)
 
-        response = jsonify({"success": True, "leaderboard": formatted_data})
-        return response
+        slice_args, message = leaderboard_slice_args()
+        if slice_args is None:
+            return jsonify({"success": False, "message": message}), 400
+
+        # Leaderboard from the storage backend (in-memory index for Sheets, direct query for the local store)
+        formatted_data = current_leaderboard_snapshot()
+
+        # Only the requested slice is sent
+        response = jsonify({"success": True, **leaderboard_slice(formatted_data, *slice_args)})
+
+        # Strong ETag over the exact body: unchanged boards are answered with 304 Not Modified
+        response.set_etag(hashlib.sha256(response.get_data()).hexdigest())
+        response.cache_control.public = True
+        response.cache_control.max_age = LEADERBOARD_CACHE_MAX_AGE_SECONDS
+        response.cache_control.must_revalidate = True
+        return response.make_conditional(request)
     
     except Exception as e:
+        sheets_client_pool.report_error(e)
+        sheet_metadata_cache.invalidate()
         safe_log('error', f"Error fetching leaderboard: {str(e)}")
         return jsonify({"success": False, "message": f"Error fetching leaderboard data: {str(e)}"})
 
+@app.route('/leaderboard/stream')
+def leaderboard_stream():
+    """Server-Sent Events: a "snapshot" of the leaderboard, then a "delta" per ranking change.
+
+    Takes the difficulty and limit parameters of /get_leaderboard. Deltas of other difficulties
+    are not sent; a delta moving an entry out of the top limit is replaced by a new snapshot,
+    since the client does not have the entry that moves up.
+    """
+    if leaderboard_hub is None:
+        return jsonify({"success": False, "message": "Leaderboard streaming is disabled"}), 404
+    slice_args, message = leaderboard_slice_args()
+    if slice_args is None:
+        return jsonify({"success": False, "message": message}), 400
+    difficulty, _, limit = slice_args
+    if leaderboard_hub.subscriber_count() >= LEADERBOARD_STREAM_MAX_CLIENTS:
+        response = jsonify({"success": False, "message": "Too many leaderboard streams, try again later"})
+        response.headers["Retry-After"] = "30"
+        return response, 503
+
+    def snapshot():
+        return leaderboard_slice(current_leaderboard_snapshot(), difficulty, limit=limit)
+
+    def select(event):
+        if event['type'] != 'delta':
+            return event
+        delta = event['data']
+        if difficulty and delta['difficulty'] != difficulty:
+            return None
+        previous_rank = delta.get('previous_rank')
+        if limit is not None and previous_rank is not None and previous_rank <= limit < delta['rank']:
+            return RESYNC
+        return event
+
+    response = app.response_class(
+        leaderboard_hub.stream(
+            snapshot,
+            last_event_id=request.headers.get('Last-Event-ID', type=int),
+            heartbeat_seconds=LEADERBOARD_STREAM_HEARTBEAT_SECONDS,
+            max_seconds=LEADERBOARD_STREAM_MAX_SECONDS,
+            select=select if difficulty or limit is not None else None
+        ),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    # Tells nginx-style proxies not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/positions')
+def get_positions():
+    difficulty = request.args.get('difficulty', 'Easy')
+    count = request.args.get('count', 50, type=int)
+    if difficulty not in DIFFICULTY_LEVELS:
+        return jsonify({"success": False, "message": "Unknown difficulty"}), 400
+    if not 1 <= count <= POSITION_BATCH_MAX:
+        return jsonify({"success": False, "message": f"count must be between 1 and {POSITION_BATCH_MAX}"}), 400
+
+    try:
+        positions = []
+        for position in position_pools.take(difficulty, count):
+            _, row, col = position['attackingPiece']
+            signature = position_signer.sign(position['fen'], trial_verifier.SQUARE_NAMES[row * 8 + col])
+            positions.append(dict(position, signature=signature))
+        return jsonify({"success": True, "difficulty": difficulty, "positions": positions})
+    except Exception as e:
+        safe_log('error', f"Error generating positions: {str(e)}")
+        return jsonify({"success": False, "message": "Error generating positions"}), 500
+
+@app.route('/player/<name>/history')
+def get_player_history(name):
+    try:
+        limit = request.args.get('limit', type=int)
+        # Shared by all workers until the player's next submission
+        namespace = player_cache_namespace(name)
+        key = f"{namespace}:history:{limit}"
+        summary = shared_cache_call('get', namespace, key)
+        if summary is None:
+            version = shared_cache_call('version', namespace)
+            summary = current_player_summary(name, limit=limit)
+            if summary is None:
+                return jsonify({"success": False, "message": "Player not found"}), 404
+            shared_cache_call('put', namespace, key, summary, version)
+        return jsonify({"success": True, "player": summary})
+
+    except Exception as e:
+        sheets_client_pool.report_error(e)
+        sheet_metadata_cache.invalidate()
+        safe_log('error', f"Error fetching player history: {str(e)}")
+        return jsonify({"success": False, "message": "Error fetching player history"}), 500
+
+@app.route('/leaderboard/percentile')
+def get_percentile():
+    try:
+        difficulty = request.args.get('difficulty', '').lower()
+        ies = request.args.get('ies', type=float)
+        name = request.args.get('name')
+        board_time = request.args.get('board_time')
+        duration = request.args.get('duration')
+        if difficulty not in ('easy', 'medium', 'hard') or (ies is None and not name):
+            return jsonify({"success": False, "message": "difficulty and either ies or name are required"}), 400
+
+        # Loads the score distribution along with the player history
+        current_player_history()
+        if ies is None:
+            # A player's best session at this difficulty
+            summary = current_player_summary(name, limit=1)
+            aggregates = summary and summary['difficulties'].get(difficulty)
+            if not aggregates:
+                return jsonify({"success": False, "message": "Player not found"}), 404
+            ies = aggregates['best_ies']
+
+        percentile = score_distribution.percentile_rank(ies, difficulty, board_time, duration)
+        if percentile is None:
+            return jsonify({"success": False, "message": "No sessions recorded for these settings"}), 404
+        return jsonify({"success": True, "ies": ies, **percentile})
+
+    except Exception as e:
+        sheets_client_pool.report_error(e)
+        sheet_metadata_cache.invalidate()
+        safe_log('error', f"Error computing percentile: {str(e)}")
+        return jsonify({"success": False, "message": "Error computing percentile"}), 500
+
+@app.route('/analytics/trials')
+def get_trial_analytics():
+    """Accuracy, median RT, IES and lapse rate of the stored trials grouped by condition.
+
+    group_by: comma-separated dimensions, at least one (difficulty, piece, piece_type, attacked). Any
+    dimension given as a parameter (difficulty=hard) filters the trials. baseline=difficulty:easy
+    compares each group with its easy counterpart rather than with all trials.
+    """
+    try:
+        group_by = [name.strip() for name in request.args.get('group_by', 'difficulty').split(',') if name.strip()]
+        where = {dimension: parse_label(dimension, request.args[dimension]) for dimension in TRIAL_DIMENSIONS if dimension in request.args}
+        baseline = None
+        if request.args.get('baseline'):
+            dimension, _, label = request.args['baseline'].partition(':')
+            baseline = (dimension, parse_label(dimension, label))
+        check_query(group_by, where, baseline)
+    except AnalyticsQueryError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    key = "analytics:" + json.dumps([group_by, sorted(where.items()), baseline], separators=(',', ':'))
+    result = shared_cache_call('get', ANALYTICS_SHARED_NAMESPACE, key)
+    if result is None:
+        try:
+            table = trial_analytics.table()
+        except Exception as e:
+            # Only reading the trials touches storage; a failure there may be a changed sheet layout
+            sheets_client_pool.report_error(e)
+            sheet_metadata_cache.invalidate()
+            safe_log('error', f"Error loading trials for analytics: {str(e)}")
+            return jsonify({"success": False, "message": "Error computing trial analytics"}), 500
+
+        try:
+            with metrics_registry.timer("trial_analytics_query"):
+                result = table.query(group_by, where, baseline)
+        except Exception as e:
+            safe_log('error', f"Error computing trial analytics: {str(e)}")
+            return jsonify({"success": False, "message": "Error computing trial analytics"}), 500
+        shared_cache_call('put', ANALYTICS_SHARED_NAMESPACE, key, result, None, ANALYTICS_CACHE_SECONDS)
+    return jsonify({"success": True, **result})
+
+def submission_payload():
+    """JSON body of a /submit_results request, inflated first when sent with Content-Encoding: gzip."""
+    if request.headers.get('Content-Encoding', '').lower() != 'gzip':
+        return request.json
+    data = json.loads(decompress_body(request.get_data(cache=False), SUBMIT_MAX_INFLATED_BYTES))
+    if not isinstance(data, dict):
+        raise TrialPayloadError("expected a JSON object")
+    return data
+
+
 @app.route('/submit_results', methods=['POST'])
 def submit_results():
     try:
-        data = request.json
-        
+        data = submission_payload()
+    except (TrialPayloadError, ValueError) as e:
+        return jsonify({"success": False, "message": f"Invalid request body: {e}"}), 400
+    except Exception as e:
+        safe_log('error', f"Error reading submission: {str(e)}")
+        return jsonify({"success": False, "message": "Error submitting results"}), 500
+
+    if submission_idempotency is None:
+        return process_submission(data)
+
+    # A client key covers retries of a payload the client re-encoded; the payload hash covers clients without one
+    client_key = request.headers.get('Idempotency-Key', '').strip()
+    if len(client_key) > MAX_KEY_LENGTH:
+        return jsonify({"success": False, "message": f"Idempotency-Key is longer than {MAX_KEY_LENGTH} characters"}), 400
+    fingerprint = payload_fingerprint(data)
+    key = f"key:{client_key}" if client_key else f"payload:{fingerprint}"
+
+    try:
+        stored = submission_idempotency.claim(key, fingerprint)
+    except IdempotencyConflict:
+        metrics_registry.inc("pontifex_submission_duplicates_total", outcome="conflict")
+        return jsonify({"success": False, "message": "Idempotency-Key was already used for a different submission"}), 422
+    except Exception as e:
+        safe_log('error', f"Idempotency store unavailable, submitting without it: {str(e)}")
+        return process_submission(data)
+    if stored is not None:
+        metrics_registry.inc("pontifex_submission_duplicates_total", outcome="waited" if stored.waited else "replayed")
+        safe_log('info', "Answering a repeated submission with the stored response")
+        response = app.response_class(stored.body, status=stored.status, mimetype='application/json')
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+    try:
+        response = make_response(process_submission(data))
+    except BaseException:
+        submission_idempotency.release(key)
+        raise
+    # Failures are not stored: the retry runs again
+    try:
+        if response.status_code >= 500:
+            submission_idempotency.release(key)
+        else:
+            submission_idempotency.complete(key, response.status_code, response.get_data())
+    except Exception as e:
+        safe_log('error', f"Error storing the submission response for its idempotency key: {str(e)}")
+    return response
+
+
+def process_submission(data):
+    """Store a decoded submission and answer it (the part of /submit_results run once per idempotency key)."""
+    try:
         patient_name = data.get('patientName')
         trial_data = data.get('trialData')
+        # Compact alternative to trialData, see trial_payload.py
+        trial_columns = data.get('trialColumns')
         difficulty = data.get('difficulty')
         duration = data.get('duration')
         
@@ -681,14 +1614,36 @@ def submit_results():
             display_difficulty = "Easy"
 
         # Validate required fields
-        if not all([patient_name, trial_data, difficulty, board_display_time]):
+        if not all([patient_name, trial_data or trial_columns, difficulty, board_display_time]):
             safe_log('error', f"Missing required fields - boardDisplayTime: {board_display_time}")
             return jsonify({
                 "success": False,
                 "message": "Missing required fields"
             }), 400
 
-        metrics = calculate_session_metrics(trial_data, duration)
+        if trial_columns is not None:
+            try:
+                trial_columns = TrialColumns.decode(trial_columns)
+            except TrialPayloadError as e:
+                return jsonify({"success": False, "message": f"Invalid trialColumns: {e}"}), 400
+
+        # Replay every answer on the server; the metrics use the replayed success flags
+        with metrics_registry.timer("verify_trials"):
+            if trial_columns is not None:
+                verification = trial_columns.verify(position_signer)
+            else:
+                trial_data, verification = trial_verifier.verify_trials(trial_data, position_signer)
+        if verification['mismatches']:
+            safe_log('warning', f"{verification['mismatches']} of {verification['verified']} verified trials disagreed with the client's success flag")
+
+        # Columnar sessions are scored from the decoded arrays (numpy is imported by the warm-up or on
+        # first use); trialData is scored by the reference, faster than numpy on a list of dicts
+        with metrics_registry.timer("calculate_session_metrics"):
+            if trial_columns is not None:
+                import metrics_engine
+                metrics = metrics_engine.compute_metrics(*trial_columns.metric_arrays(), duration)
+            else:
+                metrics = calculate_session_metrics(trial_data, duration)
         if not metrics:
             return jsonify({
                 "success": False,
@@ -701,7 +1656,6 @@ def submit_results():
         ies3 = metrics['ies3']
         focus_drift = metrics['focus_drift']
         focus_stability = metrics['focus_stability']
-        extra_metrics = metrics['extra_metrics']
         
         # Check if we have insufficient trials
         if overall_ies == 999999:
@@ -709,151 +1663,74 @@ def submit_results():
                 "success": False,
                 "message": "Insufficient trials: At least 5 successful trials are required",
                 "required": 5,
-                "successful": sum(1 for trial in trial_data if trial.get('success') == 1)
+                "successful": trial_columns.successful_trials() if trial_columns is not None else sum(1 for trial in trial_data if trial.get('success') == 1)
             }), 400
 
-        # Create service
-        service = get_sheets_service()
-        
-        # 1. Save data to single "Data" sheet (one row per submission)
+        # 1. Build the summary row for the "Data" sheet (one row per submission) and the per-trial rows
         current_date = datetime.now().strftime('%Y-%m-%d')
         current_time = datetime.now().strftime('%H:%M:%S')
-        
-        # Get spreadsheet to check for existing sheets
-        spreadsheet = service.spreadsheets().get(spreadsheetId=SHEET_ID).execute()
-        sheet_titles = [s['properties']['title'] for s in spreadsheet['sheets']]
-        
-        data_sheet_name = "Data"
-        trials_sheet_name = "Trials"
-        
-        # Create Data sheet if it doesn't exist
-        if data_sheet_name not in sheet_titles:
-            service.spreadsheets().batchUpdate(
-                spreadsheetId=SHEET_ID,
-                body={
-                    "requests": [{
-                        "addSheet": {
-                            "properties": {"title": data_sheet_name}
-                        }
-                    }]
-                }
-            ).execute()
-            ensure_sheet_header(service, data_sheet_name, DATA_SHEET_HEADERS)
-        else:
-            ensure_sheet_header(service, data_sheet_name, DATA_SHEET_HEADERS)
-        
-        # Create Trials sheet if it doesn't exist
-        if trials_sheet_name not in sheet_titles:
-            service.spreadsheets().batchUpdate(
-                spreadsheetId=SHEET_ID,
-                body={
-                    "requests": [{
-                        "addSheet": {
-                            "properties": {"title": trials_sheet_name}
-                        }
-                    }]
-                }
-            ).execute()
-            ensure_sheet_header(service, trials_sheet_name, TRIALS_SHEET_HEADERS)
+
+        data_row = build_data_row(
+            current_date, current_time, patient_name, display_difficulty, duration, board_display_time, metrics, verification,
+            session_id=uuid.uuid4().hex
+        )
+        if trial_columns is not None:
+            trial_rows = trial_columns.trial_rows(current_date, current_time, patient_name)
         else:
-            ensure_sheet_header(service, trials_sheet_name, TRIALS_SHEET_HEADERS)
+            trial_rows = build_trial_rows(current_date, current_time, patient_name, trial_data)
+        leaderboard_entry = {
+            'name': patient_name,
+            'difficulty': display_difficulty.lower(),
+            'ies': overall_ies,
+            'drift': focus_drift,
+            'stability': focus_stability,
+            'board_time': board_display_time
+        }
+
+        # Local store: the session is saved in milliseconds, before anything touches Google Sheets
+        if storage_backend.is_local:
+            storage_backend.append_session(data_row)
+            storage_backend.append_trials(trial_rows)
+
+        # Write-behind mode or Sheets replica: queue the rows durably and let the background flusher batch them
+        if submission_queue is not None:
+            submission_queue.enqueue({'data': [data_row], 'trials': trial_rows}, meta={'leaderboard_entry': leaderboard_entry})
+            submission_flusher.ensure_started()
+
+        if storage_backend.is_local or submission_queue is not None:
+            record_session(data_row)
+            response = {"success": True, "ies": overall_ies, "ies1": ies1, "ies2": ies2, "ies3": ies3, "focus_drift": focus_drift, "focus_stability": focus_stability, "verification": verification}
+            if submission_queue is not None:
+                response["queued"] = True
+
+            if storage_backend.is_local:
+                response["leaderboard"] = format_leaderboard_data(update_leaderboard(None, **current_leaderboard_kwargs(leaderboard_entry)))
+            elif leaderboard_index.loaded:
+                add_leaderboard_entry(leaderboard_entry)
+                response["leaderboard"] = format_leaderboard_data(leaderboard_index.to_sheet_rows())
+
+            # Served from the in-memory score distribution, never from an extra read
+            if player_history.loaded:
+                response["percentile"] = session_percentiles(overall_ies, leaderboard_entry['difficulty'], board_display_time, duration)
+            return jsonify(response)
+
+        # Create service
+        service = get_sheets_service()
         
         # 2. Append summary data row to Data sheet
-        data_row = [
-            current_date,
-            current_time,
-            patient_name,
-            display_difficulty,
-            duration,
-            board_display_time,
-            overall_ies,
-            ies1,
-            ies2,
-            ies3,
-            focus_drift,
-            focus_stability,
-            extra_metrics.get('overall_accuracy_pct', ''),
-            extra_metrics.get('overall_median_rt', ''),
-            extra_metrics.get('overall_rt_cv', ''),
-            extra_metrics.get('overall_lapse_rate_pct', ''),
-            extra_metrics.get('accuracy_first_pct', ''),
-            extra_metrics.get('accuracy_second_pct', ''),
-            extra_metrics.get('accuracy_third_pct', ''),
-            extra_metrics.get('median_rt_first', ''),
-            extra_metrics.get('median_rt_second', ''),
-            extra_metrics.get('median_rt_third', ''),
-            extra_metrics.get('rt_cv_first', ''),
-            extra_metrics.get('rt_cv_second', ''),
-            extra_metrics.get('rt_cv_third', ''),
-            extra_metrics.get('lapse_rate_first_pct', ''),
-            extra_metrics.get('lapse_rate_second_pct', ''),
-            extra_metrics.get('lapse_rate_third_pct', ''),
-            extra_metrics.get('rt_decrement_pct', ''),
-            extra_metrics.get('accuracy_decrement_pct', ''),
-            extra_metrics.get('ies_decrement_pct', ''),
-            extra_metrics.get('rt_slope', ''),
-            extra_metrics.get('success_slope', ''),
-            extra_metrics.get('ies_slope', ''),
-            extra_metrics.get('error_rate_slope', ''),
-            extra_metrics.get('post_error_rt_delta', ''),
-            extra_metrics.get('post_error_accuracy_delta_pp', ''),
-            extra_metrics.get('rt_success_correlation', '')
-        ]
-        
-        service.spreadsheets().values().append(
-            spreadsheetId=SHEET_ID,
-            range=f"{data_sheet_name}!A:A",
-            valueInputOption="RAW",
-            body={"values": [data_row]}
-        ).execute()
+        storage_backend.append_session(data_row)
         
         # 3. Append trial data rows to Trials sheet
-        trial_rows = []
-        for trial in trial_data:
-            trial_rows.append([
-                current_date,
-                current_time,
-                patient_name,
-                trial.get('trial', ''),
-                trial.get('trialTime', ''),
-                trial.get('attackingPiece', ''),
-                trial.get('attackingPosition', ''),
-                trial.get('attackedPieces', ''),
-                trial.get('responseTime', ''),
-                trial.get('success', ''),
-                trial.get('responsePosition', '')
-            ])
-        
-        if trial_rows:
-            service.spreadsheets().values().append(
-                spreadsheetId=SHEET_ID,
-                range=f"{trials_sheet_name}!A:A",
-                valueInputOption="RAW",
-                body={"values": trial_rows}
-            ).execute()
+        storage_backend.append_trials(trial_rows)
+        record_session(data_row)
 
         # 3. Update leaderboard with correct difficulty
-        update_leaderboard_result = update_leaderboard(
-            service,
-            current_user=patient_name,
-            current_difficulty=display_difficulty.lower(),
-            current_ies=overall_ies,
-            current_board_time=board_display_time,
-            current_drift=focus_drift,
-            current_stability=focus_stability
-        )
+        update_leaderboard_result = update_leaderboard(service, **current_leaderboard_kwargs(leaderboard_entry))
+        percentiles = session_percentiles(overall_ies, leaderboard_entry['difficulty'], board_display_time, duration)
         
-        # 4. Get the updated leaderboard data to return
+        # 4. Format the updated leaderboard data to return (no need to read the sheet back)
         try:
-            result = service.spreadsheets().values().get(
-                spreadsheetId=SHEET_ID,
-                range="Leaderboard!A1:O1000"
-            ).execute()
-            
-            leaderboard_data = result.get('values', [])
-            
-            # Format leaderboard data for response
-            formatted_leaderboard = format_leaderboard_data(leaderboard_data)
+            formatted_leaderboard = format_leaderboard_data(update_leaderboard_result)
             
             # Return the leaderboard data with the results
             return jsonify({
@@ -864,14 +1741,18 @@ def submit_results():
                 "ies3": ies3,
                 "focus_drift": focus_drift,
                 "focus_stability": focus_stability,
+                "percentile": percentiles,
+                "verification": verification,
                 "leaderboard": formatted_leaderboard  # Include the leaderboard directly in the response
             })
         except Exception as e:
             safe_log('error', f"Error getting updated leaderboard: {str(e)}")
             # Still return success for the submission, even if leaderboard fetch failed
-            return jsonify({"success": True, "ies": overall_ies, "ies1": ies1, "ies2": ies2, "ies3": ies3, "focus_drift": focus_drift, "focus_stability": focus_stability})
+            return jsonify({"success": True, "ies": overall_ies, "ies1": ies1, "ies2": ies2, "ies3": ies3, "focus_drift": focus_drift, "focus_stability": focus_stability, "percentile": percentiles, "verification": verification})
         
     except Exception as e:
+        sheets_client_pool.report_error(e)
+        sheet_metadata_cache.invalidate()
         safe_log('error', f"Error submitting results: {str(e)}")
         return jsonify({"success": False, "message": "Error submitting results"}), 500
         
@@ -928,6 +1809,39 @@ def format_leaderboard_data(leaderboard_data):
     safe_log('info', f"Formatted leaderboard entries - Easy: {len(formatted_data['easy'])}, Medium: {len(formatted_data['medium'])}, Hard: {len(formatted_data['hard'])}")
     return formatted_data
 
+@app.cli.command("build-assets")
+def build_assets_command():
+    """Write the hashed and precompressed static assets (otherwise built by the first worker that needs them)."""
+    if asset_pipeline is None:
+        raise click.ClickException("ASSET_PIPELINE is disabled")
+    manifest = asset_pipeline.build()
+    for name, hashed_path in manifest.items():
+        click.echo(f"{name} -> {hashed_path}")
+
+
+@app.cli.command("backfill-metrics")
+@click.option("--source", type=click.Choice(["storage", "sheets"]), default="storage", help="Recompute from the configured storage backend or directly from the Google Sheet.")
+@click.option("--page-size", default=DEFAULT_PAGE_SIZE, show_default=True, help="Trial rows read per page.")
+@click.option("--workers", default=None, type=int, help="Worker processes (defaults to the CPU count).")
+@click.option("--checkpoint", "checkpoint_path", default=os.path.join(app.instance_path, "backfill_checkpoint.json"), show_default=True)
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint and start from the first trial.")
+@click.option("--dry-run", is_flag=True, help="Recompute and report without writing anything.")
+def backfill_metrics_command(source, page_size, workers, checkpoint_path, restart, dry_run):
+    """Recompute the metric columns of every stored session from its trials."""
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+    storage = sheets_storage if source == "sheets" else storage_backend
+    backfill = MetricsBackfill(storage, checkpoint_path, page_size=page_size, workers=workers, dry_run=dry_run)
+    result = backfill.run(restart=restart)
+    click.echo(
+        f"Recomputed {result['sessions']} sessions, corrected {result['updated']} rows "
+        f"in {result['seconds']:.1f}s ({result['sessions_per_second']:.1f} sessions/s)"
+    )
+
+# Import time of this worker, logged and exported as pontifex_startup_seconds{phase="import"}
+warmup_state['import_seconds'] = round(time.perf_counter() - IMPORT_STARTED, 4)
+safe_log('info', f"App imported in {warmup_state['import_seconds']:.3f}s")
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
+    start_warm_up()
     app.run(host='0.0.0.0', port=port, debug=False)
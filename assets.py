@@ -0,0 +1,136 @@
+"""Fingerprinted, precompressed static assets.
+
+The pipeline copies every asset to the output directory under a content-hashed name
+(js/game.3f2a9c01b4d7.js), next to gzip (.gz) and, when the brotli package is installed,
+brotli (.br) variants, and records the names in manifest.json. The twelve piece SVGs are
+bundled into one JSON file (pieces.json: {"wK": "<svg ...>", ...}) so the game
+loads them with a single request. Since a hashed name never changes content, responses
+can be cached forever.
+
+Building is cheap when nothing changed: files whose hashed name already exists are not
+compressed again, so every worker can build at startup. `flask build-assets` builds ahead.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PIECE_CODES = ('bP', 'bN', 'bB', 'bR', 'bQ', 'bK', 'wP', 'wN', 'wB', 'wR', 'wQ', 'wK')
+SOURCE_FILES = ('css/style.css', 'js/chess.js', 'js/game.js')
+PIECES_BUNDLE = 'pieces.json'
+MANIFEST_FILE = 'manifest.json'
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Smaller files do not get any smaller compressed
+MIN_COMPRESS_BYTES = 256
+
+
+def _write_atomic(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def hashed_name(name, content):
+    root, extension = os.path.splitext(name)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:12]}{extension}"
+
+
+def accepted_encodings(accept_encoding):
+    """Content codings an Accept-Encoding header allows (q > 0)."""
+    accepted = set()
+    for token in (accept_encoding or '').split(','):
+        coding, _, parameters = token.partition(';')
+        quality = 1.0
+        parameters = parameters.strip().replace(' ', '')
+        if parameters.startswith('q='):
+            try:
+                quality = float(parameters[2:])
+            except ValueError:
+                quality = 0.0
+        if coding.strip() and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class AssetPipeline:
+    def __init__(self, static_folder, output_folder, source_files=SOURCE_FILES):
+        self.static_folder = static_folder
+        self.output_folder = output_folder
+        self.source_files = tuple(source_files)
+        self._lock = threading.Lock()
+        self._manifest = None
+
+    def sources(self):
+        """{logical name: content} of every asset, the piece bundle included."""
+        sources = {}
+        for name in self.source_files:
+            with open(os.path.join(self.static_folder, name), 'rb') as f:
+                sources[name] = f.read()
+
+        pieces = {}
+        for piece in PIECE_CODES:
+            with open(os.path.join(self.static_folder, 'assets', f"{piece}.svg"), encoding='utf-8') as f:
+                pieces[piece] = f.read().strip()
+        sources[PIECES_BUNDLE] = json.dumps(pieces, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        return sources
+
+    def build(self):
+        """Write the hashed and compressed files plus manifest.json; returns the manifest."""
+        manifest = {}
+        written = 0
+        for name, content in self.sources().items():
+            output_name = hashed_name(name, content)
+            manifest[name] = output_name
+            path = os.path.join(self.output_folder, output_name)
+            if os.path.exists(path):
+                continue
+
+            if len(content) >= MIN_COMPRESS_BYTES:
+                _write_atomic(f"{path}.gz", gzip.compress(content, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    _write_atomic(f"{path}.br", brotli.compress(content, quality=11))
+            # The uncompressed file goes last: its existence means the variants are complete
+            _write_atomic(path, content)
+            written += 1
+
+        _write_atomic(os.path.join(self.output_folder, MANIFEST_FILE), json.dumps(manifest, indent=2).encode('utf-8'))
+        if written:
+            logging.info(f"Built {written} static assets into {self.output_folder}")
+        return manifest
+
+    def manifest(self):
+        """Logical name -> hashed name, building the assets on first use in this process."""
+        if self._manifest is None:
+            with self._lock:
+                if self._manifest is None:
+                    self._manifest = self.build()
+        return self._manifest
+
+    def url_path(self, name):
+        """Hashed path of a logical asset name, or None when it is not part of the pipeline."""
+        return self.manifest().get(name)
+
+    def resolve(self, hashed_path, accept_encoding):
+        """(file path, content encoding or None, mimetype) of a hashed asset for a request, or None.
+
+        Only names listed in the manifest are served, so nothing else in the directory leaks out.
+        """
+        if hashed_path not in self.manifest().values():
+            return None
+        path = os.path.join(self.output_folder, hashed_path)
+        mimetype = mimetypes.guess_type(hashed_path)[0] or 'application/octet-stream'
+        accepted = accepted_encodings(accept_encoding)
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if encoding in accepted and os.path.exists(path + suffix):
+                return path + suffix, encoding, mimetype
+        return path, None, mimetype
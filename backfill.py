@@ -0,0 +1,226 @@
+"""Recompute session metrics for every stored session from its trials.
+
+Used when the metric definitions in FOCUS_METRICS_README.md change, or to fill the extra
+metric columns of sessions recorded before the 38-column layout. Trials are streamed page
+by page, grouped by (Date, Time, Patient Name), recomputed on a process pool with the
+batch metrics engine and written back in large batched updates. Progress is checkpointed
+after every page so an interrupted run resumes where it stopped.
+"""
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from leaderboard import parse_float
+
+DEFAULT_PAGE_SIZE = 20000
+DEFAULT_CHUNK_SIZE = 250
+DEFAULT_WRITE_BATCH_SIZE = 500
+
+# Trials row columns: Date, Time, Patient Name, Trial, Trial Time, Attacking Piece,
+# Attacking Position, Attacked Pieces, Response Time, Success, Response Position
+TRIAL_NUMBER_COLUMN = 3
+TRIAL_TIME_COLUMN = 4
+RESPONSE_TIME_COLUMN = 8
+SUCCESS_COLUMN = 9
+
+# Data row columns kept as-is; metrics start at 'Overall IES Score'
+SESSION_INFO_COLUMNS = 6
+DURATION_COLUMN = 4
+
+
+def session_key(row):
+    return tuple(str(value).strip() for value in (list(row) + ["", "", ""])[:3])
+
+
+def key_text(key):
+    return json.dumps(list(key))
+
+
+def trial_payload(row):
+    """Rebuild the trialData fields used by the metrics from a Trials row."""
+    padded = list(row) + [""] * max(0, SUCCESS_COLUMN + 1 - len(row))
+    success = padded[SUCCESS_COLUMN]
+    if isinstance(success, float) and success.is_integer():
+        success = int(success)
+    return {
+        'trialTime': padded[TRIAL_TIME_COLUMN],
+        'responseTime': padded[RESPONSE_TIME_COLUMN],
+        'success': success
+    }
+
+
+def compute_chunk(sessions):
+    """Process pool entry point: metrics table rows for [(trial_data, duration), ...]."""
+    # Imported here so that importing this module (as app does) does not import numpy
+    import metrics_engine
+
+    results = metrics_engine.calculate_batch_metrics(*metrics_engine.sessions_to_ragged(sessions))
+    return [None if metrics is None else row for metrics, row in zip(results, metrics_engine.metrics_table(results))]
+
+
+def cells_equal(old_value, new_value):
+    old_number = parse_float(old_value, None)
+    new_number = parse_float(new_value, None)
+    if old_number is not None and new_number is not None:
+        return old_number == new_number
+    return str(old_value) == str(new_value)
+
+
+def load_checkpoint(path):
+    try:
+        with open(path) as checkpoint_file:
+            return json.load(checkpoint_file)
+    except (FileNotFoundError, ValueError):
+        return {'position': 0, 'sessions': 0, 'updated': 0}
+
+
+def save_checkpoint(path, checkpoint):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(temp_path, path)
+
+
+class MetricsBackfill:
+    def __init__(self, storage, checkpoint_path, page_size=DEFAULT_PAGE_SIZE, workers=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, write_batch_size=DEFAULT_WRITE_BATCH_SIZE, dry_run=False):
+        self.storage = storage
+        self.checkpoint_path = checkpoint_path
+        self.page_size = page_size
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.write_batch_size = write_batch_size
+        self.dry_run = dry_run
+        import metrics_engine
+
+        # Columns after the metrics (such as the answer mismatch rate) are kept as stored
+        self.metric_columns = min(
+            len(storage.data_headers) - SESSION_INFO_COLUMNS,
+            len(metrics_engine.SUMMARY_METRIC_KEYS) + len(metrics_engine.EXTRA_METRIC_KEYS)
+        )
+
+    def run(self, restart=False):
+        checkpoint = {'position': 0, 'sessions': 0, 'updated': 0} if restart else load_checkpoint(self.checkpoint_path)
+
+        # Sessions sharing a (Date, Time, Patient Name) key are matched to trial groups in order
+        sessions_by_key = {}
+        for session_ref, row in self.storage.read_sessions():
+            sessions_by_key.setdefault(session_key(row), []).append((session_ref, row))
+        consumed = checkpoint.setdefault('consumed', {})
+        for text, count in consumed.items():
+            key = tuple(json.loads(text))
+            sessions_by_key[key] = sessions_by_key.get(key, [])[count:]
+
+        logging.info(f"Backfill starting at trial position {checkpoint['position']} with {len(sessions_by_key)} stored sessions")
+
+        started = time.perf_counter()
+        processed = 0
+        position = checkpoint['position']
+        pending = []
+        executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+
+        try:
+            while True:
+                page = self.storage.read_trials_page(position, self.page_size)
+                last_page = len(page) < self.page_size
+                pending.extend(page)
+                if page:
+                    position = page[-1][0] + 1
+
+                groups = self._group_trials(pending)
+                if groups and not last_page:
+                    # The last session may continue on the next page
+                    carried = groups.pop()
+                    pending = carried
+                else:
+                    pending = []
+
+                page_sessions, page_updates = self._process_groups(groups, sessions_by_key, consumed, executor)
+                if not self.dry_run:
+                    for start in range(0, len(page_updates), self.write_batch_size):
+                        self.storage.update_sessions(page_updates[start:start + self.write_batch_size])
+
+                processed += page_sessions
+                checkpoint['position'] = pending[0][0] if pending else position
+                checkpoint['sessions'] += page_sessions
+                checkpoint['updated'] += len(page_updates)
+                if not self.dry_run:
+                    save_checkpoint(self.checkpoint_path, checkpoint)
+
+                elapsed = time.perf_counter() - started
+                rate = processed / elapsed if elapsed > 0 else 0
+                logging.info(
+                    f"Backfill: {checkpoint['sessions']} sessions recomputed, {checkpoint['updated']} rows corrected "
+                    f"({rate:.1f} sessions/s)"
+                )
+
+                if last_page:
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        elapsed = time.perf_counter() - started
+        checkpoint['seconds'] = elapsed
+        checkpoint['sessions_per_second'] = processed / elapsed if elapsed > 0 else 0
+        return checkpoint
+
+    @staticmethod
+    def _group_trials(trials):
+        """Split consecutive (position, row) pairs into per-session groups.
+
+        A new session starts when the key changes or when the trial number stops increasing
+        (two sessions of the same player within the same second).
+        """
+        groups = []
+        current_key = None
+        previous_trial = None
+        for position, row in trials:
+            key = session_key(row)
+            trial_number = parse_float(row[TRIAL_NUMBER_COLUMN] if len(row) > TRIAL_NUMBER_COLUMN else None, None)
+            restarted = trial_number is not None and previous_trial is not None and trial_number <= previous_trial
+            if key != current_key or restarted:
+                groups.append([])
+                current_key = key
+            groups[-1].append((position, row))
+            previous_trial = trial_number
+        return groups
+
+    def _process_groups(self, groups, sessions_by_key, consumed, executor):
+        matched = []
+        for group in groups:
+            key = session_key(group[0][1])
+            candidates = sessions_by_key.get(key)
+            if not candidates:
+                continue
+            session_ref, data_row = candidates.pop(0)
+            if candidates or key_text(key) in consumed:
+                consumed[key_text(key)] = consumed.get(key_text(key), 0) + 1
+            duration = data_row[DURATION_COLUMN] if len(data_row) > DURATION_COLUMN else None
+            matched.append((session_ref, data_row, ([trial_payload(row) for _, row in group], duration)))
+
+        chunks = [
+            [session for _, _, session in matched[start:start + self.chunk_size]]
+            for start in range(0, len(matched), self.chunk_size)
+        ]
+        if executor is not None:
+            chunk_results = executor.map(compute_chunk, chunks)
+        else:
+            chunk_results = map(compute_chunk, chunks)
+        metric_rows = [row for chunk in chunk_results for row in chunk]
+
+        updates = []
+        for (session_ref, data_row, _), metric_row in zip(matched, metric_rows):
+            if metric_row is None:
+                continue
+            info = (list(data_row) + [""] * SESSION_INFO_COLUMNS)[:SESSION_INFO_COLUMNS]
+            trailing = list(data_row[SESSION_INFO_COLUMNS + self.metric_columns:])
+            new_row = info + metric_row[:self.metric_columns] + trailing
+            old_metrics = list(data_row[SESSION_INFO_COLUMNS:SESSION_INFO_COLUMNS + self.metric_columns])
+            old_metrics += [""] * (self.metric_columns - len(old_metrics))
+            if not all(cells_equal(old, new) for old, new in zip(old_metrics, metric_row)):
+                updates.append((session_ref, new_row))
+
+        return len(matched), updates
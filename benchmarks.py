@@ -0,0 +1,462 @@
+"""Benchmarks for the session metrics and payload formats, the leaderboard, /submit_results, trial analytics and the app's cold start.
+
+    python benchmarks.py                      # run everything, print and save the results
+    python benchmarks.py --save-baseline      # ...and make them the baseline
+    python benchmarks.py --sizes 1000,10000   # fewer historical rows
+
+Sessions are synthetic but follow the game: each trial shows the board for the mode's board
+display time, then waits for an answer, so the trial count grows with the duration, from the
+20 second sprint to the 360 second "Extended" session. The leaderboard and submit benchmarks
+run against the offline Sheets stand-in (SHEETS_FAKE) holding 1k, 10k and 100k historical
+Data rows; set SHEETS_FAKE_LATENCY_MS to include API latency. The analytics benchmark builds
+the columnar trial table from 100, 1k and 10k sessions' Trials rows and queries it. The startup benchmark imports
+the app and runs its warm-up in fresh interpreters, so heavy imports creeping back show up.
+
+Results are JSON keyed by benchmark name. When a baseline exists, every benchmark whose best
+round is more than --threshold slower than the baseline is reported and the exit status is 1
+(the best round is far less sensitive to a busy machine than the median).
+"""
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import click
+
+# Benchmarks never touch the real spreadsheet; these must be set before app is imported
+os.environ.setdefault("SHEETS_FAKE", "memory")
+os.environ.setdefault("POSITION_POOL_SIZE", "0")
+os.environ.setdefault("LEADERBOARD_INDEX_MAX_AGE_SECONDS", "0")
+# Per-minute quota waits would swamp the timings; set SHEETS_SCHEDULER=1 to include them
+os.environ.setdefault("SHEETS_SCHEDULER", "0")
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_THRESHOLD = 0.2
+# Sessions whose trials fill the analytics table (about 45 trials each)
+ANALYTICS_SESSION_COUNTS = (100, 1000, 10000)
+# Sessions per metrics_engine batch, as backfill scores them
+BATCH_SESSIONS = 500
+
+# Session lengths in seconds and how often each is played
+DURATION_OPTIONS = (20, 60, 120, 180, 240, 360)
+DURATION_WEIGHTS = (0.05, 0.25, 0.1, 0.45, 0.05, 0.1)
+
+# Game modes as in static/js/game.js: (difficulty sent by the browser, leaderboard difficulty, board display time)
+GAME_MODES = (
+    ('Medium', 'Easy', 5),
+    ('Hard', 'Medium', 3),
+    ('Very Hard', 'Hard', 1)
+)
+
+# Seconds between an answer and the next board
+FEEDBACK_SECONDS = 0.5
+SQUARE_NAMES = [f"{chr(97 + col)}{8 - row}" for row in range(8) for col in range(8)]
+
+
+class SessionGenerator:
+    """Synthetic sessions and Data rows with realistic trial counts, response times and accuracy."""
+
+    def __init__(self, seed=0, positions_per_difficulty=200, signer=None):
+        import positions
+
+        self.rng = random.Random(seed)
+        self.positions = {
+            difficulty: positions.generate_positions(difficulty, positions_per_difficulty, self.rng)
+            for difficulty, _, _ in GAME_MODES
+        }
+        # Sign the positions as /positions does, so the answers are replayed from their FEN
+        self.signer = signer
+
+    def duration(self):
+        return self.rng.choices(DURATION_OPTIONS, DURATION_WEIGHTS)[0]
+
+    def mode(self):
+        return self.rng.choice(GAME_MODES)
+
+    def trials(self, difficulty, board_time, duration):
+        """trialData as logged by ChessGame.logTrialData for one session."""
+        accuracy = self.rng.uniform(0.6, 0.95)
+        # Log-normal response times around 1-2 seconds, slower when the board was shown briefly
+        median_rt = self.rng.uniform(0.9, 1.6) + 0.1 * (5 - board_time)
+        trials = []
+        elapsed = 0.0
+        while elapsed < duration:
+            position = self.rng.choice(self.positions[difficulty])
+            piece, row, col = position['attackingPiece']
+            attacked = [SQUARE_NAMES[r * 8 + c] for r, c in position['attackedPieces']]
+            response_time = round(min(self.rng.lognormvariate(math.log(median_rt), 0.4), 10.0), 3)
+
+            # Accuracy fades slightly over the session
+            correct = self.rng.random() < accuracy - 0.1 * elapsed / duration
+            if correct:
+                response = attacked[0]
+            else:
+                response = self.rng.choice([name for name in SQUARE_NAMES if name not in attacked])
+
+            trials.append({
+                'trial': len(trials) + 1,
+                'trialTime': round(elapsed, 3),
+                'attackingPiece': piece,
+                'attackingPosition': SQUARE_NAMES[row * 8 + col],
+                'attackedPieces': ';'.join(attacked),
+                'responseTime': response_time,
+                'success': 1 if correct else 0,
+                'responsePosition': response,
+                'fen': position['fen'],
+                'positionSignature': self.signer.sign(position['fen'], SQUARE_NAMES[row * 8 + col]) if self.signer else None
+            })
+            elapsed += board_time + response_time + FEEDBACK_SECONDS
+        return trials
+
+    def submission(self, patient_name, duration=None):
+        """JSON body of a /submit_results request the app accepts (at least 5 successful trials)."""
+        while True:
+            difficulty, _, board_time = self.mode()
+            session_duration = duration or self.duration()
+            trials = self.trials(difficulty, board_time, session_duration)
+            if sum(trial['success'] for trial in trials) >= 5:
+                break
+        return {
+            'patientName': patient_name,
+            'difficulty': difficulty,
+            'duration': session_duration,
+            'boardDisplayTime': board_time,
+            'trialData': trials
+        }
+
+    def data_rows(self, count, column_count, players=None):
+        """Historical Data rows (summary columns filled, metric columns blank), oldest first."""
+        players = players or max(10, count // 8)
+        start = datetime(2025, 1, 1)
+        rows = []
+        for index in range(count):
+            _, display_difficulty, board_time = self.mode()
+            played_at = start + timedelta(minutes=index * 5)
+            ies = round(self.rng.lognormvariate(math.log(2.5), 0.35), 2)
+            thirds = [round(ies * self.rng.uniform(0.8, 1.25), 2) for _ in range(3)]
+            row = [
+                played_at.strftime('%Y-%m-%d'), played_at.strftime('%H:%M:%S'),
+                f"Player {self.rng.randrange(players)}", display_difficulty, self.duration(), board_time,
+                ies, *thirds, round(thirds[2] - thirds[0], 2), round(self.rng.uniform(40, 100), 1)
+            ]
+            rows.append(row + [""] * (column_count - len(row)))
+        return rows
+
+
+def measure(function, repeat, number=1):
+    """Median and best time per call in milliseconds over repeat rounds of number calls."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - started) / number)
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 4),
+        'min_ms': round(min(timings) * 1000, 4),
+        'repeat': repeat,
+        'number': number
+    }
+
+
+def load_app():
+    import logging
+
+    import app
+
+    if app.sheets_fake is None:
+        raise click.UsageError("Benchmarks write thousands of rows; run them with SHEETS_FAKE=memory or SHEETS_FAKE=file.")
+    # Request logging would dominate the timings
+    logging.getLogger().setLevel(logging.WARNING)
+    return app
+
+
+def seed_sheets(app, generator, row_count):
+    """Replace the Data sheet of the stand-in with row_count historical sessions."""
+    service = app.get_sheets_service()
+    app.sheets_storage.reconcile_headers(service)
+    values = service.spreadsheets().values()
+    values.clear(spreadsheetId=app.SHEET_ID, range="Data!A2:ZZ").execute()
+    values.clear(spreadsheetId=app.SHEET_ID, range="Trials!A2:ZZ").execute()
+    rows = generator.data_rows(row_count, len(app.DATA_SHEET_HEADERS))
+    values.append(
+        spreadsheetId=app.SHEET_ID, range="Data!A1", valueInputOption="RAW", insertDataOption="INSERT_ROWS",
+        body={"values": rows}
+    ).execute()
+    return service
+
+
+def bench_metrics(app, generator, repeat):
+    import metrics_engine
+
+    results = {}
+    for duration in DURATION_OPTIONS:
+        sessions = []
+        for _ in range(5):
+            difficulty, _, board_time = generator.mode()
+            sessions.append(generator.trials(difficulty, board_time, duration))
+        trial_count = round(statistics.mean(len(trials) for trials in sessions))
+
+        for name, calculate in (('engine', metrics_engine.calculate_session_metrics), ('reference', app.calculate_session_metrics)):
+            result = measure(lambda: [calculate(trials, duration) for trials in sessions], repeat)
+            result['median_ms'] = round(result['median_ms'] / len(sessions), 4)
+            result['min_ms'] = round(result['min_ms'] / len(sessions), 4)
+            results[f"metrics.{name}.{duration}s"] = dict(result, trials=trial_count)
+
+        # Backfill scores stored sessions in batches; per-session times, against the reference in a loop
+        batch = []
+        for _ in range(BATCH_SESSIONS):
+            difficulty, _, board_time = generator.mode()
+            batch.append((generator.trials(difficulty, board_time, duration), duration))
+        ragged = metrics_engine.sessions_to_ragged(batch)
+        for name, calculate in (
+            ('batch', lambda: metrics_engine.calculate_batch_metrics(*ragged)),
+            ('batch_reference', lambda: [app.calculate_session_metrics(trials, duration) for trials, duration in batch]),
+        ):
+            result = measure(calculate, repeat)
+            result['median_ms'] = round(result['median_ms'] / len(batch), 4)
+            result['min_ms'] = round(result['min_ms'] / len(batch), 4)
+            results[f"metrics.{name}.{duration}s"] = dict(result, sessions=len(batch))
+    return results
+
+
+def bench_payload(app, generator, repeat):
+    """Parsing, verifying and scoring a session sent as trialData JSON or as gzip-compressed trialColumns."""
+    import gzip
+
+    import metrics_engine
+    import trial_payload
+    import trial_verifier
+
+    def from_json(body):
+        trials, _ = trial_verifier.verify_trials(json.loads(body)['trialData'], app.position_signer)
+        return app.calculate_session_metrics(trials, duration)
+
+    def from_columns(body):
+        trials = trial_payload.TrialColumns.decode(json.loads(trial_payload.decompress_body(body, 1 << 24))['trialColumns'])
+        trials.verify(app.position_signer)
+        return metrics_engine.compute_metrics(*trials.metric_arrays(), duration)
+
+    results = {}
+    for duration in (60, 180, 360):
+        submission = generator.submission("Payload", duration=duration)
+        json_body = json.dumps(submission).encode()
+        columns_submission = dict(submission, trialColumns=trial_payload.encode_trial_columns(submission['trialData']))
+        del columns_submission['trialData']
+        columns_body = gzip.compress(json.dumps(columns_submission, separators=(',', ':')).encode())
+
+        for name, decode, body in (('json', from_json, json_body), ('columns_gzip', from_columns, columns_body)):
+            results[f"payload.{name}.{duration}s"] = dict(measure(lambda: decode(body), repeat, number=20), bytes=len(body))
+    return results
+
+
+def bench_analytics(generator, repeat):
+    """Loading Trials rows into the columnar table, and grouped queries over it."""
+    import trial_analytics
+
+    results = {}
+    for session_count in ANALYTICS_SESSION_COUNTS:
+        rows = []
+        difficulties = {}
+        start = datetime(2025, 1, 1)
+        for index in range(session_count):
+            difficulty, leaderboard_difficulty, board_time = generator.mode()
+            moment = start + timedelta(minutes=index)
+            key = (moment.strftime('%Y-%m-%d'), moment.strftime('%H:%M:%S'), f"Analytics player {index % 500}")
+            difficulties[key] = leaderboard_difficulty.lower()
+            for trial in generator.trials(difficulty, board_time, generator.duration()):
+                rows.append([
+                    *key, trial['trial'], trial['trialTime'], trial['attackingPiece'], trial['attackingPosition'],
+                    trial['attackedPieces'], trial['responseTime'], trial['success'], trial['responsePosition']
+                ])
+
+        results[f"analytics.load.{session_count}"] = dict(
+            measure(lambda: trial_analytics.TrialTable.from_rows(rows, difficulties), repeat), trials=len(rows)
+        )
+        table = trial_analytics.TrialTable.from_rows(rows, difficulties)
+        for group_by in (('difficulty',), ('piece', 'attacked', 'difficulty')):
+            results[f"analytics.query.{'_'.join(group_by)}.{session_count}"] = measure(
+                lambda: table.query(group_by, baseline=('difficulty', 'easy')), repeat, number=5
+            )
+    return results
+
+
+def bench_leaderboard(app, generator, sizes, repeat):
+    results = {}
+    for size in sizes:
+        service = seed_sheets(app, generator, size)
+        results[f"leaderboard.rebuild.{size}"] = measure(lambda: app.update_leaderboard(service, rebuild=True), repeat)
+
+        names = itertools.count()
+
+        def add_session():
+            ies = round(generator.rng.lognormvariate(math.log(2.5), 0.35), 2)
+            app.update_leaderboard(
+                service, current_user=f"New player {next(names)}", current_difficulty=generator.mode()[1],
+                current_ies=ies, current_board_time=3, current_drift=0, current_stability=90
+            )
+        results[f"leaderboard.incremental.{size}"] = measure(add_session, repeat, number=20)
+
+        leaderboard_rows = app.leaderboard_index.to_sheet_rows()
+        results[f"leaderboard.format.{size}"] = dict(
+            measure(lambda: app.format_leaderboard_data(leaderboard_rows), repeat, number=10),
+            leaderboard_rows=len(leaderboard_rows)
+        )
+    return results
+
+
+def bench_submit(app, generator, sizes, submissions):
+    client = app.app.test_client()
+    results = {}
+    for size in sizes:
+        seed_sheets(app, generator, size)
+        app.update_leaderboard(None, rebuild=True)
+        bodies = [generator.submission(f"Bench player {index}") for index in range(submissions)]
+
+        timings = []
+        for body in bodies:
+            started = time.perf_counter()
+            response = client.post('/submit_results', json=body)
+            timings.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise click.ClickException(f"/submit_results returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+        results[f"submit.{size}"] = {
+            'median_ms': round(statistics.median(timings) * 1000, 4),
+            'min_ms': round(min(timings) * 1000, 4),
+            'requests_per_second': round(len(timings) / sum(timings), 2),
+            'repeat': len(timings),
+            'number': 1
+        }
+    return results
+
+
+STARTUP_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.warm_up()
+print(json.dumps({'import': imported - started, 'warm_up': time.perf_counter() - imported}))
+"""
+
+
+def bench_startup(repeat):
+    timings = {'import': [], 'warm_up': []}
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            raise click.ClickException(f"Starting the app failed: {completed.stderr[-500:]}")
+        for phase, seconds in json.loads(completed.stdout.strip().splitlines()[-1]).items():
+            timings[phase].append(seconds)
+
+    return {
+        f"startup.{phase}": {
+            'median_ms': round(statistics.median(values) * 1000, 4),
+            'min_ms': round(min(values) * 1000, 4),
+            'repeat': len(values),
+            'number': 1
+        }
+        for phase, values in timings.items()
+    }
+
+
+def compare(results, baseline, threshold):
+    """(regressions, improvements) as (name, baseline ms, current ms) of benchmarks present in both."""
+    regressions = []
+    improvements = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or not previous.get('min_ms'):
+            continue
+        change = (result['min_ms'] - previous['min_ms']) / previous['min_ms']
+        if change > threshold:
+            regressions.append((name, previous['min_ms'], result['min_ms']))
+        elif change < -threshold:
+            improvements.append((name, previous['min_ms'], result['min_ms']))
+    return regressions, improvements
+
+
+@click.command()
+@click.option("--only", default="metrics,payload,leaderboard,submit,analytics,startup", show_default=True, help="Comma separated benchmark groups.")
+@click.option("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES), show_default=True, help="Historical Data rows for the leaderboard and submit benchmarks.")
+@click.option("--repeat", default=5, show_default=True, help="Rounds per benchmark; the median round is reported.")
+@click.option("--submissions", default=30, show_default=True, help="/submit_results requests per size.")
+@click.option("--seed", default=0, show_default=True)
+@click.option("--output", "output_path", default=None, help="Write the results here (defaults to instance/benchmark_results.json).")
+@click.option("--baseline", "baseline_path", default=DEFAULT_BASELINE_PATH, show_default=True)
+@click.option("--save-baseline", is_flag=True, help="Store these results as the new baseline.")
+@click.option("--threshold", default=DEFAULT_THRESHOLD, show_default=True, help="Slowdown (0.2 = 20%) reported as a regression.")
+def main(only, sizes, repeat, submissions, seed, output_path, baseline_path, save_baseline, threshold):
+    app = load_app()
+    groups = {group.strip() for group in only.split(",") if group.strip()}
+    sizes = [int(size) for size in sizes.split(",") if size.strip()]
+    generator = SessionGenerator(seed, signer=app.position_signer)
+
+    results = {}
+    if "metrics" in groups:
+        results.update(bench_metrics(app, generator, repeat))
+    if "payload" in groups:
+        results.update(bench_payload(app, generator, repeat))
+    if "leaderboard" in groups:
+        results.update(bench_leaderboard(app, generator, sizes, repeat))
+    if "submit" in groups:
+        results.update(bench_submit(app, generator, sizes, submissions))
+    if "analytics" in groups:
+        results.update(bench_analytics(generator, repeat))
+    if "startup" in groups:
+        results.update(bench_startup(repeat))
+
+    for name, result in results.items():
+        extra = f"  {result['requests_per_second']} req/s" if 'requests_per_second' in result else ""
+        click.echo(f"{name:32} median {result['median_ms']:10.3f} ms  min {result['min_ms']:10.3f} ms{extra}")
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sheets_fake': os.environ.get("SHEETS_FAKE"),
+            'sheets_fake_latency_ms': float(os.environ.get("SHEETS_FAKE_LATENCY_MS", 0))
+        },
+        'results': results
+    }
+    output_path = output_path or os.path.join(app.app.instance_path, "benchmark_results.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    click.echo(f"Results written to {output_path}")
+
+    regressions = []
+    if os.path.exists(baseline_path) and not save_baseline:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions, improvements = compare(results, baseline, threshold)
+        for name, before, after in improvements:
+            click.echo(f"Faster than baseline: {name} {before:.3f} ms -> {after:.3f} ms")
+        for name, before, after in regressions:
+            click.echo(f"REGRESSION: {name} {before:.3f} ms -> {after:.3f} ms (+{100 * (after - before) / before:.0f}%)")
+        if not regressions:
+            click.echo(f"No regressions above {threshold:.0%} against {baseline_path}")
+
+    if save_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump(report, f, indent=2)
+        click.echo(f"Baseline saved to {baseline_path}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+"""Gunicorn settings, read automatically when gunicorn starts from this directory (Procfile)."""
+import os
+
+# Threaded workers: an open /leaderboard/stream holds one thread instead of a whole worker, and
+# long-lived responses are not killed by the worker timeout (as they would be with sync workers)
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 32))
+
+
+def post_worker_init(worker):
+    # Warm the worker up in the background as soon as it has loaded the app, so the first
+    # request after a cold start does not build the Sheets client or load the indexes itself
+    import app
+    app.start_warm_up()
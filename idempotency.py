@@ -0,0 +1,160 @@
+"""Idempotency keys for /submit_results, shared by every worker on the host.
+
+A submission is identified by the client's Idempotency-Key header, or else by a hash of its
+payload. The first request with a key claims it and runs; a duplicate arriving meanwhile
+(on any worker) waits for it to finish, and every later duplicate is answered with the
+stored response instead of appending the session again. Responses are kept for
+ttl_seconds, at most max_entries of them, in a small SQLite database in WAL mode.
+
+A claim whose request failed (5xx) is released so that the retry runs normally. A claim
+left behind by a worker that died is taken over once its process is gone or its lease ran out.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+DEFAULT_TTL_SECONDS = 3600
+DEFAULT_MAX_ENTRIES = 2000
+DEFAULT_LEASE_SECONDS = 120
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a different payload."""
+
+
+class StoredResponse:
+    def __init__(self, status, body, waited=False):
+        self.status = status
+        self.body = body
+        self.waited = waited
+
+
+def payload_fingerprint(payload):
+    """sha256 of a JSON payload, independent of key order and of how the body was encoded."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class IdempotencyStore:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            state TEXT NOT NULL,
+            owner_pid INTEGER,
+            status INTEGER,
+            body BLOB,
+            created REAL NOT NULL,
+            expires REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idempotency_keys_expires ON idempotency_keys (expires);
+    """
+
+    def __init__(self, path, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES,
+                 lease_seconds=DEFAULT_LEASE_SECONDS, poll_interval_seconds=0.05):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lease_seconds = lease_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection().executescript(self.SCHEMA)
+
+    def connection(self):
+        """Connection owned by the calling thread (and process, so it survives a fork)."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def claim(self, key, fingerprint):
+        """Claim key for this request (returns None), or return the StoredResponse of the request that had it.
+
+        Waits while another request holds the key. Raises IdempotencyConflict when the key
+        was used for a different payload.
+        """
+        started = time.monotonic()
+        while True:
+            outcome = self._try_claim(key, fingerprint)
+            if outcome is None or isinstance(outcome, StoredResponse):
+                if outcome is not None:
+                    outcome.waited = time.monotonic() - started > self.poll_interval_seconds
+                return outcome
+            time.sleep(self.poll_interval_seconds)
+
+    def _try_claim(self, key, fingerprint):
+        """None when claimed, a StoredResponse when done, True while another request holds the key."""
+        now = time.time()
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT fingerprint, state, owner_pid, status, body, expires FROM idempotency_keys WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is not None:
+                stored_fingerprint, state, owner_pid, status, body, expires = row
+                abandoned = state == 'pending' and (expires <= now or not _pid_alive(owner_pid))
+                if expires > now and not abandoned:
+                    if stored_fingerprint != fingerprint:
+                        raise IdempotencyConflict(key)
+                    if state == 'done':
+                        return StoredResponse(status, zlib.decompress(body))
+                    return True
+
+            connection.execute(
+                "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, state, owner_pid, created, expires) "
+                "VALUES (?, ?, 'pending', ?, ?, ?)",
+                (key, fingerprint, os.getpid(), now, now + self.lease_seconds)
+            )
+            self._evict(connection, now)
+            return None
+        finally:
+            connection.execute("COMMIT")
+
+    def complete(self, key, status, body):
+        """Store the response of a claimed key for later duplicates."""
+        now = time.time()
+        self.connection().execute(
+            "UPDATE idempotency_keys SET state = 'done', status = ?, body = ?, expires = ? WHERE key = ? AND owner_pid = ?",
+            (status, zlib.compress(body), now + self.ttl_seconds, key, os.getpid())
+        )
+
+    def release(self, key):
+        """Drop a claim whose request failed, so a retry runs again."""
+        self.connection().execute(
+            "DELETE FROM idempotency_keys WHERE key = ? AND state = 'pending' AND owner_pid = ?",
+            (key, os.getpid())
+        )
+
+    def _evict(self, connection, now):
+        connection.execute("DELETE FROM idempotency_keys WHERE expires <= ? AND state = 'done'", (now,))
+        connection.execute(
+            "DELETE FROM idempotency_keys WHERE key IN ("
+            "SELECT key FROM idempotency_keys WHERE state = 'done' ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def size(self):
+        return self.connection().execute("SELECT COUNT(*) FROM idempotency_keys").fetchone()[0]
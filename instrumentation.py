@@ -0,0 +1,324 @@
+"""Prometheus metrics shared by every gunicorn worker.
+
+Each process records counters, histograms and gauges in memory (a dict update under a lock),
+and a background thread writes a snapshot to the process's own file in the metrics directory
+every flush interval. /metrics merges the snapshots of all workers into the text exposition
+format. Counters and histograms of workers that exited are folded into an archive file so
+their counts are never lost; gauges are reported per live worker with a pid label.
+"""
+import bisect
+import contextlib
+import fcntl
+import functools
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from sheets_client import wrap_service_requests
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ARCHIVE_FILE = "metrics_archive.json"
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsRegistry:
+    """Counters, histograms and gauges of this process, plus the merged view of all workers.
+
+    directory=None keeps everything in this process (single-worker setups). Gauges are read
+    from the registered callbacks whenever a snapshot is taken.
+    """
+
+    def __init__(self, directory=None, flush_interval_seconds=2, buckets=DEFAULT_BUCKETS):
+        self.directory = directory
+        self.flush_interval_seconds = flush_interval_seconds
+        self.buckets = tuple(buckets)
+        self._descriptions = {}
+        self._gauge_callbacks = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._reset_values()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # A forked worker starts from zero instead of re-reporting its parent's counts
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_values(self):
+        self._counters = {}
+        self._histograms = {}
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._reset_values()
+
+    def describe(self, name, kind, help_text):
+        self._descriptions[name] = (kind, help_text)
+
+    def gauge(self, name, help_text, callback):
+        """Register a gauge read at snapshot time; callback returns a number or {((label, value), ...): number}."""
+        self.describe(name, 'gauge', help_text)
+        self._gauge_callbacks[name] = callback
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+        self.ensure_started()
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+        self.ensure_started()
+
+    @contextlib.contextmanager
+    def timer(self, function_name):
+        """Time a block as pontifex_function_duration_seconds{function=...}, counting exceptions."""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc("pontifex_function_errors_total", function=function_name)
+            raise
+        finally:
+            self.observe("pontifex_function_duration_seconds", time.perf_counter() - started, function=function_name)
+
+    def timed(self, function_name):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(function_name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        with self._lock:
+            counters = [[name, labels, value] for (name, labels), value in self._counters.items()]
+            histograms = [
+                [name, labels, list(counts), total, count]
+                for (name, labels), (counts, total, count) in self._histograms.items()
+            ]
+
+        gauges = []
+        for name, callback in self._gauge_callbacks.items():
+            try:
+                value = callback()
+            except Exception as e:
+                logging.warning(f"Error reading gauge {name}: {e}")
+                continue
+            if isinstance(value, dict):
+                gauges.extend([name, list(labels), gauge_value] for labels, gauge_value in value.items())
+            elif value is not None:
+                gauges.append([name, [], value])
+        return {'pid': os.getpid(), 'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+    # Cross-process files
+
+    def _file_path(self, pid):
+        return os.path.join(self.directory, f"metrics_{pid}.json")
+
+    @contextlib.contextmanager
+    def _directory_lock(self):
+        with open(os.path.join(self.directory, ".lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def flush(self):
+        """Write this process's snapshot to its file in the metrics directory."""
+        if not self.directory:
+            return
+        snapshot = self.snapshot()
+        path = self._file_path(snapshot['pid'])
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(temp_path, path)
+
+    def ensure_started(self):
+        """Start the flush thread in this process if it is not already running (fork-safe)."""
+        if not self.directory or (self._pid == os.getpid() and self._thread is not None):
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            # Nothing was flushed yet in this process: a file under its pid belongs to an exited one
+            try:
+                with self._directory_lock():
+                    self._archive_files([self._file_path(os.getpid())])
+            except Exception as e:
+                logging.error(f"Error archiving metrics: {e}")
+
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="metrics-flusher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error writing metrics: {e}")
+            time.sleep(self.flush_interval_seconds)
+
+    def _archive_files(self, paths):
+        """Fold the counters and histograms of exited processes into the archive (directory lock held)."""
+        paths = [path for path in paths if os.path.exists(path)]
+        if not paths:
+            return
+        archive_path = os.path.join(self.directory, ARCHIVE_FILE)
+        archive = self._read(archive_path) or {'counters': [], 'histograms': [], 'gauges': []}
+        merged = self._merge([archive] + [self._read(path) for path in paths])
+        merged['gauges'] = []
+        temp_path = f"{archive_path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(merged, f, separators=(',', ':'))
+        os.replace(temp_path, archive_path)
+        for path in paths:
+            os.remove(path)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _merge(self, snapshots):
+        counters = {}
+        histograms = {}
+        gauges = []
+        for snapshot in snapshots:
+            if not snapshot:
+                continue
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, counts, total, count in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+            for name, labels, value in snapshot.get('gauges', []):
+                pid_labels = list(map(tuple, labels))
+                if 'pid' in snapshot:
+                    pid_labels.append(('pid', str(snapshot['pid'])))
+                gauges.append([name, sorted(pid_labels), value])
+        return {
+            'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+            'histograms': [[name, labels, *values] for (name, labels), values in histograms.items()],
+            'gauges': gauges
+        }
+
+    def collect(self):
+        """Merged snapshot of every worker (just this process without a metrics directory)."""
+        if not self.directory:
+            return self._merge([self.snapshot()])
+
+        self.ensure_started()
+        self.flush()
+        with self._directory_lock():
+            snapshots = []
+            exited = []
+            for path in glob.glob(os.path.join(self.directory, "metrics_*.json")):
+                try:
+                    pid = int(os.path.basename(path)[len("metrics_"):-len(".json")])
+                except ValueError:
+                    continue
+                if pid != os.getpid() and not _pid_alive(pid):
+                    exited.append(path)
+                    continue
+                snapshots.append(self._read(path))
+            self._archive_files(exited)
+            snapshots.append(self._read(os.path.join(self.directory, ARCHIVE_FILE)))
+        return self._merge(snapshots)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        merged = self.collect()
+        families = {}
+        for name, labels, value in merged['counters']:
+            families.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+        for name, labels, value in merged['gauges']:
+            families.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+        for name, labels, counts, total, count in merged['histograms']:
+            lines = families.setdefault(name, [])
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                bucket_labels = list(labels) + [('le', _format_number(float(bound)) if bound != float('inf') else "+Inf")]
+                lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(float(total))}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        output = []
+        for name in sorted(families):
+            kind, help_text = self._descriptions.get(name, ('untyped', name))
+            output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(families[name])
+        return "\n".join(output) + "\n"
+
+
+def instrument_service(registry, service):
+    """Sheets service whose requests report to registry, e.g. operation="spreadsheets.values.append"."""
+
+    def around(operation, request_kwargs, execute):
+        started = time.perf_counter()
+        try:
+            return execute()
+        except Exception as e:
+            status = getattr(getattr(e, 'resp', None), 'status', None) or type(e).__name__
+            registry.inc("pontifex_sheets_errors_total", operation=operation, status=status)
+            raise
+        finally:
+            registry.inc("pontifex_sheets_requests_total", operation=operation)
+            registry.observe("pontifex_sheets_request_duration_seconds", time.perf_counter() - started, operation=operation)
+
+    return wrap_service_requests(service, around)
@@ -0,0 +1,444 @@
+import bisect
+import itertools
+import logging
+import threading
+import time
+
+LEADERBOARD_DIFFICULTIES = ('easy', 'medium', 'hard')
+LEADERBOARD_COLUMNS = 15
+
+LEADERBOARD_HEADER_ROWS = [
+    ["Easy Difficulty", "", "", "", "", "Medium Difficulty", "", "", "", "", "Hard Difficulty", "", "", "", ""],
+    ["Rank", "Name", "IES (s)", "Drift", "Stability",
+     "Rank", "Name", "IES (s)", "Drift", "Stability",
+     "Rank", "Name", "IES (s)", "Drift", "Stability"]
+]
+
+
+def normalize_player_name(name):
+    """Key used to recognise the same player across sessions (case and spacing insensitive)."""
+    return " ".join(str(name or "").split()).casefold()
+
+
+def parse_float(value, default):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return default
+
+
+def parse_data_row(row):
+    """Turn a Data sheet row into a leaderboard entry, or None when the row is unusable.
+
+    Data sheet columns: Date, Time, Patient Name, Difficulty, Duration,
+    Board Display Time, Overall IES Score, IES1, IES2, IES3, Focus Drift, Focus Stability
+    """
+    # Need at least Date, Time, Patient Name, Difficulty, Duration, Board Display Time, Overall IES Score
+    if len(row) < 7 or not row[2]:
+        return None
+
+    drift_str = row[10] if len(row) > 10 else "0"
+    stability_str = row[11] if len(row) > 11 else "0"
+    try:
+        drift = float(drift_str)
+        stability = float(stability_str)
+    except (ValueError, TypeError):
+        drift = 0
+        stability = 0
+
+    return {
+        'name': row[2],
+        'difficulty': str(row[3]).lower(),
+        'ies': parse_float(row[6], 999999),
+        'drift': drift,
+        'stability': stability,
+        'board_time': parse_float(row[5], 0)
+    }
+
+
+class SortedBuckets:
+    """Sorted sequence of unique items, kept as consecutive sorted buckets of at most 2 * load items.
+
+    A plain sorted list finds a position in O(log n) but shifts O(n) items on every insert or
+    delete. Here a binary search over the bucket maxima picks the bucket, and only that bucket's
+    items are shifted: O(log n + load) per add or remove. A full bucket is split in two. The
+    rank of an item adds up the sizes of the buckets before it, O(n / load).
+    """
+
+    def __init__(self, items=(), load=256):
+        """items must already be sorted (as after a rebuild), which takes a single pass."""
+        self.load = load
+        items = list(items)
+        self._buckets = [items[start:start + load] for start in range(0, len(items), load)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._size = len(items)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._buckets)
+
+    def add(self, item):
+        buckets, maxes = self._buckets, self._maxes
+        if not buckets:
+            buckets.append([item])
+            maxes.append(item)
+            self._size += 1
+            return
+
+        index = bisect.bisect_right(maxes, item)
+        if index == len(maxes):
+            # Beyond every bucket: append to the last one
+            index -= 1
+            buckets[index].append(item)
+            maxes[index] = item
+        else:
+            bisect.insort(buckets[index], item)
+        self._size += 1
+
+        bucket = buckets[index]
+        if len(bucket) > 2 * self.load:
+            buckets[index:index + 1] = [bucket[:self.load], bucket[self.load:]]
+            maxes[index:index + 1] = [bucket[self.load - 1], bucket[-1]]
+
+    def _locate(self, item):
+        """(bucket index, position in the bucket) of item; ValueError when absent."""
+        index = bisect.bisect_left(self._maxes, item)
+        if index < len(self._maxes):
+            bucket = self._buckets[index]
+            position = bisect.bisect_left(bucket, item)
+            if bucket[position] == item:
+                return index, position
+        raise ValueError(f"{item!r} is not in the list")
+
+    def remove(self, item):
+        index, position = self._locate(item)
+        bucket = self._buckets[index]
+        del bucket[position]
+        self._size -= 1
+        if bucket:
+            self._maxes[index] = bucket[-1]
+        else:
+            del self._buckets[index]
+            del self._maxes[index]
+
+    def index(self, item):
+        """Zero-based position of item in sorted order."""
+        index, position = self._locate(item)
+        return sum(len(bucket) for bucket in itertools.islice(self._buckets, index)) + position
+
+
+class LeaderboardIndex:
+    """Per-difficulty ranking holding each player's best (lowest IES) session.
+
+    Rankings are kept as SortedBuckets of (ies, sequence, player_key): a new session moves
+    one entry in O(log n + bucket size) instead of re-sorting, or shifting, every entry.
+    version increases whenever the ranking may have changed and never repeats.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.version = 0
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._best = {difficulty: {} for difficulty in LEADERBOARD_DIFFICULTIES}
+            self._order = {difficulty: SortedBuckets() for difficulty in LEADERBOARD_DIFFICULTIES}
+            self._sequence = 0
+            self._bulk_loading = False
+            self.loaded_at = None
+
+    @property
+    def loaded(self):
+        return self.loaded_at is not None
+
+    def is_stale(self, max_age_seconds):
+        if not self.loaded:
+            return True
+        if not max_age_seconds:
+            return False
+        return (time.monotonic() - self.loaded_at) >= max_age_seconds
+
+    def load_rows(self, rows):
+        """Rebuild the index from Data sheet rows (header row excluded)."""
+        entries = []
+        for row in rows:
+            try:
+                entry = parse_data_row(row)
+            except Exception as e:
+                logging.warning(f"Skipping data row due to error: {e}")
+                continue
+            if entry:
+                entries.append(entry)
+        self.load_entries(entries)
+
+    def load_entries(self, entries):
+        """Rebuild the index from leaderboard entries as returned by a storage backend."""
+        with self._lock:
+            self.clear()
+            # Keep only the best sessions first, then sort each ranking once
+            self._bulk_loading = True
+            try:
+                for entry in entries:
+                    self.add_entry(**entry)
+            finally:
+                self._bulk_loading = False
+            for difficulty, best in self._best.items():
+                self._order[difficulty] = SortedBuckets(sorted(entry['sort_key'] for entry in best.values()))
+            self.loaded_at = time.monotonic()
+
+    def add_entry(self, name, difficulty, ies, drift, stability, board_time=0, replace=False):
+        """Record a session; returns True when it changed the ranking.
+
+        With replace=True the entry overwrites the player's current one even when its score is
+        worse, as needed for combined scores that can go up as well as down.
+        """
+        difficulty = str(difficulty or "").lower()
+        if difficulty not in self._best or not name:
+            return False
+
+        ies = parse_float(ies, 999999)
+        player_key = normalize_player_name(name)
+
+        with self._lock:
+            best = self._best[difficulty]
+            order = self._order[difficulty]
+            current = best.get(player_key)
+
+            if current is not None:
+                if ies >= current['ies'] and not replace:
+                    return False
+                if not self._bulk_loading:
+                    order.remove(current['sort_key'])
+
+            self._sequence += 1
+            sort_key = (ies, self._sequence, player_key)
+            best[player_key] = {
+                'name': name,
+                'ies': ies,
+                'drift': drift,
+                'stability': stability,
+                'board_time': board_time,
+                'sort_key': sort_key
+            }
+            if not self._bulk_loading:
+                order.add(sort_key)
+            self.version += 1
+            return True
+
+    def place_entry(self, name, difficulty, ies, drift, stability, board_time=0, replace=False):
+        """add_entry that reports the move: (previous rank or -1 when new, new rank), or None when unchanged."""
+        difficulty = str(difficulty or "").lower()
+        with self._lock:
+            previous_rank = self.rank_of(difficulty, name)
+            if not self.add_entry(name, difficulty, ies, drift, stability, board_time, replace):
+                return None
+            return previous_rank, self.rank_of(difficulty, name)
+
+    def entry_of(self, difficulty, name):
+        player_key = normalize_player_name(name)
+        with self._lock:
+            return self._best.get(difficulty, {}).get(player_key)
+
+    def ranked_entries(self, difficulty):
+        with self._lock:
+            best = self._best.get(difficulty, {})
+            return [best[key] for _, _, key in self._order.get(difficulty, [])]
+
+    def rank_of(self, difficulty, name):
+        """Zero-based rank of a player in difficulty, or -1 when absent."""
+        player_key = normalize_player_name(name)
+        with self._lock:
+            entry = self._best.get(difficulty, {}).get(player_key)
+            if entry is None:
+                return -1
+            return self._order[difficulty].index(entry['sort_key'])
+
+    def to_sheet_rows(self):
+        """Leaderboard grid with the three difficulties side by side, as written to the sheet."""
+        with self._lock:
+            columns = [self.ranked_entries(difficulty) for difficulty in LEADERBOARD_DIFFICULTIES]
+
+        leaderboard_data = [list(row) for row in LEADERBOARD_HEADER_ROWS]
+        max_entries = max(len(entries) for entries in columns)
+
+        for i in range(max_entries):
+            row = []
+            for entries in columns:
+                if i < len(entries):
+                    entry = entries[i]
+                    row.extend([i + 1, entry['name'], entry['ies'], entry['drift'], entry['stability']])
+                else:
+                    row.extend(["", "", "", "", ""])
+            leaderboard_data.append(row)
+
+        return leaderboard_data
+
+
+def apply_leaderboard_delta(leaderboard, delta, limit=None):
+    """Apply a leaderboard delta (see app.leaderboard_delta) to a formatted leaderboard, as the browser does.
+
+    The entry is placed by its score rather than by the delta's rank, so deltas from workers
+    whose indexes lag behind still produce the right order. A leaderboard holding only the
+    top limit entries is cut back to limit. Returns the leaderboard.
+    """
+    entries = leaderboard.setdefault(delta['difficulty'], [])
+    player_key = normalize_player_name(delta['entry']['name'])
+    entries[:] = [entry for entry in entries if normalize_player_name(entry['name']) != player_key]
+
+    # After equal scores, like a new entry in LeaderboardIndex
+    score = parse_float(delta['entry']['score'], 999999)
+    position = bisect.bisect_right([parse_float(entry['score'], 999999) for entry in entries], score)
+    entries.insert(position, dict(delta['entry']))
+    if limit is not None:
+        del entries[limit:]
+    for rank, entry in enumerate(entries, start=1):
+        entry['rank'] = rank
+    return leaderboard
+
+
+def column_letter(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+class LeaderboardSheetWriter:
+    """Writes leaderboard snapshots to the sheet as row diffs against the last written snapshot.
+
+    With debounce_seconds > 0, snapshots arriving faster than that are coalesced and only
+    the newest one is written once the interval has elapsed. Snapshots arriving while another
+    thread is writing (for instance while it waits for Sheets quota) are coalesced the same
+    way: that thread writes only the newest one once its current write is done.
+    """
+
+    def __init__(self, spreadsheet_id, debounce_seconds=0, service_factory=None):
+        self.spreadsheet_id = spreadsheet_id
+        self.debounce_seconds = debounce_seconds
+        self.service_factory = service_factory
+        self._lock = threading.Lock()
+        self._written = None
+        self._written_sheet = None
+        self._last_write = 0
+        self._pending = None
+        self._timer = None
+        self._writing = False
+
+    def reset(self):
+        """Forget the last written snapshot so the next write rewrites the whole sheet."""
+        with self._lock:
+            self._written = None
+            self._written_sheet = None
+
+    def write(self, service, sheet_name, leaderboard_data):
+        """Write a snapshot, or leave it for the thread already writing; returns True if this call wrote it."""
+        rows = [self._pad(row) for row in leaderboard_data]
+
+        with self._lock:
+            self._pending = (sheet_name, rows)
+            if self._writing:
+                # Only the newest snapshot matters: the writing thread picks this one up when it is done
+                return False
+
+            wait = self.debounce_seconds - (time.monotonic() - self._last_write)
+            if self.debounce_seconds and wait > 0:
+                if self._timer is None and self.service_factory is not None:
+                    self._timer = threading.Timer(wait, self.flush_pending)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return False
+
+            self._writing = True
+        return self._drain(service)
+
+    def flush_pending(self, service=None):
+        with self._lock:
+            self._timer = None
+            if self._pending is None or self._writing:
+                return False
+            self._writing = True
+        try:
+            return self._drain(service or self.service_factory())
+        except Exception as e:
+            logging.error(f"Error writing debounced leaderboard snapshot: {e}")
+            return False
+
+    def _drain(self, service):
+        """Write pending snapshots until none is left (called by the one thread with _writing set)."""
+        wrote = False
+        try:
+            while True:
+                with self._lock:
+                    pending, self._pending = self._pending, None
+                    if pending is None:
+                        self._writing = False
+                        return wrote
+                self._write_rows(service, *pending)
+                wrote = True
+        except Exception:
+            with self._lock:
+                # The sheet may be half written: rewrite it completely next time
+                self._written = None
+                self._writing = False
+            raise
+
+    def _write_rows(self, service, sheet_name, rows):
+        values = service.spreadsheets().values()
+        last_column = column_letter(LEADERBOARD_COLUMNS - 1)
+
+        if self._written is None or self._written_sheet != sheet_name:
+            # Unknown sheet contents: replace everything once, diffs afterwards
+            values.clear(spreadsheetId=self.spreadsheet_id, range=f"{sheet_name}!A:{last_column}").execute()
+            values.update(
+                spreadsheetId=self.spreadsheet_id,
+                range=f"{sheet_name}!A1",
+                valueInputOption="RAW",
+                body={"values": rows}
+            ).execute()
+        else:
+            data = []
+            for start, end in self._changed_runs(self._written, rows):
+                data.append({
+                    "range": f"{sheet_name}!A{start + 1}:{last_column}{end}",
+                    "values": rows[start:end]
+                })
+
+            if data:
+                values.batchUpdate(
+                    spreadsheetId=self.spreadsheet_id,
+                    body={"valueInputOption": "RAW", "data": data}
+                ).execute()
+
+            if len(self._written) > len(rows):
+                values.clear(
+                    spreadsheetId=self.spreadsheet_id,
+                    range=f"{sheet_name}!A{len(rows) + 1}:{last_column}{len(self._written)}"
+                ).execute()
+
+        self._written = rows
+        self._written_sheet = sheet_name
+        self._last_write = time.monotonic()
+
+    @staticmethod
+    def _changed_runs(old_rows, new_rows):
+        """Yield [start, end) row ranges of new_rows that differ from old_rows."""
+        start = None
+        for i, row in enumerate(new_rows):
+            changed = i >= len(old_rows) or old_rows[i] != row
+            if changed and start is None:
+                start = i
+            elif not changed and start is not None:
+                yield start, i
+                start = None
+        if start is not None:
+            yield start, len(new_rows)
+
+    @staticmethod
+    def _pad(row):
+        return list(row) + [""] * max(0, LEADERBOARD_COLUMNS - len(row))
@@ -0,0 +1,320 @@
+"""Leaderboard changes pushed to browsers as Server-Sent Events.
+
+A submission that changes the ranking publishes one delta: the entry inserted or moved in
+its difficulty, with its new and previous rank. Deltas are appended to an event log file
+shared by every worker on the host (the local stand-in for a pub/sub broker): publishing
+takes a flock and assigns the next event id, and each worker tails the file with one thread
+that fans every event out to the streams connected to it. Only that thread touches the
+file, however many clients are listening.
+
+Every stream has a bounded buffer; a client too slow to keep up loses its backlog and gets
+a fresh snapshot instead. Idle streams receive a heartbeat comment so proxies keep them
+open and dead connections are noticed. A client reconnecting with Last-Event-ID is sent
+the events it missed while they are still in memory, otherwise a snapshot.
+"""
+import collections
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+DEFAULT_BUFFER_SIZE = 64
+DEFAULT_REPLAY_SIZE = 256
+DEFAULT_HEARTBEAT_SECONDS = 15
+# The log is rewritten with its newest events once it grows beyond this
+DEFAULT_MAX_LOG_BYTES = 256 * 1024
+TAIL_READ_BYTES = 8192
+
+# Put in a subscription's buffer in place of the events it lost
+RESYNC = object()
+
+
+def format_event(data, event=None, event_id=None):
+    """One Server-Sent Events message carrying data as JSON."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+class EventLog:
+    """Append-only JSON lines file of events, shared by every process on the host.
+
+    Event ids increase by one per event across all processes. Once the file exceeds
+    max_bytes it is replaced by a copy holding its newest keep_events events.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_LOG_BYTES, keep_events=DEFAULT_REPLAY_SIZE):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.max_bytes = max_bytes
+        self.keep_events = keep_events
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        open(self.path, 'a').close()
+
+    def append(self, event_type, data):
+        """Append one event; returns it with its id."""
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                event = {'id': self._last_id() + 1, 'type': event_type, 'origin': os.getpid(), 'data': data}
+                with open(self.path, 'ab') as log_file:
+                    log_file.write((json.dumps(event, separators=(',', ':')) + "\n").encode('utf-8'))
+                    size = log_file.tell()
+                if size > self.max_bytes:
+                    self._compact()
+                return event
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read(self, cursor=None):
+        """Events appended since cursor (None: the whole log); returns (events, new cursor).
+
+        The cursor notices the file being replaced by a compaction, in which case the
+        events are read again from the start and the caller skips those it has seen.
+        """
+        try:
+            log_file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return [], None
+        with log_file:
+            stat = os.fstat(log_file.fileno())
+            offset = 0
+            if cursor is not None and cursor[0] == stat.st_ino and cursor[1] <= stat.st_size:
+                offset = cursor[1]
+            log_file.seek(offset)
+
+            events = []
+            for line in log_file:
+                if not line.endswith(b"\n"):
+                    break  # still being written, read again next time
+                offset += len(line)
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logging.error(f"Dropping corrupt event log line at offset {offset - len(line)}")
+            return events, (stat.st_ino, offset)
+
+    def _last_id(self):
+        with open(self.path, 'rb') as log_file:
+            size = os.fstat(log_file.fileno()).st_size
+            log_file.seek(max(0, size - TAIL_READ_BYTES))
+            lines = log_file.read().split(b"\n")
+        for line in reversed(lines):
+            try:
+                return int(json.loads(line)['id'])
+            except (ValueError, KeyError, TypeError):
+                continue
+        return 0
+
+    def _compact(self):
+        events, _ = self.read()
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as temp_file:
+            for event in events[-self.keep_events:]:
+                temp_file.write((json.dumps(event, separators=(',', ':')) + "\n").encode('utf-8'))
+        os.replace(temp_path, self.path)
+
+
+class Subscription:
+    """Buffer of events waiting to be sent to one client, holding at most buffer_size."""
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self.dropped = 0
+        self._events = collections.deque()
+        self._condition = threading.Condition()
+
+    def put(self, event):
+        """Queue an event; returns False when the buffer was full and the backlog was dropped for a resync."""
+        with self._condition:
+            overflow = len(self._events) >= self.buffer_size
+            if overflow:
+                self.dropped += len(self._events)
+                self._events.clear()
+                self._events.append(RESYNC)
+            elif not self._events or self._events[0] is not RESYNC:
+                self._events.append(event)
+            self._condition.notify()
+            return not overflow
+
+    def get(self, timeout):
+        """Next event, RESYNC, or None when nothing arrived within timeout seconds."""
+        with self._condition:
+            if not self._events:
+                self._condition.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+
+class EventHub:
+    """Fans the events of an EventLog out to the subscriptions of this process.
+
+    on_event, when given, is called from the hub thread with every event appended after
+    the hub started, including those published by other processes.
+    """
+
+    def __init__(self, event_log, buffer_size=DEFAULT_BUFFER_SIZE, replay_size=DEFAULT_REPLAY_SIZE,
+                 poll_interval_seconds=0.5, on_event=None):
+        self.event_log = event_log
+        self.buffer_size = buffer_size
+        self.poll_interval_seconds = poll_interval_seconds
+        self.on_event = on_event
+        self.replay_size = replay_size
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._subscriptions = set()
+        self._recent = collections.deque(maxlen=self.replay_size)
+        self._cursor = None
+        self._thread = None
+        self._pid = None
+        self.last_id = 0
+        self.delivered = 0
+        self.resyncs = 0
+
+    def ensure_started(self):
+        """Start the tailing thread in this process if it is not already running (fork-safe)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            # Events already in the log are history: kept for replays, not delivered
+            events, self._cursor = self.event_log.read()
+            self._recent.extend(events)
+            self.last_id = events[-1]['id'] if events else 0
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="event-hub", daemon=True)
+            self._thread.start()
+
+    def publish(self, event_type, data):
+        """Append an event to the shared log; every process's hub delivers it, this one right away."""
+        self.ensure_started()
+        event = self.event_log.append(event_type, data)
+        self._wake.set()
+        return event
+
+    def subscribe(self):
+        self.ensure_started()
+        subscription = Subscription(self.buffer_size)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def subscriber_count(self):
+        return len(self._subscriptions)
+
+    def events_since(self, last_id):
+        """Events after last_id still held for replay, or None when some of them are gone."""
+        with self._lock:
+            if last_id > self.last_id:
+                return None
+            missed = [event for event in self._recent if event['id'] > last_id]
+            if self.last_id > last_id and (not missed or missed[0]['id'] != last_id + 1):
+                return None
+            return missed
+
+    def poll(self):
+        """Deliver the events appended since the last poll; returns how many there were."""
+        events, cursor = self.event_log.read(self._cursor)
+        self._cursor = cursor
+        if events and events[-1]['id'] < self.last_id:
+            # The log was deleted and started over
+            logging.warning("Event log restarted, resetting event ids")
+            with self._lock:
+                self.last_id = 0
+                self._recent.clear()
+
+        delivered = 0
+        for event in events:
+            if event['id'] <= self.last_id:
+                continue
+            # Handled before last_id moves on, so a snapshot taken at last_id already reflects the event
+            if self.on_event is not None:
+                try:
+                    self.on_event(event)
+                except Exception as e:
+                    logging.error(f"Error handling event {event['id']}: {e}")
+            with self._lock:
+                self.last_id = event['id']
+                self._recent.append(event)
+                subscriptions = list(self._subscriptions)
+            for subscription in subscriptions:
+                if not subscription.put(event):
+                    self.resyncs += 1
+            delivered += 1
+        self.delivered += delivered
+        return delivered
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval_seconds)
+            self._wake.clear()
+            try:
+                self.poll()
+            except Exception as e:
+                logging.error(f"Error reading the event log: {e}")
+
+    def stream(self, snapshot, last_event_id=None, heartbeat_seconds=DEFAULT_HEARTBEAT_SECONDS, max_seconds=None,
+               retry_milliseconds=3000, select=None):
+        """Server-Sent Events for one client: a snapshot (or the missed events), then every event.
+
+        snapshot() returns the full state as a "snapshot" event's data. select(event), when
+        given, decides what the client gets for each event: the event (sent), None (skipped)
+        or RESYNC (a snapshot instead). The stream ends after max_seconds; EventSource then
+        reconnects with Last-Event-ID and nothing is lost.
+        """
+        subscription = self.subscribe()
+        try:
+            yield f"retry: {retry_milliseconds}\n\n"
+            missed = None
+            if last_event_id is not None:
+                missed = self.events_since(last_event_id)
+            if missed is None:
+                # Subscribed first: events racing the snapshot are sent again, and applying a delta twice is harmless
+                snapshot_id = self.last_id
+                yield format_event(snapshot(), 'snapshot', snapshot_id)
+                seen_id = snapshot_id
+            else:
+                selected = [select(event) if select else event for event in missed]
+                if any(event is RESYNC for event in selected):
+                    yield format_event(snapshot(), 'snapshot', self.last_id)
+                    seen_id = self.last_id
+                else:
+                    for event in selected:
+                        if event is not None:
+                            yield format_event(event['data'], event['type'], event['id'])
+                    seen_id = missed[-1]['id'] if missed else last_event_id
+
+            deadline = time.monotonic() + max_seconds if max_seconds else None
+            while deadline is None or time.monotonic() < deadline:
+                timeout = heartbeat_seconds
+                if deadline is not None:
+                    timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+                event = subscription.get(timeout)
+                if select is not None and event is not None and event is not RESYNC and event['id'] > seen_id:
+                    selected = select(event)
+                    if selected is None:
+                        seen_id = event['id']
+                        continue
+                    event = selected
+                if event is None:
+                    yield ": heartbeat\n\n"
+                elif event is RESYNC:
+                    seen_id = self.last_id
+                    yield format_event(snapshot(), 'snapshot', seen_id)
+                elif event['id'] > seen_id:
+                    seen_id = event['id']
+                    yield format_event(event['data'], event['type'], event['id'])
+        finally:
+            self.unsubscribe(subscription)
@@ -0,0 +1,656 @@
+"""Vectorized session metrics.
+
+Array implementation of app.calculate_session_metrics: the trial payload is turned into
+contiguous NumPy arrays once and every metric is computed from masks over those arrays.
+Results are identical to the pure-Python reference, including the 999999 sentinel and
+the rounding rules, because every reduction adds values in the same order as Python's
+sum() and all rounding is done on Python floats.
+
+calculate_batch_metrics scores many sessions at once and is what backfill uses.
+/submit_results scores a trialColumns session, already decoded into arrays, with
+compute_metrics; a trialData list of dicts is faster to score with the reference.
+tests/test_metrics_engine.py fuzzes both paths against the reference.
+"""
+import math
+import sys
+
+import numpy as np
+
+INSUFFICIENT_IES = 999999
+MIN_SUCCESSFUL_TRIALS = 5
+
+# Metric keys in DATA_SHEET_HEADERS order, starting at 'Overall IES Score'
+SUMMARY_METRIC_KEYS = ['overall_ies', 'ies1', 'ies2', 'ies3', 'focus_drift', 'focus_stability']
+EXTRA_METRIC_KEYS = [
+    'overall_accuracy_pct', 'overall_median_rt', 'overall_rt_cv', 'overall_lapse_rate_pct',
+    'accuracy_first_pct', 'accuracy_second_pct', 'accuracy_third_pct',
+    'median_rt_first', 'median_rt_second', 'median_rt_third',
+    'rt_cv_first', 'rt_cv_second', 'rt_cv_third',
+    'lapse_rate_first_pct', 'lapse_rate_second_pct', 'lapse_rate_third_pct',
+    'rt_decrement_pct', 'accuracy_decrement_pct', 'ies_decrement_pct',
+    'rt_slope', 'success_slope', 'ies_slope', 'error_rate_slope',
+    'post_error_rt_delta', 'post_error_accuracy_delta_pp', 'rt_success_correlation'
+]
+
+# Python 3.12 made sum() of floats compensated; match whichever sum() the reference runs on
+COMPENSATED_SUM = sys.version_info >= (3, 12)
+
+
+def _sum(values):
+    if values.size == 0:
+        return 0
+    if values.dtype.kind in 'iub':
+        return int(values.sum())
+    if COMPENSATED_SUM:
+        return sum(values.tolist())
+    return float(np.cumsum(values)[-1])
+
+
+def _mean(values):
+    if values.size == 0:
+        return None
+    return _sum(values) / values.size
+
+
+def _standard_deviation(values):
+    if values.size == 0:
+        return None
+    average = _mean(values)
+    return math.sqrt(_sum((values - average) ** 2) / values.size)
+
+
+def _median_sorted(sorted_values):
+    size = sorted_values.size
+    if size == 0:
+        return None
+    midpoint = size // 2
+    if size % 2 == 1:
+        return float(sorted_values[midpoint])
+    return (float(sorted_values[midpoint - 1]) + float(sorted_values[midpoint])) / 2
+
+
+def _median(values):
+    return _median_sorted(np.sort(values))
+
+
+def _coefficient_of_variation(values):
+    average = _mean(values)
+    if average in (None, 0):
+        return None
+    deviation = _standard_deviation(values)
+    if deviation is None:
+        return None
+    return deviation / average
+
+
+def _linear_slope(x_values, y_values):
+    if x_values.size != y_values.size or x_values.size < 2:
+        return None
+    x_deviation = x_values - _mean(x_values)
+    denominator = _sum(x_deviation ** 2)
+    if denominator == 0:
+        return None
+    return _sum(x_deviation * (y_values - _mean(y_values))) / denominator
+
+
+def _pearson_correlation(x_values, y_values):
+    if x_values.size != y_values.size or x_values.size < 2:
+        return None
+    x_mean = _mean(x_values)
+    y_mean = _mean(y_values)
+    x_sd = _standard_deviation(x_values)
+    y_sd = _standard_deviation(y_values)
+    if x_sd in (None, 0) or y_sd in (None, 0):
+        return None
+    covariance = _sum((x_values - x_mean) * (y_values - y_mean)) / x_values.size
+    return covariance / (x_sd * y_sd)
+
+
+def _round_metric(value, digits=2):
+    if value is None or not math.isfinite(value):
+        return ""
+    return round(float(value), digits)
+
+
+def _percent(value, digits=2):
+    if value is None or not math.isfinite(value):
+        return ""
+    return round(float(value) * 100, digits)
+
+
+def _percent_change(first_value, last_value):
+    if first_value in (None, 0) or last_value is None:
+        return None
+    return ((last_value - first_value) / first_value) * 100
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def trials_to_arrays(trial_data):
+    """Convert a trialData payload into (response_times, rt_valid, success, trial_times) arrays."""
+    count = len(trial_data)
+    response_times = np.zeros(count, dtype=np.float64)
+    rt_valid = np.zeros(count, dtype=bool)
+    success = np.zeros(count, dtype=np.int64)
+    trial_times = np.zeros(count, dtype=np.float64)
+
+    for index, trial in enumerate(trial_data):
+        response_time = _to_float(trial.get('responseTime'))
+        if response_time is not None:
+            response_times[index] = response_time
+            rt_valid[index] = True
+        success[index] = 1 if str(trial.get('success', 0)) == '1' else 0
+        trial_time = _to_float(trial.get('trialTime'))
+        trial_times[index] = trial_time if trial_time is not None else index + 1
+
+    return response_times, rt_valid, success, trial_times
+
+
+def _block_ies(block_rt, block_valid, block_success):
+    if block_success.size == 0:
+        return INSUFFICIENT_IES
+    successful = block_valid & (block_success == 1)
+    successful_count = int(successful.sum())
+    if successful_count == 0:
+        return INSUFFICIENT_IES
+    accuracy = successful_count / block_success.size
+    median_response_time = _median(block_rt[successful])
+    if median_response_time is None or accuracy <= 0:
+        return INSUFFICIENT_IES
+    return round(median_response_time / accuracy, 2)
+
+
+def _summarize_block(block_rt, block_valid, block_success, lapse_threshold):
+    response_times = block_rt[block_valid]
+    accuracy = (_sum(block_success) / block_success.size) if block_success.size else None
+    lapse_rate = None
+    if response_times.size and lapse_threshold is not None:
+        lapse_rate = int((response_times > lapse_threshold).sum()) / response_times.size
+
+    return {
+        'accuracy': accuracy,
+        'median_rt': _median(response_times),
+        'rt_cv': _coefficient_of_variation(response_times),
+        'lapse_rate': lapse_rate,
+        'ies': _block_ies(block_rt, block_valid, block_success)
+    }
+
+
+def _time_third_masks(trial_times, duration):
+    total_time = _to_float(duration)
+    if total_time in (None, 0):
+        total_time = float(trial_times.max()) if trial_times.size else 0
+    if total_time == 0:
+        total_time = max(trial_times.size, 1)
+
+    interval_duration = total_time / 3
+    first = trial_times < interval_duration
+    second = ~first & (trial_times < 2 * interval_duration)
+    third = ~first & ~second
+    return first, second, third
+
+
+def _ies_summary(ies1, ies2, ies3):
+    """(overall IES, focus drift, focus stability, IES decrement, IES slope) from the block IES values.
+
+    Plain Python on the three rounded values, exactly as the reference computes them.
+    """
+    overall_ies = round((ies1 * ies2 * ies3) ** (1 / 3), 2)
+
+    try:
+        focus_drift = round(ies1 - ies3, 2)
+        mean_ies = (ies1 + ies2 + ies3) / 3
+        average_deviation = (abs(ies1 - mean_ies) + abs(ies2 - mean_ies) + abs(ies3 - mean_ies)) / 3
+        focus_stability = round(100 * (1 - (average_deviation / mean_ies)))
+        focus_stability = max(0, min(100, focus_stability))
+    except (ValueError, ZeroDivisionError):
+        focus_drift = 0
+        focus_stability = 0
+
+    points = [(position, ies) for position, ies in enumerate((ies1, ies2, ies3), start=1) if ies != INSUFFICIENT_IES]
+    x_values = [point[0] for point in points]
+    y_values = [point[1] for point in points]
+    ies_decrement = _round_metric(_percent_change(y_values[0], y_values[-1])) if len(y_values) >= 2 else ""
+
+    ies_slope = None
+    if len(x_values) >= 2:
+        x_mean = sum(x_values) / len(x_values)
+        y_mean = sum(y_values) / len(y_values)
+        denominator = sum((x - x_mean) ** 2 for x in x_values)
+        if denominator != 0:
+            ies_slope = sum((x - x_mean) * (y - y_mean) for x, y in zip(x_values, y_values)) / denominator
+
+    return overall_ies, focus_drift, focus_stability, ies_decrement, _round_metric(ies_slope, 4)
+
+
+def compute_metrics(response_times, rt_valid, success, trial_times, duration):
+    """Session metrics from trial arrays, in the same shape as app.calculate_session_metrics."""
+    # inf and NaN inputs turn into NaN and inf as in the reference; keep numpy from also logging
+    # a RuntimeWarning for each of them, as calculate_batch_metrics does
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        return _compute_metrics(response_times, rt_valid, success, trial_times, duration)
+
+
+def _compute_metrics(response_times, rt_valid, success, trial_times, duration):
+    count = success.size
+    if count == 0:
+        return None
+
+    successful_trials = _sum(success)
+    if successful_trials < MIN_SUCCESSFUL_TRIALS:
+        return {
+            'overall_ies': INSUFFICIENT_IES,
+            'ies1': INSUFFICIENT_IES,
+            'ies2': INSUFFICIENT_IES,
+            'ies3': INSUFFICIENT_IES,
+            'focus_drift': 0,
+            'focus_stability': 0,
+            'extra_metrics': {}
+        }
+
+    valid_rt = response_times[rt_valid]
+    overall_accuracy = successful_trials / count
+    overall_median_rt = _median(valid_rt)
+    overall_rt_cv = _coefficient_of_variation(valid_rt)
+    response_time_sd = _standard_deviation(valid_rt)
+    lapse_threshold = None
+
+    if overall_median_rt is not None and response_time_sd is not None:
+        lapse_threshold = overall_median_rt + (2 * response_time_sd)
+
+    overall_lapse_rate = None
+    if valid_rt.size and lapse_threshold is not None:
+        overall_lapse_rate = int((valid_rt > lapse_threshold).sum()) / valid_rt.size
+
+    # Blocks keep trials in trial-time order so that their sums add up in the reference order
+    order = np.argsort(trial_times, kind='stable')
+    ordered_rt = response_times[order]
+    ordered_valid = rt_valid[order]
+    ordered_success = success[order]
+    blocks = [
+        _summarize_block(ordered_rt[mask], ordered_valid[mask], ordered_success[mask], lapse_threshold)
+        for mask in _time_third_masks(trial_times[order], duration)
+    ]
+    first_block, second_block, third_block = blocks
+
+    ies1 = first_block['ies']
+    ies2 = second_block['ies']
+    ies3 = third_block['ies']
+    overall_ies, focus_drift, focus_stability, ies_decrement, ies_slope = _ies_summary(ies1, ies2, ies3)
+
+    post_error_rt_delta = None
+    post_error_accuracy_delta = None
+
+    follows_error = success[:-1] == 0
+    if follows_error.any() and (~follows_error).any():
+        next_rt = response_times[1:]
+        next_valid = rt_valid[1:]
+        next_success = success[1:]
+
+        post_error_rt = _mean(next_rt[follows_error & next_valid])
+        post_correct_rt = _mean(next_rt[~follows_error & next_valid])
+        post_error_accuracy = _mean(next_success[follows_error])
+        post_correct_accuracy = _mean(next_success[~follows_error])
+
+        if post_error_rt is not None and post_correct_rt is not None:
+            post_error_rt_delta = post_error_rt - post_correct_rt
+
+        if post_error_accuracy is not None and post_correct_accuracy is not None:
+            post_error_accuracy_delta = (post_error_accuracy - post_correct_accuracy) * 100
+
+    trial_numbers = np.arange(1, count + 1, dtype=np.int64)
+
+    extra_metrics = {
+        'overall_accuracy_pct': _percent(overall_accuracy),
+        'overall_median_rt': _round_metric(overall_median_rt),
+        'overall_rt_cv': _round_metric(overall_rt_cv, 4),
+        'overall_lapse_rate_pct': _percent(overall_lapse_rate),
+        'accuracy_first_pct': _percent(first_block['accuracy']),
+        'accuracy_second_pct': _percent(second_block['accuracy']),
+        'accuracy_third_pct': _percent(third_block['accuracy']),
+        'median_rt_first': _round_metric(first_block['median_rt']),
+        'median_rt_second': _round_metric(second_block['median_rt']),
+        'median_rt_third': _round_metric(third_block['median_rt']),
+        'rt_cv_first': _round_metric(first_block['rt_cv'], 4),
+        'rt_cv_second': _round_metric(second_block['rt_cv'], 4),
+        'rt_cv_third': _round_metric(third_block['rt_cv'], 4),
+        'lapse_rate_first_pct': _percent(first_block['lapse_rate']),
+        'lapse_rate_second_pct': _percent(second_block['lapse_rate']),
+        'lapse_rate_third_pct': _percent(third_block['lapse_rate']),
+        'rt_decrement_pct': _round_metric(_percent_change(first_block['median_rt'], third_block['median_rt'])),
+        'accuracy_decrement_pct': _round_metric(_percent_change(first_block['accuracy'], third_block['accuracy'])),
+        'ies_decrement_pct': ies_decrement,
+        'rt_slope': _round_metric(_linear_slope(trial_numbers[rt_valid], valid_rt), 4),
+        'success_slope': _round_metric(_linear_slope(trial_numbers, success), 4),
+        'ies_slope': ies_slope,
+        'error_rate_slope': _round_metric(_linear_slope(trial_numbers, 1 - success), 4),
+        'post_error_rt_delta': _round_metric(post_error_rt_delta),
+        'post_error_accuracy_delta_pp': _round_metric(post_error_accuracy_delta),
+        'rt_success_correlation': _round_metric(_pearson_correlation(valid_rt, success[rt_valid]), 4)
+    }
+
+    return {
+        'overall_ies': overall_ies,
+        'ies1': ies1,
+        'ies2': ies2,
+        'ies3': ies3,
+        'focus_drift': focus_drift,
+        'focus_stability': focus_stability,
+        'extra_metrics': extra_metrics
+    }
+
+
+def calculate_session_metrics(trial_data, duration):
+    """Drop-in replacement for app.calculate_session_metrics."""
+    if not trial_data:
+        return None
+    return compute_metrics(*trials_to_arrays(trial_data), duration)
+
+
+def sessions_to_ragged(sessions):
+    """Pack [(trial_data, duration), ...] into ragged arrays for calculate_batch_metrics.
+
+    Missing response times are encoded as NaN.
+    """
+    offsets = np.zeros(len(sessions) + 1, dtype=np.int64)
+    durations = []
+    parts = []
+    for index, (trial_data, duration) in enumerate(sessions):
+        response_times, rt_valid, success, trial_times = trials_to_arrays(trial_data or [])
+        response_times[~rt_valid] = np.nan
+        parts.append((response_times, success, trial_times))
+        offsets[index + 1] = offsets[index] + success.size
+        durations.append(duration)
+
+    if not parts:
+        empty = np.zeros(0)
+        return empty, np.zeros(0, dtype=np.int64), empty, offsets, durations
+
+    return (
+        np.concatenate([part[0] for part in parts]),
+        np.concatenate([part[1] for part in parts]),
+        np.concatenate([part[2] for part in parts]),
+        offsets,
+        durations
+    )
+
+
+def _row_sums(values):
+    """Sum along the last axis, in order and with the rounding of Python's sum().
+
+    Cells left out of a sum must hold 0.0, which changes neither the plain nor the
+    compensated running sum. Before 3.12 sum() adds left to right, which cumsum does too;
+    from 3.12 it uses Neumaier's compensated summation, replayed here one column at a time
+    for all rows together.
+    """
+    if values.shape[-1] == 0:
+        return np.zeros(values.shape[:-1])
+    if not COMPENSATED_SUM:
+        # sum() starts from the integer 0, so it never returns -0.0
+        return np.cumsum(values, axis=-1)[..., -1] + 0.0
+
+    total = np.zeros(values.shape[:-1])
+    compensation = np.zeros(values.shape[:-1])
+    for column in np.moveaxis(values, -1, 0):
+        running = total + column
+        compensation += np.where(np.abs(total) >= np.abs(column), (total - running) + column, (column - running) + total)
+        total = running
+    return np.where((compensation != 0) & np.isfinite(compensation), total + compensation, total)
+
+
+def _row_medians(values, mask):
+    """Median of the cells of each row (last axis) selected by mask, NaN for rows without any."""
+    counts = mask.sum(axis=-1)
+    ordered = np.sort(np.where(mask, values, np.inf), axis=-1)
+    last = ordered.shape[-1] - 1
+    lower = np.take_along_axis(ordered, np.clip((counts - 1) // 2, 0, last)[..., None], axis=-1)[..., 0]
+    upper = np.take_along_axis(ordered, np.clip(counts // 2, 0, last)[..., None], axis=-1)[..., 0]
+    medians = np.where(counts % 2 == 1, lower, (lower + upper) / 2)
+    return np.where(counts > 0, medians, np.nan)
+
+
+def _nan_to_none(values):
+    return [None if value != value else value for value in values.tolist()]
+
+
+def calculate_batch_metrics(response_times, successes, trial_times, offsets, durations):
+    """Metrics for many sessions given as ragged arrays.
+
+    Session i owns trials offsets[i]:offsets[i + 1] of the flat response_times (NaN when
+    missing), successes (0/1) and trial_times arrays. Returns one metrics dict (or None for a
+    session without trials) per session, identical to compute_metrics.
+
+    The sessions are laid out as the rows of padded matrices and every reduction runs over
+    all rows at once: masked row sums replaying Python's sum(), row sorts for the medians.
+    Only rounding and the three block IES values are handled per session, in Python.
+    """
+    response_times = np.asarray(response_times, dtype=np.float64)
+    successes = np.asarray(successes, dtype=np.int64)
+    trial_times = np.asarray(trial_times, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    if lengths.size == 0 or lengths.max() == 0:
+        return [None] * lengths.size
+
+    columns = np.arange(int(lengths.max()))
+    present = columns < lengths[:, None]
+    cells = np.where(present, offsets[:-1, None] + columns, 0)
+    rt = np.where(present, response_times[cells], np.nan)
+    valid = ~np.isnan(rt)
+    success = np.where(present, successes[cells], 0)
+    times = trial_times[cells]
+    trial_numbers = columns + 1
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        successful = success.sum(axis=1)
+        rt_count = valid.sum(axis=1)
+
+        # Trials in trial-time order (stable, padding last) for the time-third blocks
+        order = np.lexsort((np.where(present, times, 0.0), ~present), axis=-1)
+        ordered_rt = np.take_along_axis(rt, order, axis=-1)
+        ordered_valid = np.take_along_axis(valid, order, axis=-1)
+        ordered_success = np.take_along_axis(success, order, axis=-1)
+        ordered_times = np.take_along_axis(times, order, axis=-1)
+
+        total_time = np.array([_to_float(duration) or 0.0 for duration in durations], dtype=np.float64)
+        latest = np.max(np.where(present, times, -np.inf), axis=1)
+        total_time = np.where(total_time == 0, latest, total_time)
+        total_time = np.where(total_time == 0, np.maximum(lengths, 1), total_time)
+        interval = (total_time / 3)[:, None]
+        block_of = np.where(ordered_times < interval, 0, np.where(ordered_times < 2 * interval, 1, 2))
+        in_block = present[None] & (block_of[None] == np.arange(3)[:, None, None])
+        block_valid = in_block & ordered_valid[None]
+        block_size = in_block.sum(axis=-1)
+        block_rt_count = block_valid.sum(axis=-1)
+
+        # A trial follows an error when the previous trial of its session failed
+        pair = present[:, 1:]
+        follows_error = pair & (success[:, :-1] == 0)
+        follows_correct = pair & (success[:, :-1] != 0)
+        next_valid = valid[:, 1:]
+        next_rt = rt[:, 1:]
+
+        # First pass: plain sums
+        first_sums = _row_sums(np.stack([
+            np.where(valid, rt, 0.0),
+            *np.where(block_valid, ordered_rt[None], 0.0),
+            np.pad(np.where(follows_error & next_valid, next_rt, 0.0), ((0, 0), (0, 1))),
+            np.pad(np.where(follows_correct & next_valid, next_rt, 0.0), ((0, 0), (0, 1)))
+        ]))
+        rt_mean = first_sums[0] / rt_count
+        block_mean = first_sums[1:4] / block_rt_count
+        post_error_rt = first_sums[4] / (follows_error & next_valid).sum(axis=1)
+        post_correct_rt = first_sums[5] / (follows_correct & next_valid).sum(axis=1)
+
+        # Means of integers are exact; x - mean promotes to float as in Python
+        valid_number_mean = np.where(valid, trial_numbers, 0).sum(axis=1) / rt_count
+        number_mean = np.where(present, trial_numbers, 0).sum(axis=1) / lengths
+        success_mean = successful / lengths
+        error_mean = (lengths - successful) / lengths
+        valid_success_mean = np.where(valid, success, 0).sum(axis=1) / rt_count
+
+        rt_deviation = rt - rt_mean[:, None]
+        valid_number_deviation = trial_numbers - valid_number_mean[:, None]
+        number_deviation = trial_numbers - number_mean[:, None]
+        valid_success_deviation = success - valid_success_mean[:, None]
+
+        # Second pass: sums around those means
+        second_sums = _row_sums(np.stack([
+            np.where(valid, rt_deviation ** 2, 0.0),
+            *np.where(block_valid, (ordered_rt[None] - block_mean[:, :, None]) ** 2, 0.0),
+            np.where(valid, valid_number_deviation ** 2, 0.0),
+            np.where(valid, valid_number_deviation * rt_deviation, 0.0),
+            np.where(present, number_deviation ** 2, 0.0),
+            np.where(present, number_deviation * (success - success_mean[:, None]), 0.0),
+            np.where(present, number_deviation * ((1 - success) - error_mean[:, None]), 0.0),
+            np.where(valid, valid_success_deviation ** 2, 0.0),
+            np.where(valid, rt_deviation * valid_success_deviation, 0.0)
+        ]))
+        rt_sd = np.sqrt(second_sums[0] / rt_count)
+        block_sd = np.sqrt(second_sums[1:4] / block_rt_count)
+
+        rt_median = _row_medians(rt, valid)
+        lapse_threshold = rt_median + 2 * rt_sd
+        lapses = valid & (rt > lapse_threshold[:, None])
+        block_lapses = (block_valid & (ordered_rt[None] > lapse_threshold[None, :, None])).sum(axis=-1)
+        block_median = _row_medians(ordered_rt[None], block_valid)
+
+        block_correct = block_valid & (ordered_success[None] == 1)
+        block_correct_count = block_correct.sum(axis=-1)
+        block_ies = np.where(
+            (block_size > 0) & (block_correct_count > 0),
+            _row_medians(ordered_rt[None], block_correct) / (block_correct_count / block_size),
+            np.nan
+        )
+
+        two_or_more = rt_count >= 2
+        success_sd = np.sqrt(second_sums[9] / rt_count)
+        correlation = np.where(
+            two_or_more & (rt_sd != 0) & (success_sd != 0),
+            (second_sums[10] / rt_count) / (rt_sd * success_sd),
+            np.nan
+        )
+
+        metrics = {
+            'accuracy': successful / lengths,
+            'median_rt': rt_median,
+            'rt_cv': np.where(rt_mean != 0, rt_sd / rt_mean, np.nan),
+            'lapse_rate': lapses.sum(axis=1) / rt_count,
+            'block_accuracy': np.where(in_block & (ordered_success[None] == 1), 1, 0).sum(axis=-1) / block_size,
+            'block_median_rt': block_median,
+            'block_rt_cv': np.where(block_mean != 0, block_sd / block_mean, np.nan),
+            'block_lapse_rate': block_lapses / block_rt_count,
+            'block_ies': block_ies,
+            'rt_slope': np.where(two_or_more & (second_sums[4] != 0), second_sums[5] / second_sums[4], np.nan),
+            'success_slope': np.where((lengths >= 2) & (second_sums[6] != 0), second_sums[7] / second_sums[6], np.nan),
+            'error_rate_slope': np.where((lengths >= 2) & (second_sums[6] != 0), second_sums[8] / second_sums[6], np.nan),
+            'post_error_rt': post_error_rt,
+            'post_correct_rt': post_correct_rt,
+            'post_error_accuracy': np.where(follows_error, success[:, 1:], 0).sum(axis=1) / follows_error.sum(axis=1),
+            'post_correct_accuracy': np.where(follows_correct, success[:, 1:], 0).sum(axis=1) / follows_correct.sum(axis=1),
+            'rt_success_correlation': correlation
+        }
+
+    # Undefined values are NaN so far; as lists with None they read like the reference's
+    values = {}
+    for name, array in metrics.items():
+        if array.ndim == 2:
+            values[name] = list(zip(*(_nan_to_none(row) for row in array)))
+        else:
+            values[name] = _nan_to_none(array)
+    successful = successful.tolist()
+    lengths = lengths.tolist()
+
+    results = []
+    for index, count in enumerate(lengths):
+        if count == 0:
+            results.append(None)
+            continue
+        if successful[index] < MIN_SUCCESSFUL_TRIALS:
+            results.append({
+                'overall_ies': INSUFFICIENT_IES,
+                'ies1': INSUFFICIENT_IES,
+                'ies2': INSUFFICIENT_IES,
+                'ies3': INSUFFICIENT_IES,
+                'focus_drift': 0,
+                'focus_stability': 0,
+                'extra_metrics': {}
+            })
+            continue
+        results.append(_batch_session_metrics({name: column[index] for name, column in values.items()}))
+    return results
+
+
+def _batch_session_metrics(session):
+    """The metrics dict of one session from its values computed by calculate_batch_metrics."""
+    ies1, ies2, ies3 = (INSUFFICIENT_IES if ies is None else round(ies, 2) for ies in session['block_ies'])
+    overall_ies, focus_drift, focus_stability, ies_decrement, ies_slope = _ies_summary(ies1, ies2, ies3)
+
+    first_accuracy, second_accuracy, third_accuracy = session['block_accuracy']
+    first_median_rt, second_median_rt, third_median_rt = session['block_median_rt']
+    first_rt_cv, second_rt_cv, third_rt_cv = session['block_rt_cv']
+    first_lapse_rate, second_lapse_rate, third_lapse_rate = session['block_lapse_rate']
+
+    post_error_rt_delta = None
+    post_error_accuracy_delta = None
+    if session['post_error_accuracy'] is not None and session['post_correct_accuracy'] is not None:
+        if session['post_error_rt'] is not None and session['post_correct_rt'] is not None:
+            post_error_rt_delta = session['post_error_rt'] - session['post_correct_rt']
+        post_error_accuracy_delta = (session['post_error_accuracy'] - session['post_correct_accuracy']) * 100
+
+    return {
+        'overall_ies': overall_ies,
+        'ies1': ies1,
+        'ies2': ies2,
+        'ies3': ies3,
+        'focus_drift': focus_drift,
+        'focus_stability': focus_stability,
+        'extra_metrics': {
+            'overall_accuracy_pct': _percent(session['accuracy']),
+            'overall_median_rt': _round_metric(session['median_rt']),
+            'overall_rt_cv': _round_metric(session['rt_cv'], 4),
+            'overall_lapse_rate_pct': _percent(session['lapse_rate']),
+            'accuracy_first_pct': _percent(first_accuracy),
+            'accuracy_second_pct': _percent(second_accuracy),
+            'accuracy_third_pct': _percent(third_accuracy),
+            'median_rt_first': _round_metric(first_median_rt),
+            'median_rt_second': _round_metric(second_median_rt),
+            'median_rt_third': _round_metric(third_median_rt),
+            'rt_cv_first': _round_metric(first_rt_cv, 4),
+            'rt_cv_second': _round_metric(second_rt_cv, 4),
+            'rt_cv_third': _round_metric(third_rt_cv, 4),
+            'lapse_rate_first_pct': _percent(first_lapse_rate),
+            'lapse_rate_second_pct': _percent(second_lapse_rate),
+            'lapse_rate_third_pct': _percent(third_lapse_rate),
+            'rt_decrement_pct': _round_metric(_percent_change(first_median_rt, third_median_rt)),
+            'accuracy_decrement_pct': _round_metric(_percent_change(first_accuracy, third_accuracy)),
+            'ies_decrement_pct': ies_decrement,
+            'rt_slope': _round_metric(session['rt_slope'], 4),
+            'success_slope': _round_metric(session['success_slope'], 4),
+            'ies_slope': ies_slope,
+            'error_rate_slope': _round_metric(session['error_rate_slope'], 4),
+            'post_error_rt_delta': _round_metric(post_error_rt_delta),
+            'post_error_accuracy_delta_pp': _round_metric(post_error_accuracy_delta),
+            'rt_success_correlation': _round_metric(session['rt_success_correlation'], 4)
+        }
+    }
+
+
+def metrics_table(results):
+    """Rows of metric values in DATA_SHEET_HEADERS order, from 'Overall IES Score' onwards."""
+    table = []
+    for metrics in results:
+        if metrics is None:
+            table.append([""] * (len(SUMMARY_METRIC_KEYS) + len(EXTRA_METRIC_KEYS)))
+            continue
+        extra_metrics = metrics['extra_metrics']
+        table.append(
+            [metrics[key] for key in SUMMARY_METRIC_KEYS]
+            + [extra_metrics.get(key, '') for key in EXTRA_METRIC_KEYS]
+        )
+    return table
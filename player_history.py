@@ -0,0 +1,210 @@
+import collections
+import threading
+import time
+
+from leaderboard import LEADERBOARD_DIFFICULTIES, normalize_player_name, parse_float
+
+INSUFFICIENT_IES = 999999
+
+# Weights of the combined score: peak performance, recent form and consistency
+COMBINED_SCORE_WEIGHTS = (
+    ('best_ies', 0.5),
+    ('ew_ies', 0.3),
+    ('rolling_mean_ies', 0.2)
+)
+
+
+class DifficultyAggregates:
+    """Running IES aggregates of one player at one difficulty, each updated in O(1)."""
+
+    def __init__(self, window, ew_alpha):
+        self.ew_alpha = ew_alpha
+        self.count = 0
+        self.best_ies = None
+        self.last_ies = None
+        self.ew_ies = None
+        self.best_drift = 0
+        self.best_stability = 0
+        self.best_board_time = 0
+        self._window = collections.deque(maxlen=window)
+        self._window_sum = 0.0
+
+    def add(self, ies, drift, stability, board_time):
+        self.count += 1
+        self.last_ies = ies
+
+        if len(self._window) == self._window.maxlen:
+            self._window_sum -= self._window[0]
+        self._window.append(ies)
+        self._window_sum += ies
+
+        self.ew_ies = ies if self.ew_ies is None else self.ew_alpha * ies + (1 - self.ew_alpha) * self.ew_ies
+
+        if self.best_ies is None or ies < self.best_ies:
+            self.best_ies = ies
+            self.best_drift = drift
+            self.best_stability = stability
+            self.best_board_time = board_time
+
+    @property
+    def rolling_mean_ies(self):
+        return self._window_sum / len(self._window) if self._window else None
+
+    @property
+    def combined_score(self):
+        if not self.count:
+            return None
+        return sum(weight * getattr(self, name) for name, weight in COMBINED_SCORE_WEIGHTS)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'best_ies': self.best_ies,
+            'last_ies': self.last_ies,
+            'rolling_mean_ies': round(self.rolling_mean_ies, 2),
+            'ew_ies': round(self.ew_ies, 2),
+            'combined_score': round(self.combined_score, 2)
+        }
+
+
+class PlayerHistoryIndex:
+    """Sessions of every player, keyed by normalized Patient Name, with per-difficulty aggregates.
+
+    Sessions are added one Data row at a time, so a new submission never rescans the sheet.
+    Adding a row whose Session ID (the session_id_column cell) was already recorded, as the
+    submit path and the write-behind flush both do, is a no-op. Rows without a Session ID,
+    stored before the column existed, are always added.
+    """
+
+    def __init__(self, window=5, ew_alpha=0.3, session_id_column=None):
+        self.window = window
+        self.ew_alpha = ew_alpha
+        self.session_id_column = session_id_column
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._players = {}
+            self._seen = set()
+            self.loaded_at = None
+
+    @property
+    def loaded(self):
+        return self.loaded_at is not None
+
+    def is_stale(self, max_age_seconds):
+        if not self.loaded:
+            return True
+        if not max_age_seconds:
+            return False
+        return (time.monotonic() - self.loaded_at) >= max_age_seconds
+
+    def load_rows(self, rows):
+        """Rebuild the index from Data rows in the order they were stored."""
+        with self._lock:
+            self.clear()
+            for row in rows:
+                self.add_row(row)
+            self.loaded_at = time.monotonic()
+
+    def add_row(self, row):
+        """Record one Data row; returns the session, or None if the row was skipped or already recorded.
+
+        Data sheet columns: Date, Time, Patient Name, Difficulty, Duration,
+        Board Display Time, Overall IES Score, IES1, IES2, IES3, Focus Drift, Focus Stability
+        """
+        padded = list(row) + [""] * max(0, 12 - len(row))
+        name = str(padded[2]).strip()
+        difficulty = str(padded[3]).lower()
+        ies = parse_float(padded[6], None)
+        if not name or difficulty not in LEADERBOARD_DIFFICULTIES or ies is None or ies >= INSUFFICIENT_IES:
+            return None
+
+        player_key = normalize_player_name(name)
+        session_id = None
+        if self.session_id_column is not None and self.session_id_column < len(row):
+            session_id = str(row[self.session_id_column]).strip() or None
+        drift = parse_float(padded[10], 0)
+        stability = parse_float(padded[11], 0)
+        board_time = parse_float(padded[5], 0)
+        duration = parse_float(padded[4], None)
+
+        with self._lock:
+            if session_id is not None:
+                if session_id in self._seen:
+                    return None
+                self._seen.add(session_id)
+
+            player = self._players.get(player_key)
+            if player is None:
+                player = self._players[player_key] = {'name': name, 'sessions': [], 'difficulties': {}}
+            player['name'] = name
+
+            aggregates = player['difficulties'].get(difficulty)
+            if aggregates is None:
+                aggregates = player['difficulties'][difficulty] = DifficultyAggregates(self.window, self.ew_alpha)
+            aggregates.add(ies, drift, stability, board_time)
+
+            session = {
+                'date': padded[0],
+                'time': padded[1],
+                'difficulty': difficulty,
+                'duration': duration,
+                'board_time': board_time,
+                'ies': ies,
+                'drift': drift,
+                'stability': stability
+            }
+            player['sessions'].append(session)
+            return session
+
+    def all_sessions(self):
+        with self._lock:
+            return [session for player in self._players.values() for session in player['sessions']]
+
+    def player_summary(self, name, limit=None):
+        """Aggregates per difficulty plus the session list (newest first), or None for an unknown player."""
+        with self._lock:
+            player = self._players.get(normalize_player_name(name))
+            if player is None:
+                return None
+            sessions = player['sessions'][::-1]
+            return {
+                'name': player['name'],
+                'session_count': len(player['sessions']),
+                'difficulties': {
+                    difficulty: aggregates.to_dict()
+                    for difficulty, aggregates in player['difficulties'].items()
+                },
+                'sessions': sessions[:limit] if limit else sessions
+            }
+
+    def leaderboard_entry(self, name, difficulty):
+        """Leaderboard entry of a player ranked on the combined score, or None."""
+        with self._lock:
+            player = self._players.get(normalize_player_name(name))
+            aggregates = player and player['difficulties'].get(difficulty)
+            if not aggregates:
+                return None
+            return self._entry(player, aggregates, difficulty)
+
+    def leaderboard_entries(self):
+        """Combined-score leaderboard entries of every player and difficulty."""
+        with self._lock:
+            return [
+                self._entry(player, aggregates, difficulty)
+                for player in self._players.values()
+                for difficulty, aggregates in player['difficulties'].items()
+            ]
+
+    @staticmethod
+    def _entry(player, aggregates, difficulty):
+        return {
+            'name': player['name'],
+            'difficulty': difficulty,
+            'ies': round(aggregates.combined_score, 2),
+            'drift': aggregates.best_drift,
+            'stability': aggregates.best_stability,
+            'board_time': aggregates.best_board_time
+        }
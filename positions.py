@@ -0,0 +1,311 @@
+"""Chess positions for the attack recognition task, generated with bitboards.
+
+Mirrors ChessGame.generatePosition in static/js/chess.js: a white attacking piece, one black
+piece it attacks, then random filler pieces with at most one piece of each type per color,
+pawns kept off the first and last ranks, kings never adjacent and nothing placed between a
+sliding attacker and its target. Squares are numbered row * 8 + col with row 0 the eighth
+rank, as in the browser board.
+"""
+import collections
+import logging
+import os
+import random
+import threading
+
+PIECE_TYPES = ('P', 'N', 'B', 'R', 'Q', 'K')
+
+DIFFICULTY_LEVELS = {
+    "Easy": (4, 6),
+    "Medium": (6, 8),
+    "Hard": (8, 10),
+    "Very Hard": (10, 12)
+}
+
+FULL_BOARD = (1 << 64) - 1
+
+KNIGHT_OFFSETS = ((2, 1), (1, 2), (-1, 2), (-2, 1), (-2, -1), (-1, -2), (1, -2), (2, -1))
+KING_OFFSETS = ((1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1))
+ROOK_DIRECTIONS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+BISHOP_DIRECTIONS = ((1, 1), (-1, 1), (-1, -1), (1, -1))
+
+
+def square_bit(row, col):
+    return 1 << (row * 8 + col)
+
+
+def squares_of(mask):
+    """Square indexes of the set bits of mask, lowest first."""
+    squares = []
+    while mask:
+        low = mask & -mask
+        squares.append(low.bit_length() - 1)
+        mask ^= low
+    return squares
+
+
+def _offset_table(offsets):
+    table = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        mask = 0
+        for d_row, d_col in offsets:
+            if 0 <= row + d_row < 8 and 0 <= col + d_col < 8:
+                mask |= square_bit(row + d_row, col + d_col)
+        table.append(mask)
+    return table
+
+
+def _ray_table(direction):
+    d_row, d_col = direction
+    table = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        mask = 0
+        row, col = row + d_row, col + d_col
+        while 0 <= row < 8 and 0 <= col < 8:
+            mask |= square_bit(row, col)
+            row, col = row + d_row, col + d_col
+        table.append(mask)
+    return table
+
+
+KNIGHT_ATTACKS = _offset_table(KNIGHT_OFFSETS)
+KING_ATTACKS = _offset_table(KING_OFFSETS)
+# White pawns capture towards row 0, black pawns towards row 7
+PAWN_ATTACKS = {
+    'w': _offset_table(((-1, -1), (-1, 1))),
+    'b': _offset_table(((1, -1), (1, 1)))
+}
+
+# Rays per direction; a direction is "positive" when it walks towards higher square indexes
+RAYS = {direction: _ray_table(direction) for direction in ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+POSITIVE_DIRECTIONS = {direction for direction in RAYS if direction[0] * 8 + direction[1] > 0}
+SLIDER_DIRECTIONS = {
+    'R': ROOK_DIRECTIONS,
+    'B': BISHOP_DIRECTIONS,
+    'Q': ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+}
+
+
+def _between_table():
+    """between[a][b]: squares strictly between a and b when they share a line, 0 otherwise."""
+    between = [[0] * 64 for _ in range(64)]
+    for direction, table in RAYS.items():
+        for square in range(64):
+            # Walk the ray away from square
+            targets = squares_of(table[square])
+            if direction not in POSITIVE_DIRECTIONS:
+                targets.reverse()
+            path = 0
+            for target in targets:
+                between[square][target] = path
+                path |= 1 << target
+    return between
+
+
+BETWEEN = _between_table()
+
+# Pawns never stand on the first or last rank
+PAWN_SQUARES = FULL_BOARD & ~(0xFF | (0xFF << 56))
+
+
+def sliding_attacks(square, occupied, directions):
+    """Squares attacked along directions, stopping at (and including) the first occupied square."""
+    attacks = 0
+    for direction in directions:
+        ray = RAYS[direction][square]
+        blockers = ray & occupied
+        if blockers:
+            if direction in POSITIVE_DIRECTIONS:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= RAYS[direction][first]
+        attacks |= ray
+    return attacks
+
+
+def attacks_from(piece_type, color, square, occupied=0):
+    if piece_type == 'N':
+        return KNIGHT_ATTACKS[square]
+    if piece_type == 'K':
+        return KING_ATTACKS[square]
+    if piece_type == 'P':
+        return PAWN_ATTACKS[color][square]
+    return sliding_attacks(square, occupied, SLIDER_DIRECTIONS[piece_type])
+
+
+def _random_square(rng, mask):
+    squares = squares_of(mask)
+    return rng.choice(squares) if squares else None
+
+
+def generate_position(difficulty, rng=random):
+    """One position as served to the browser (board, attackingPiece, attackedPieces, fen)."""
+    min_pieces, max_pieces = DIFFICULTY_LEVELS[difficulty]
+
+    while True:
+        position = _try_generate(rng, rng.randint(min_pieces, max_pieces))
+        if position is not None:
+            return position
+
+
+def _try_generate(rng, piece_count):
+    pieces = {}
+    used = {'w': set(), 'b': set()}
+    kings = {}
+
+    # Attacking piece: always white, as in the browser game
+    attacking_type = rng.choice(PIECE_TYPES)
+    attacking_square = _random_square(rng, PAWN_SQUARES if attacking_type == 'P' else FULL_BOARD)
+    targets = attacks_from(attacking_type, 'w', attacking_square)
+
+    # Attacked piece: a black piece on one of the attacked squares (a black king would touch a white king)
+    defending_types = [piece_type for piece_type in PIECE_TYPES if not (piece_type == 'K' and attacking_type == 'K')]
+    defending_type = rng.choice(defending_types)
+    target_square = _random_square(rng, targets & (PAWN_SQUARES if defending_type == 'P' else FULL_BOARD))
+    if target_square is None:
+        return None
+
+    for color, piece_type, square in (('w', attacking_type, attacking_square), ('b', defending_type, target_square)):
+        pieces[square] = color + piece_type
+        used[color].add(piece_type)
+        if piece_type == 'K':
+            kings[color] = square
+
+    occupied = (1 << attacking_square) | (1 << target_square)
+    blocked = BETWEEN[attacking_square][target_square] if attacking_type in SLIDER_DIRECTIONS else 0
+    free = FULL_BOARD & ~(occupied | blocked)
+
+    # Filler pieces
+    while len(pieces) < piece_count:
+        color = rng.choice('wb')
+        available = [piece_type for piece_type in PIECE_TYPES if piece_type not in used[color]]
+        if not available:
+            color = 'b' if color == 'w' else 'w'
+            available = [piece_type for piece_type in PIECE_TYPES if piece_type not in used[color]]
+        piece_type = rng.choice(available)
+
+        allowed = free & (PAWN_SQUARES if piece_type == 'P' else FULL_BOARD)
+        other_king = kings.get('b' if color == 'w' else 'w')
+        if piece_type == 'K' and other_king is not None:
+            allowed &= ~KING_ATTACKS[other_king]
+        square = _random_square(rng, allowed)
+        if square is None:
+            return None
+
+        pieces[square] = color + piece_type
+        used[color].add(piece_type)
+        if piece_type == 'K':
+            kings[color] = square
+        occupied |= 1 << square
+        free &= ~(1 << square)
+
+    black = 0
+    for square, piece in pieces.items():
+        if piece[0] == 'b':
+            black |= 1 << square
+    attacked = attacks_from(attacking_type, 'w', attacking_square, occupied) & black
+
+    board = [[None] * 8 for _ in range(8)]
+    for square, piece in pieces.items():
+        board[square // 8][square % 8] = piece
+
+    # The intended target first, then any other attacked piece
+    attacked_squares = [target_square] + [square for square in squares_of(attacked) if square != target_square]
+    return {
+        'board': board,
+        'attackingPiece': ['w' + attacking_type, attacking_square // 8, attacking_square % 8],
+        'attackedPieces': [[square // 8, square % 8] for square in attacked_squares],
+        'fen': board_to_fen(board)
+    }
+
+
+def board_to_fen(board):
+    ranks = []
+    for row in board:
+        rank = ""
+        empty = 0
+        for piece in row:
+            if piece is None:
+                empty += 1
+                continue
+            if empty:
+                rank += str(empty)
+                empty = 0
+            rank += piece[1] if piece[0] == 'w' else piece[1].lower()
+        if empty:
+            rank += str(empty)
+        ranks.append(rank)
+    return "/".join(ranks) + " w - - 0 1"
+
+
+def generate_positions(difficulty, count, rng=random):
+    return [generate_position(difficulty, rng) for _ in range(count)]
+
+
+class PositionPools:
+    """Warm pools of pre-generated positions per difficulty, refilled by a background thread.
+
+    Requests take positions from the pool; whatever the pool cannot cover is generated on the
+    spot. The refill thread wakes when a pool drops below half of pool_size.
+    """
+
+    def __init__(self, pool_size=500, refill_chunk=50, seed=None):
+        self.pool_size = pool_size
+        self.refill_chunk = refill_chunk
+        self.rng = random.Random(seed)
+        self._pools = {difficulty: collections.deque() for difficulty in DIFFICULTY_LEVELS}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def take(self, difficulty, count):
+        positions = []
+        with self._lock:
+            pool = self._pools[difficulty]
+            while pool and len(positions) < count:
+                positions.append(pool.popleft())
+            low = len(pool) < self.pool_size // 2
+
+        if len(positions) < count:
+            positions.extend(generate_positions(difficulty, count - len(positions), self.rng))
+        if low:
+            self.ensure_started()
+            self._wake.set()
+        return positions
+
+    def sizes(self):
+        with self._lock:
+            return {difficulty: len(pool) for difficulty, pool in self._pools.items()}
+
+    def refill(self):
+        """Top every pool up to pool_size; returns the number of positions generated."""
+        generated = 0
+        for difficulty, pool in self._pools.items():
+            while len(pool) < self.pool_size:
+                batch = generate_positions(difficulty, min(self.refill_chunk, self.pool_size - len(pool)), self.rng)
+                with self._lock:
+                    pool.extend(batch)
+                generated += len(batch)
+        return generated
+
+    def ensure_started(self):
+        """Start the refill thread in this process if it is not already running (fork-safe)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="position-pool-refill", daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.refill()
+            except Exception as e:
+                logging.error(f"Error refilling position pools: {e}")
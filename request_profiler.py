@@ -0,0 +1,181 @@
+"""Opt-in profiling of single requests, kept in a bounded ring buffer on disk.
+
+A request is profiled when it carries the admin token in the X-Profile-Token header, or when
+it is picked by random sampling. Two modes are available:
+
+- "cprofile": deterministic cProfile of the request thread, downloadable as a .pstats file
+  (python -m pstats, snakeviz);
+- "sample": wall-clock stack samples of the request thread taken by a helper thread,
+  downloadable as collapsed stacks for flamegraph.pl / speedscope. Time spent waiting on
+  Google Sheets shows up here, unlike in cProfile's CPU-centric view.
+
+Every profile is a data file plus a JSON metadata file named after the profile id; the oldest
+profiles are deleted once there are more than max_profiles. The directory may be shared by
+all workers.
+"""
+import collections
+import cProfile
+import fcntl
+import glob
+import hmac
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+PROFILE_MODES = ('cprofile', 'sample')
+PROFILE_FORMATS = {'cprofile': 'pstats', 'sample': 'collapsed'}
+
+
+class StackSampler:
+    """Samples the stack of one thread every interval_seconds until stopped."""
+
+    def __init__(self, thread_id, interval_seconds=0.002):
+        self.thread_id = thread_id
+        self.interval_seconds = interval_seconds
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class RequestProfiler:
+    def __init__(self, directory, max_profiles=50, sample_rate=0, admin_token=None, default_mode='cprofile',
+                 sample_interval_seconds=0.002):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.sample_rate = sample_rate
+        self.admin_token = admin_token or None
+        self.default_mode = default_mode if default_mode in PROFILE_MODES else 'cprofile'
+        self.sample_interval_seconds = sample_interval_seconds
+        self._sequence = itertools.count()
+        self._random = random.Random()
+
+    @property
+    def enabled(self):
+        """False when neither sampling nor the admin header can trigger a profile (the hooks are then not installed)."""
+        return bool(self.sample_rate > 0 or self.admin_token)
+
+    def is_admin(self, token):
+        return bool(self.admin_token and token and hmac.compare_digest(token, self.admin_token))
+
+    def requested_mode(self, headers):
+        """Profiling mode for a request with these headers, or None to leave it alone."""
+        if self.is_admin(headers.get('X-Profile-Token')):
+            mode = headers.get('X-Profile-Mode', self.default_mode)
+            return mode if mode in PROFILE_MODES else self.default_mode
+        if self.sample_rate > 0 and self._random.random() < self.sample_rate:
+            return self.default_mode
+        return None
+
+    def start(self, mode):
+        """Start profiling the calling thread; pass the returned capture to finish()."""
+        capture = {'mode': mode, 'started': time.perf_counter(), 'captured_at': time.time()}
+        if mode == 'sample':
+            capture['sampler'] = StackSampler(threading.get_ident(), self.sample_interval_seconds)
+            capture['sampler'].start()
+        else:
+            capture['profile'] = cProfile.Profile()
+            try:
+                capture['profile'].enable()
+            except ValueError:
+                # Another profiler is already active in this thread
+                return None
+        return capture
+
+    @staticmethod
+    def stop(capture):
+        if capture.get('stopped'):
+            return
+        capture['stopped'] = True
+        capture['duration_ms'] = round((time.perf_counter() - capture['started']) * 1000, 3)
+        if 'sampler' in capture:
+            capture['sampler'].stop()
+        else:
+            capture['profile'].disable()
+
+    def finish(self, capture, metadata):
+        """Stop the capture and store it with its metadata; returns the profile id."""
+        self.stop(capture)
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = f"{int(capture['captured_at'] * 1000)}-{os.getpid()}-{next(self._sequence)}"
+        profile_format = PROFILE_FORMATS[capture['mode']]
+        data_path = os.path.join(self.directory, f"{profile_id}.{profile_format}")
+
+        if capture['mode'] == 'sample':
+            with open(data_path, 'w') as f:
+                f.write(capture['sampler'].collapsed())
+        else:
+            capture['profile'].dump_stats(data_path)
+
+        metadata = dict(
+            metadata, id=profile_id, mode=capture['mode'], format=profile_format,
+            duration_ms=capture['duration_ms'], captured_at=capture['captured_at'], pid=os.getpid()
+        )
+        with open(os.path.join(self.directory, f"{profile_id}.json"), 'w') as f:
+            json.dump(metadata, f)
+
+        self._evict()
+        return profile_id
+
+    def _evict(self):
+        with open(os.path.join(self.directory, ".lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                ids = self._ids()
+                for profile_id in ids[:max(0, len(ids) - self.max_profiles)]:
+                    for path in glob.glob(os.path.join(self.directory, f"{profile_id}.*")):
+                        os.remove(path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _ids(self):
+        """Profile ids, oldest first (ids start with the capture time in milliseconds)."""
+        paths = glob.glob(os.path.join(self.directory, "*.json"))
+        ids = [os.path.basename(path)[:-len(".json")] for path in paths]
+        return sorted(ids, key=lambda profile_id: [int(part) for part in profile_id.split("-")])
+
+    def list_profiles(self):
+        """Metadata of every stored profile, newest first."""
+        profiles = []
+        for profile_id in reversed(self._ids()):
+            try:
+                with open(os.path.join(self.directory, f"{profile_id}.json")) as f:
+                    profiles.append(json.load(f))
+            except (FileNotFoundError, ValueError) as e:
+                logging.warning(f"Skipping unreadable profile {profile_id}: {e}")
+        return profiles
+
+    def profile_path(self, profile_id):
+        """(path, format) of a stored profile, or None."""
+        if profile_id not in self._ids():
+            return None
+        for profile_format in PROFILE_FORMATS.values():
+            path = os.path.join(self.directory, f"{profile_id}.{profile_format}")
+            if os.path.exists(path):
+                return path, profile_format
+        return None
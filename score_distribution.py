@@ -0,0 +1,73 @@
+import bisect
+import threading
+
+from leaderboard import parse_float
+
+
+def bucket_value(value):
+    """Normalized Board Display Time / Duration used in bucket keys (None matches every value)."""
+    number = parse_float(value, None)
+    return None if number is None else round(number, 3)
+
+
+class ScoreDistribution:
+    """IES of every session, kept in sorted arrays per (difficulty, board display time, duration).
+
+    Each session is inserted in four buckets: the whole difficulty, the difficulty at its
+    board display time, at its duration, and at both. A lookup is two binary searches in
+    the requested bucket.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._buckets = {}
+
+    def load_sessions(self, sessions):
+        with self._lock:
+            self.clear()
+            for session in sessions:
+                self.add_session(session)
+
+    def add_session(self, session):
+        self.add(session['difficulty'], session['ies'], session.get('board_time'), session.get('duration'))
+
+    def add(self, difficulty, ies, board_time=None, duration=None):
+        board_time = bucket_value(board_time)
+        duration = bucket_value(duration)
+        keys = {
+            (difficulty, None, None),
+            (difficulty, board_time, None),
+            (difficulty, None, duration),
+            (difficulty, board_time, duration)
+        }
+        with self._lock:
+            for key in keys:
+                bisect.insort(self._buckets.setdefault(key, []), ies)
+
+    def percentile_rank(self, ies, difficulty, board_time=None, duration=None):
+        """Position of an IES among the sessions of a bucket (lower IES ranks higher), or None if empty.
+
+        percentile is the share of sessions with a worse IES, counting ties as half.
+        """
+        key = (difficulty, bucket_value(board_time), bucket_value(duration))
+        with self._lock:
+            scores = self._buckets.get(key)
+            if not scores:
+                return None
+            count = len(scores)
+            better = bisect.bisect_left(scores, ies)
+            not_worse = bisect.bisect_right(scores, ies)
+            next_score = scores[better - 1] if better else None
+
+        worse = count - not_worse
+        return {
+            'percentile': round(100 * (worse + 0.5 * (not_worse - better)) / count, 1),
+            'rank': better + 1,
+            'count': count,
+            'next_rank_ies': next_score,
+            'distance_to_next_rank': round(ies - next_score, 2) if next_score is not None else 0
+        }
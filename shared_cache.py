@@ -0,0 +1,239 @@
+"""Cache shared by every worker on the host, kept in a SQLite database in WAL mode.
+
+Entries live in namespaces ("leaderboard", "sheets", "player:<name>", ...). Each namespace
+has a version, and an entry is only valid while it carries its namespace's current
+version: invalidate() bumps the version, which every worker sees on its next read. A
+value computed from data read before an invalidation is refused by put() when it is
+given the version read beforehand, so a slow reload cannot overwrite newer data.
+apply() updates an entry in place and bumps the version in the same transaction, for
+changes (such as a submission) that can be applied without recomputing the value.
+
+Entries expire after their TTL; beyond max_entries the least recently used are evicted.
+Hits and misses are counted per key in memory and added to the shared stats table every
+stats_flush_seconds, together with the access times used for LRU eviction.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL_SECONDS = 300
+DEFAULT_STATS_FLUSH_SECONDS = 5
+
+
+def _encode(value):
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+
+def _decode(blob):
+    return json.loads(zlib.decompress(blob))
+
+
+class SharedCache:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            key TEXT PRIMARY KEY,
+            namespace TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            value BLOB NOT NULL,
+            created REAL NOT NULL,
+            expires REAL NOT NULL,
+            accessed REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS cache_entries_namespace ON cache_entries (namespace);
+        CREATE INDEX IF NOT EXISTS cache_entries_accessed ON cache_entries (accessed);
+
+        CREATE TABLE IF NOT EXISTS cache_namespaces (
+            namespace TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS cache_stats (
+            key TEXT PRIMARY KEY,
+            hits INTEGER NOT NULL DEFAULT 0,
+            misses INTEGER NOT NULL DEFAULT 0
+        );
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 stats_flush_seconds=DEFAULT_STATS_FLUSH_SECONDS, registry=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stats_flush_seconds = stats_flush_seconds
+        self.registry = registry
+        self._local = threading.local()
+        self._reset_stats()
+        os.register_at_fork(after_in_child=self._reset_stats)
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection().executescript(self.SCHEMA)
+
+    def _reset_stats(self):
+        self._stats_lock = threading.Lock()
+        self._pending_stats = {}
+        self._pending_access = {}
+        self._stats_flushed_at = time.monotonic()
+
+    def connection(self):
+        """Connection owned by the calling thread (and process, so it survives a fork)."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def version(self, namespace):
+        """Current version of namespace; pass it to put() when the value takes a while to compute."""
+        row = self.connection().execute(
+            "SELECT version FROM cache_namespaces WHERE namespace = ?", (namespace,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get(self, namespace, key):
+        """Cached value of key, or None when it is missing, expired or invalidated."""
+        row = self.connection().execute(
+            "SELECT e.value, e.version, e.expires, COALESCE(n.version, 0) FROM cache_entries e "
+            "LEFT JOIN cache_namespaces n ON n.namespace = e.namespace WHERE e.key = ? AND e.namespace = ?",
+            (key, namespace)
+        ).fetchone()
+        value = None
+        if row is not None and row[1] == row[3] and row[2] > time.time():
+            value = _decode(row[0])
+        self._count(namespace, key, value is not None)
+        return value
+
+    def put(self, namespace, key, value, version=None, ttl_seconds=None):
+        """Store value; with version, only if namespace has not been invalidated since. Returns True when stored."""
+        now = time.time()
+        blob = _encode(value)
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            current = self._namespace_version(connection, namespace)
+            if version is not None and version != current:
+                return False
+            connection.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, namespace, version, value, created, expires, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, namespace, current, blob, now, now + (ttl_seconds or self.ttl_seconds), now)
+            )
+            self._evict(connection, now)
+            return True
+        finally:
+            connection.execute("COMMIT")
+
+    def apply(self, namespace, key, function):
+        """Bump namespace's version, keeping key valid with function(value) applied to it.
+
+        Every other entry of the namespace is invalidated. Returns the new value, or None
+        when key held no valid value (the next reader computes it from scratch).
+        """
+        now = time.time()
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            current = self._namespace_version(connection, namespace)
+            row = connection.execute(
+                "SELECT value, version, expires FROM cache_entries WHERE key = ? AND namespace = ?", (key, namespace)
+            ).fetchone()
+            version = self._bump(connection, namespace, current)
+            if row is None or row[1] != current or row[2] <= now:
+                return None
+            value = function(_decode(row[0]))
+            connection.execute(
+                "UPDATE cache_entries SET value = ?, version = ? WHERE key = ?", (_encode(value), version, key)
+            )
+            return value
+        finally:
+            connection.execute("COMMIT")
+
+    def invalidate(self, namespace):
+        """Invalidate every entry of namespace, in all workers."""
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._bump(connection, namespace, self._namespace_version(connection, namespace))
+            connection.execute("DELETE FROM cache_entries WHERE namespace = ?", (namespace,))
+        finally:
+            connection.execute("COMMIT")
+
+    def stats(self):
+        """{key: {'hits', 'misses', 'hit_rate'}} over all workers (this one's counts flushed first)."""
+        self.flush_stats()
+        rows = self.connection().execute("SELECT key, hits, misses FROM cache_stats ORDER BY hits + misses DESC")
+        return {
+            key: {'hits': hits, 'misses': misses, 'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None}
+            for key, hits, misses in rows
+        }
+
+    def size(self):
+        return self.connection().execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+
+    def flush_stats(self):
+        with self._stats_lock:
+            pending_stats, self._pending_stats = self._pending_stats, {}
+            pending_access, self._pending_access = self._pending_access, {}
+            self._stats_flushed_at = time.monotonic()
+        if not pending_stats:
+            return
+
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT INTO cache_stats (key, hits, misses) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses",
+                [(key, hits, misses) for key, (hits, misses) in pending_stats.items()]
+            )
+            connection.executemany(
+                "UPDATE cache_entries SET accessed = MAX(accessed, ?) WHERE key = ?",
+                [(accessed, key) for key, accessed in pending_access.items()]
+            )
+        finally:
+            connection.execute("COMMIT")
+
+    def _count(self, namespace, key, hit):
+        with self._stats_lock:
+            counts = self._pending_stats.setdefault(key, [0, 0])
+            counts[0 if hit else 1] += 1
+            if hit:
+                self._pending_access[key] = time.time()
+            due = time.monotonic() - self._stats_flushed_at >= self.stats_flush_seconds
+        if self.registry is not None:
+            # Namespaces such as player:<name> are reported by their kind only
+            self.registry.inc("pontifex_shared_cache_requests_total", namespace=namespace.split(':', 1)[0],
+                              result="hit" if hit else "miss")
+        if due:
+            try:
+                self.flush_stats()
+            except sqlite3.Error as e:
+                logging.warning(f"Error flushing shared cache stats: {e}")
+
+    @staticmethod
+    def _namespace_version(connection, namespace):
+        row = connection.execute("SELECT version FROM cache_namespaces WHERE namespace = ?", (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _bump(connection, namespace, current):
+        connection.execute(
+            "INSERT OR REPLACE INTO cache_namespaces (namespace, version) VALUES (?, ?)", (namespace, current + 1)
+        )
+        return current + 1
+
+    def _evict(self, connection, now):
+        connection.execute("DELETE FROM cache_entries WHERE expires <= ?", (now,))
+        connection.execute(
+            "DELETE FROM cache_entries WHERE key IN ("
+            "SELECT key FROM cache_entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
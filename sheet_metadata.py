@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+
+DEFAULT_METADATA_TTL_SECONDS = 300
+TITLES_NAMESPACE = "sheet_titles"
+HEADERS_NAMESPACE = "sheet_headers"
+# Reconciled headers only change with the code, so they are shared for a day
+SHARED_HEADERS_TTL_SECONDS = 86400
+
+
+def get_sheet_title_case_insensitive(sheet_titles, target_title):
+    """Return the sheet title matching target_title, case-insensitively."""
+    target_lower = target_title.lower()
+    return next((title for title in sheet_titles if title.lower() == target_lower), None)
+
+
+class SpreadsheetMetadataCache:
+    """TTL cache of sheet titles plus the header rows already reconciled in this worker.
+
+    Titles expire after ttl_seconds. Header state never expires on its own: a sheet's
+    header row is only checked again when invalidate() is called or when the expected
+    headers change (a schema change).
+
+    With a shared_cache (shared_cache.SharedCache) the titles and reconciled headers are
+    also shared with the other workers, so only one of them reads them from Sheets.
+    """
+
+    def __init__(self, spreadsheet_id, ttl_seconds=DEFAULT_METADATA_TTL_SECONDS, clock=time.monotonic, shared_cache=None):
+        self.spreadsheet_id = spreadsheet_id
+        self.ttl_seconds = ttl_seconds
+        self.shared_cache = shared_cache
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._sheet_titles = None
+        self._fetched_at = None
+        self._reconciled_headers = {}
+
+    def invalidate(self):
+        with self._lock:
+            self._sheet_titles = None
+            self._fetched_at = None
+            self._reconciled_headers.clear()
+            self._shared('invalidate', TITLES_NAMESPACE)
+            self._shared('invalidate', HEADERS_NAMESPACE)
+
+    def get_sheet_titles(self, service, force_refresh=False):
+        with self._lock:
+            if force_refresh or self._is_expired():
+                titles = None if force_refresh else self._shared('get', TITLES_NAMESPACE, TITLES_NAMESPACE)
+                if titles is None:
+                    version = self._shared('version', TITLES_NAMESPACE)
+                    spreadsheet = service.spreadsheets().get(
+                        spreadsheetId=self.spreadsheet_id,
+                        fields="sheets.properties.title"
+                    ).execute()
+                    titles = [s['properties']['title'] for s in spreadsheet.get('sheets', [])]
+                    self._shared('put', TITLES_NAMESPACE, TITLES_NAMESPACE, titles, version, self.ttl_seconds)
+                self._sheet_titles = titles
+                self._fetched_at = self._clock()
+            return list(self._sheet_titles)
+
+    def resolve_title(self, service, target_title):
+        """Return the existing sheet title matching target_title case-insensitively, or None."""
+        return get_sheet_title_case_insensitive(self.get_sheet_titles(service), target_title)
+
+    def ensure_sheet(self, service, sheet_name, headers=None):
+        """Create sheet_name if missing and make sure its first row matches headers.
+
+        Returns the actual (possibly differently cased) title of the sheet.
+        """
+        with self._lock:
+            title = self.resolve_title(service, sheet_name)
+
+            if title is None:
+                service.spreadsheets().batchUpdate(
+                    spreadsheetId=self.spreadsheet_id,
+                    body={
+                        "requests": [{
+                            "addSheet": {
+                                "properties": {"title": sheet_name}
+                            }
+                        }]
+                    }
+                ).execute()
+                title = sheet_name
+                self._sheet_titles.append(title)
+                self._reconciled_headers.pop(title.lower(), None)
+                self._shared('invalidate', TITLES_NAMESPACE)
+
+            if headers is not None:
+                self._reconcile_header(service, title, headers)
+
+            return title
+
+    def _reconcile_header(self, service, title, headers):
+        expected = tuple(str(header) for header in headers)
+        if self._reconciled_headers.get(title.lower()) == expected:
+            return
+        # Another worker already checked this sheet's header row
+        shared_key = f"{HEADERS_NAMESPACE}:{title.lower()}"
+        if self._shared('get', HEADERS_NAMESPACE, shared_key) == list(expected):
+            self._reconciled_headers[title.lower()] = expected
+            return
+        version = self._shared('version', HEADERS_NAMESPACE)
+
+        current = service.spreadsheets().values().get(
+            spreadsheetId=self.spreadsheet_id,
+            range=f"{title}!1:1"
+        ).execute().get("values", [])
+        current_header = tuple(current[0]) if current else ()
+
+        if current_header != expected:
+            logging.info(f"Migrating header row of sheet '{title}' ({len(current_header)} -> {len(expected)} columns)")
+            service.spreadsheets().values().update(
+                spreadsheetId=self.spreadsheet_id,
+                range=f"{title}!A1",
+                valueInputOption="RAW",
+                body={"values": [list(expected)]}
+            ).execute()
+
+        self._reconciled_headers[title.lower()] = expected
+        self._shared('put', HEADERS_NAMESPACE, shared_key, list(expected), version, SHARED_HEADERS_TTL_SECONDS)
+
+    def _shared(self, method, *args):
+        """Call a shared cache method; the Sheets metadata is read directly when the shared cache fails."""
+        if self.shared_cache is None:
+            return None
+        try:
+            return getattr(self.shared_cache, method)(*args)
+        except Exception as e:
+            logging.warning(f"Shared cache {method} failed for sheet metadata: {e}")
+            return None
+
+    def _is_expired(self):
+        if self._sheet_titles is None or self._fetched_at is None:
+            return True
+        return (self._clock() - self._fetched_at) >= self.ttl_seconds
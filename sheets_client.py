@@ -0,0 +1,158 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+
+# The Google client libraries take a large share of the app's import time, so they are
+# imported on first use (or by the warm-up after a worker starts), never at import time.
+
+CREDENTIALS_ENV_VAR = "GOOGLE_SHEET_CREDENTIALS"
+SHEETS_SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+HTTP_TIMEOUT_SECONDS = 30
+
+# HTTP statuses that mean the cached credentials are no longer usable
+AUTH_ERROR_STATUSES = (401,)
+
+
+class SheetsClientPool:
+    """Per-worker pool of Sheets API clients built once and reused across requests.
+
+    Credentials and the parsed discovery document are shared by every thread.
+    Each thread gets its own authorized HTTP connection (httplib2 is not thread-safe),
+    which keeps its TCP/TLS connection alive between requests.
+    """
+
+    def __init__(self, env_var=CREDENTIALS_ENV_VAR, scopes=None, http_timeout=HTTP_TIMEOUT_SECONDS):
+        self.env_var = env_var
+        self.scopes = scopes or SHEETS_SCOPES
+        self.http_timeout = http_timeout
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._discovery_document = None
+        self._credentials = None
+        self._fingerprint = None
+        self._generation = 0
+
+    def get_service(self):
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.discovery import build_from_document
+
+        credentials, generation = self._get_credentials()
+
+        cached_service = getattr(self._local, 'service', None)
+        if cached_service is not None and self._local.generation == generation:
+            return cached_service
+
+        authorized_http = AuthorizedHttp(credentials, http=httplib2.Http(timeout=self.http_timeout))
+        service = build_from_document(self._get_discovery_document(), http=authorized_http)
+
+        self._local.service = service
+        self._local.generation = generation
+        return service
+
+    def invalidate(self):
+        """Drop cached credentials so that every thread rebuilds its client on next use."""
+        with self._lock:
+            self._credentials = None
+            self._fingerprint = None
+            self._generation += 1
+
+    def report_error(self, error):
+        """Invalidate the pool if error shows the credentials were rejected."""
+        if is_auth_error(error):
+            logging.warning("Sheets authentication failed, rebuilding client pool")
+            self.invalidate()
+            return True
+        return False
+
+    def _get_credentials(self):
+        from google.oauth2 import service_account
+
+        credentials_json = os.environ.get(self.env_var)
+        if credentials_json is None:
+            raise ValueError(f"{self.env_var} is not set.")
+
+        fingerprint = hashlib.sha256(credentials_json.encode('utf-8')).hexdigest()
+
+        with self._lock:
+            if self._credentials is None or fingerprint != self._fingerprint:
+                credentials_info = json.loads(credentials_json)
+                self._credentials = service_account.Credentials.from_service_account_info(
+                    credentials_info,
+                    scopes=self.scopes
+                )
+                self._fingerprint = fingerprint
+                self._generation += 1
+
+            return self._credentials, self._generation
+
+    def _get_discovery_document(self):
+        from googleapiclient.discovery_cache import get_static_doc
+
+        if self._discovery_document is None:
+            with self._lock:
+                if self._discovery_document is None:
+                    self._discovery_document = json.loads(get_static_doc("sheets", "v4"))
+        return self._discovery_document
+
+
+def is_auth_error(error):
+    # Errors raised before the client libraries were imported cannot be theirs
+    if 'googleapiclient' not in sys.modules:
+        return False
+    from google.auth.exceptions import RefreshError
+    from googleapiclient.errors import HttpError
+
+    if isinstance(error, RefreshError):
+        return True
+    if isinstance(error, HttpError):
+        return getattr(error.resp, 'status', None) in AUTH_ERROR_STATUSES
+    return False
+
+
+class _RequestProxy:
+    """A googleapiclient request whose execute() runs through around(operation, request_kwargs, execute)."""
+
+    def __init__(self, request, operation, request_kwargs, around):
+        self._request = request
+        self._operation = operation
+        self._request_kwargs = request_kwargs
+        self._around = around
+
+    def execute(self, *args, **kwargs):
+        return self._around(self._operation, self._request_kwargs, lambda: self._request.execute(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+
+class _ResourceProxy:
+    def __init__(self, resource, path, around):
+        self._resource = resource
+        self._path = path
+        self._around = around
+
+    def __getattr__(self, name):
+        attribute = getattr(self._resource, name)
+        if not callable(attribute):
+            return attribute
+        path = f"{self._path}.{name}" if self._path else name
+
+        def call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            if hasattr(result, 'execute'):
+                return _RequestProxy(result, path, kwargs, self._around)
+            return _ResourceProxy(result, path, self._around)
+        return call
+
+
+def wrap_service_requests(service, around):
+    """Sheets service whose requests call around(operation, request_kwargs, execute) instead of execute().
+
+    operation names the API method, e.g. "spreadsheets.values.append"; request_kwargs are the
+    arguments the request was built with and execute() sends it. Wrappers can be nested.
+    """
+    return _ResourceProxy(service, "", around)
@@ -0,0 +1,373 @@
+"""Offline stand-in for the parts of the Google Sheets v4 API used by the app.
+
+Covers spreadsheets().get, spreadsheets().batchUpdate (addSheet) and values().get / update /
+batchUpdate / append / clear, with the request objects and HttpError exceptions of
+googleapiclient so the calling code cannot tell the difference. State lives in memory or in a
+JSON file shared by every process (gunicorn workers) that points at it. Every call can be
+slowed down, rejected with 429 quota errors or failed outright, and is counted per endpoint.
+"""
+import collections
+import fcntl
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from leaderboard import column_letter
+
+RANGE_PATTERN = re.compile(r"^([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$")
+NUMBER_PATTERN = re.compile(r"^-?\d+(\.\d+)?$")
+
+
+def column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+
+def parse_range(a1_range):
+    """'Sheet!A2:L' -> ('Sheet', first_row, first_col, last_row, last_col), 0-based, None when unbounded."""
+    if "!" in a1_range:
+        title, cells = a1_range.rsplit("!", 1)
+    else:
+        title, cells = a1_range, ""
+    if len(title) > 1 and title[0] == title[-1] == "'":
+        title = title[1:-1].replace("''", "'")
+
+    match = RANGE_PATTERN.match(cells.upper())
+    if match is None:
+        raise ValueError(a1_range)
+    start_col, start_row, end_col, end_row = match.groups()
+    single_cell = end_col is None and end_row is None
+
+    first_row = int(start_row) - 1 if start_row else 0
+    first_col = column_index(start_col) if start_col else 0
+    if single_cell:
+        # 'A1' is one cell, 'A' a column, '1' a row, '' the whole sheet
+        last_row = first_row if start_row else None
+        last_col = first_col if start_col else None
+    else:
+        last_row = int(end_row) - 1 if end_row else None
+        last_col = column_index(end_col) if end_col else None
+    return title, first_row, first_col, last_row, last_col
+
+
+def format_value(value):
+    """Cell value as FORMATTED_VALUE would render it."""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def http_error(status, reason, message):
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    response = httplib2.Response({'status': status, 'reason': reason})
+    content = json.dumps({"error": {"code": status, "message": message, "status": reason}}).encode('utf-8')
+    return HttpError(response, content)
+
+
+class FakeRequest:
+    """Mimics googleapiclient's HttpRequest: nothing happens until execute()."""
+
+    def __init__(self, backend, endpoint, operation, writes=False):
+        self.backend = backend
+        self.endpoint = endpoint
+        self.operation = operation
+        self.writes = writes
+
+    def execute(self, num_retries=0, **kwargs):
+        return self.backend.call(self.endpoint, self.operation, self.writes)
+
+
+class FakeValues:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, spreadsheetId, range, valueRenderOption="FORMATTED_VALUE", majorDimension="ROWS", **kwargs):
+        def operation(state):
+            title, first_row, first_col, last_row, last_col = parse_range(range)
+            rows = self.backend.sheet_rows(state, spreadsheetId, title, range)
+            selected = rows[first_row:None if last_row is None else last_row + 1]
+
+            values = []
+            for row in selected:
+                cells = row[first_col:None if last_col is None else last_col + 1]
+                if valueRenderOption != "UNFORMATTED_VALUE":
+                    cells = [format_value(cell) for cell in cells]
+                values.append(self.backend.trim_row(cells))
+            while values and not values[-1]:
+                values.pop()
+
+            result = {"range": range, "majorDimension": "ROWS"}
+            if values:
+                result["values"] = values
+            return result
+
+        return FakeRequest(self.backend, "values.get", operation)
+
+    def update(self, spreadsheetId, range, valueInputOption, body, **kwargs):
+        def operation(state):
+            return self.backend.write_values(state, spreadsheetId, range, valueInputOption, body.get("values", []))
+
+        return FakeRequest(self.backend, "values.update", operation, writes=True)
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        def operation(state):
+            updated_rows = 0
+            for data in body.get("data", []):
+                result = self.backend.write_values(
+                    state, spreadsheetId, data["range"], body.get("valueInputOption", "RAW"), data.get("values", [])
+                )
+                updated_rows += result["updatedRows"]
+            return {"spreadsheetId": spreadsheetId, "totalUpdatedRows": updated_rows}
+
+        return FakeRequest(self.backend, "values.batchUpdate", operation, writes=True)
+
+    def append(self, spreadsheetId, range, valueInputOption, body, insertDataOption=None, **kwargs):
+        def operation(state):
+            title = parse_range(range)[0]
+            rows = self.backend.sheet_rows(state, spreadsheetId, title, range)
+            while rows and not any(cell != "" for cell in rows[-1]):
+                rows.pop()
+            first_row = len(rows)
+            values = body.get("values", [])
+            self.backend.write_values(state, spreadsheetId, f"{title}!A{first_row + 1}", valueInputOption, values)
+            return {
+                "spreadsheetId": spreadsheetId,
+                "updates": {
+                    "updatedRange": f"{title}!A{first_row + 1}:{column_letter(max([len(row) for row in values] or [1]) - 1)}{first_row + len(values)}",
+                    "updatedRows": len(values),
+                    "updatedCells": sum(len(row) for row in values)
+                }
+            }
+
+        return FakeRequest(self.backend, "values.append", operation, writes=True)
+
+    def clear(self, spreadsheetId, range, body=None, **kwargs):
+        def operation(state):
+            title, first_row, first_col, last_row, last_col = parse_range(range)
+            rows = self.backend.sheet_rows(state, spreadsheetId, title, range)
+            self.backend.clear_cells(rows, first_row, first_col, last_row, last_col)
+            return {"spreadsheetId": spreadsheetId, "clearedRange": range}
+
+        return FakeRequest(self.backend, "values.clear", operation, writes=True)
+
+
+class FakeSpreadsheets:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, spreadsheetId, fields=None, **kwargs):
+        def operation(state):
+            sheets = self.backend.spreadsheet(state, spreadsheetId)
+            return {
+                "spreadsheetId": spreadsheetId,
+                "sheets": [
+                    {"properties": {"sheetId": sheet["sheetId"], "title": title, "index": index}}
+                    for index, (title, sheet) in enumerate(sheets.items())
+                ]
+            }
+
+        return FakeRequest(self.backend, "spreadsheets.get", operation)
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        def operation(state):
+            sheets = self.backend.spreadsheet(state, spreadsheetId)
+            replies = []
+            for request in body.get("requests", []):
+                if "addSheet" not in request:
+                    raise http_error(400, "INVALID_ARGUMENT", f"Unsupported request: {', '.join(request)}")
+                title = request["addSheet"].get("properties", {}).get("title") or f"Sheet{len(sheets) + 1}"
+                if title.lower() in (existing.lower() for existing in sheets):
+                    raise http_error(400, "INVALID_ARGUMENT", f'A sheet with the name "{title}" already exists.')
+                sheet_id = max([sheet["sheetId"] for sheet in sheets.values()] or [0]) + 1
+                sheets[title] = {"sheetId": sheet_id, "rows": []}
+                replies.append({"addSheet": {"properties": {"sheetId": sheet_id, "title": title, "index": len(sheets) - 1}}})
+            return {"spreadsheetId": spreadsheetId, "replies": replies}
+
+        return FakeRequest(self.backend, "spreadsheets.batchUpdate", operation, writes=True)
+
+    def values(self):
+        return FakeValues(self.backend)
+
+
+class FakeSheetsService:
+    """Drop-in for the object returned by googleapiclient's build('sheets', 'v4')."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def spreadsheets(self):
+        return FakeSpreadsheets(self.backend)
+
+
+class FakeSheetsBackend:
+    """Spreadsheet state, fault injection and call statistics shared by every FakeSheetsService.
+
+    path=None keeps the spreadsheets in memory; otherwise they are stored in a JSON file and
+    every call re-reads it when another process changed it, under an exclusive file lock.
+    latency_ms (+ up to jitter_ms) is slept on every call. Calls beyond quota_per_minute, and
+    a random quota_error_rate share of calls, fail with 429; failure_rate fails calls with 503.
+    """
+
+    def __init__(self, path=None, latency_ms=0, jitter_ms=0, quota_per_minute=0, quota_error_rate=0,
+                 failure_rate=0, seed=None):
+        self.path = path
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.quota_per_minute = quota_per_minute
+        self.quota_error_rate = quota_error_rate
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+        self._recent_calls = collections.deque()
+        self._state = {}
+        self._loaded_version = None
+        self.reset_stats()
+
+        if path:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+
+    def service(self):
+        return FakeSheetsService(self)
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._calls = collections.Counter()
+            self._errors = collections.Counter()
+            self._seconds = collections.Counter()
+
+    def stats(self):
+        """Calls, injected errors and time spent per endpoint since the last reset."""
+        with self._stats_lock:
+            return {
+                'calls': dict(self._calls),
+                'errors': dict(self._errors),
+                'seconds': {endpoint: round(seconds, 6) for endpoint, seconds in self._seconds.items()},
+                'total_calls': sum(self._calls.values())
+            }
+
+    def call(self, endpoint, operation, writes=False):
+        started = time.perf_counter()
+        with self._stats_lock:
+            self._calls[endpoint] += 1
+        try:
+            self._inject(endpoint)
+            with self._lock:
+                if self.path:
+                    return self._call_file(operation, writes)
+                return json.loads(json.dumps(operation(self._state)))
+        finally:
+            with self._stats_lock:
+                self._seconds[endpoint] += time.perf_counter() - started
+
+    def _inject(self, endpoint):
+        delay = self.latency_ms + (self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000)
+
+        error = None
+        if self.quota_per_minute:
+            now = time.monotonic()
+            with self._stats_lock:
+                while self._recent_calls and now - self._recent_calls[0] >= 60:
+                    self._recent_calls.popleft()
+                if len(self._recent_calls) >= self.quota_per_minute:
+                    error = "quota"
+                else:
+                    self._recent_calls.append(now)
+        if error is None and self.quota_error_rate and self._random.random() < self.quota_error_rate:
+            error = "quota"
+        if error is None and self.failure_rate and self._random.random() < self.failure_rate:
+            error = "failure"
+
+        if error is not None:
+            with self._stats_lock:
+                self._errors[f"{endpoint} {error}"] += 1
+            if error == "quota":
+                raise http_error(429, "RESOURCE_EXHAUSTED", "Quota exceeded for quota metric 'Read requests' (fake)")
+            raise http_error(503, "UNAVAILABLE", "The service is currently unavailable (fake)")
+
+    def _call_file(self, operation, writes):
+        with open(f"{self.path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._reload_if_changed()
+                result = operation(self._state)
+                if writes:
+                    temp_path = f"{self.path}.{os.getpid()}.tmp"
+                    with open(temp_path, 'w') as state_file:
+                        json.dump(self._state, state_file)
+                    os.replace(temp_path, self.path)
+                    self._loaded_version = self._file_version()
+                return json.loads(json.dumps(result))
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _file_version(self):
+        # Every save replaces the file, so a new inode means another process wrote it
+        stat = os.stat(self.path)
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _reload_if_changed(self):
+        try:
+            version = self._file_version()
+        except FileNotFoundError:
+            self._state = {}
+            self._loaded_version = None
+            return
+        if version != self._loaded_version:
+            with open(self.path) as state_file:
+                self._state = json.load(state_file)
+            self._loaded_version = version
+
+    # Helpers used by the request operations, called with the state lock held
+
+    @staticmethod
+    def spreadsheet(state, spreadsheet_id):
+        return state.setdefault(spreadsheet_id, {})
+
+    def sheet_rows(self, state, spreadsheet_id, title, a1_range):
+        sheets = self.spreadsheet(state, spreadsheet_id)
+        for existing, sheet in sheets.items():
+            if existing.lower() == title.lower():
+                return sheet["rows"]
+        raise http_error(400, "INVALID_ARGUMENT", f"Unable to parse range: {a1_range}")
+
+    def write_values(self, state, spreadsheet_id, a1_range, value_input_option, values):
+        title, first_row, first_col, _, _ = parse_range(a1_range)
+        rows = self.sheet_rows(state, spreadsheet_id, title, a1_range)
+        for offset, values_row in enumerate(values):
+            while len(rows) <= first_row + offset:
+                rows.append([])
+            row = rows[first_row + offset]
+            if len(row) < first_col + len(values_row):
+                row.extend([""] * (first_col + len(values_row) - len(row)))
+            for column, value in enumerate(values_row):
+                if value_input_option == "USER_ENTERED" and isinstance(value, str) and NUMBER_PATTERN.match(value):
+                    value = float(value) if "." in value else int(value)
+                row[first_col + column] = "" if value is None else value
+        return {"updatedRange": a1_range, "updatedRows": len(values)}
+
+    @staticmethod
+    def clear_cells(rows, first_row, first_col, last_row, last_col):
+        for row in rows[first_row:None if last_row is None else last_row + 1]:
+            end = len(row) if last_col is None else min(last_col + 1, len(row))
+            for column in range(first_col, end):
+                row[column] = ""
+
+    @staticmethod
+    def trim_row(cells):
+        end = len(cells)
+        while end and cells[end - 1] == "":
+            end -= 1
+        return cells[:end]
@@ -0,0 +1,256 @@
+"""Quota-aware scheduling of Google Sheets API calls.
+
+Google Sheets allows a fixed number of read and of write requests per minute. Every request
+first takes a token from the read or the write bucket, refilled at the per-minute quota; with
+a state_path the buckets live in a file shared by every worker on the host, so the workers
+stay under the quota together. Requests rejected anyway (429) or failing with a transient
+server error are retried with jittered exponential backoff, honouring Retry-After.
+
+Identical idempotent requests (the same reads, header writes or range updates) that arrive
+while an equal request is still waiting for its token are coalesced: they wait for that one
+request and share its result instead of spending their own token. A request that already
+started is never joined, so a caller always sees the effect of the writes it made before.
+"""
+import copy
+import email.utils
+import fcntl
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_BURST = 10
+
+READ_OPERATIONS = frozenset({
+    'spreadsheets.get',
+    'spreadsheets.values.get',
+    'spreadsheets.values.batchGet',
+    'spreadsheets.values.batchGetByDataFilter'
+})
+# Sending these twice has the same effect as sending them once
+IDEMPOTENT_OPERATIONS = READ_OPERATIONS | {
+    'spreadsheets.values.update',
+    'spreadsheets.values.batchUpdate',
+    'spreadsheets.values.clear',
+    'spreadsheets.batchUpdate'
+}
+
+RATE_LIMIT_STATUSES = (429,)
+TRANSIENT_STATUSES = (500, 502, 503, 504)
+
+
+class TokenBucket:
+    """Token bucket refilled at rate_per_minute, holding at most burst tokens.
+
+    With state_path the bucket is shared by every process using that file (flock).
+    """
+
+    def __init__(self, name, rate_per_minute, burst=DEFAULT_BURST, state_path=None, clock=time.time):
+        self.name = name
+        self.rate_per_second = rate_per_minute / 60
+        self.burst = max(1, burst)
+        self.state_path = state_path
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = {'tokens': float(self.burst), 'updated': clock()}
+        self.waiting = 0
+
+        if state_path:
+            os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+        self.waiting = 0
+
+    def acquire(self):
+        """Take one token, sleeping until one is available; returns the seconds waited."""
+        started = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        try:
+            while True:
+                wait = self._try_take()
+                if wait <= 0:
+                    return time.monotonic() - started
+                time.sleep(wait)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def _try_take(self):
+        """Take a token if one is available (returns 0), otherwise return the seconds until the next one."""
+        with self._lock:
+            if not self.state_path:
+                return self._take(self._state)
+
+            with open(self.state_path, 'a+') as state_file:
+                fcntl.flock(state_file, fcntl.LOCK_EX)
+                try:
+                    state_file.seek(0)
+                    try:
+                        state = json.loads(state_file.read())
+                    except ValueError:
+                        state = {'tokens': float(self.burst), 'updated': self._clock()}
+                    wait = self._take(state)
+                    state_file.seek(0)
+                    state_file.truncate()
+                    state_file.write(json.dumps(state))
+                    state_file.flush()
+                    return wait
+                finally:
+                    fcntl.flock(state_file, fcntl.LOCK_UN)
+
+    def _take(self, state):
+        now = self._clock()
+        elapsed = max(0.0, now - state['updated'])
+        state['tokens'] = min(float(self.burst), state['tokens'] + elapsed * self.rate_per_second)
+        state['updated'] = now
+        if state['tokens'] >= 1:
+            state['tokens'] -= 1
+            return 0
+        return (1 - state['tokens']) / self.rate_per_second
+
+
+class _PendingRequest:
+    def __init__(self):
+        self.started = False
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def http_status(error):
+    """HTTP status of a googleapiclient HttpError (read from its response, so the library need not be imported)."""
+    return getattr(getattr(error, 'resp', None), 'status', None)
+
+
+def retry_after_seconds(error):
+    """Seconds requested by the Retry-After header of an HttpError, or None."""
+    response = getattr(error, 'resp', None)
+    value = response.get('retry-after') if hasattr(response, 'get') else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class SheetsScheduler:
+    """Sends Sheets requests within the read and write quotas, retrying rate limited and transient failures.
+
+    Appends are only retried on 429 (the request was rejected, so nothing was written); a 5xx
+    could mean the rows were stored, and appending them again would duplicate the session.
+    registry, when given, receives queue wait times, retries and coalesced requests.
+    """
+
+    def __init__(self, reads_per_minute=DEFAULT_REQUESTS_PER_MINUTE, writes_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 burst=DEFAULT_BURST, state_path=None, max_retries=5, base_delay_seconds=1, max_delay_seconds=32,
+                 registry=None):
+        self.buckets = {
+            'read': TokenBucket('read', reads_per_minute, burst, f"{state_path}.read" if state_path else None),
+            'write': TokenBucket('write', writes_per_minute, burst, f"{state_path}.write" if state_path else None)
+        }
+        self.max_retries = max_retries
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._waiting = {}
+        self._random = random.Random()
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._waiting = {}
+
+    def queue_depths(self):
+        return {name: bucket.waiting for name, bucket in self.buckets.items()}
+
+    def execute(self, operation, request_kwargs, execute):
+        """Run execute() for the request within quota; usable as a wrap_service_requests hook."""
+        key = None
+        if operation in IDEMPOTENT_OPERATIONS:
+            key = (operation, json.dumps(request_kwargs, sort_keys=True, default=str))
+            with self._lock:
+                pending = self._waiting.get(key)
+                if pending is not None and not pending.started:
+                    leader = False
+                else:
+                    pending = self._waiting[key] = _PendingRequest()
+                    leader = True
+
+            if not leader:
+                self._count("pontifex_sheets_coalesced_total", operation=operation)
+                pending.done.wait()
+                if pending.error is not None:
+                    raise pending.error
+                return copy.deepcopy(pending.result)
+        else:
+            pending = None
+
+        try:
+            result = self._send(operation, execute, pending, key)
+        except Exception as e:
+            if pending is not None:
+                pending.error = e
+            raise
+        else:
+            if pending is not None:
+                pending.result = result
+            return result
+        finally:
+            if pending is not None:
+                self._mark_started(pending, key)
+                pending.done.set()
+
+    def _mark_started(self, pending, key):
+        with self._lock:
+            pending.started = True
+            if self._waiting.get(key) is pending:
+                del self._waiting[key]
+
+    def _send(self, operation, execute, pending, key):
+        bucket_name = 'read' if operation in READ_OPERATIONS else 'write'
+        bucket = self.buckets[bucket_name]
+        attempt = 0
+        while True:
+            waited = bucket.acquire()
+            if self.registry is not None:
+                self.registry.observe("pontifex_sheets_queue_wait_seconds", waited, bucket=bucket_name)
+            if pending is not None and not pending.started:
+                # From now on new identical requests must not join: they may follow writes this one would miss
+                self._mark_started(pending, key)
+
+            try:
+                return execute()
+            except Exception as e:
+                status = http_status(e)
+                retryable = status in RATE_LIMIT_STATUSES or (
+                    status in TRANSIENT_STATUSES and operation != 'spreadsheets.values.append'
+                )
+                if not retryable or attempt >= self.max_retries:
+                    raise
+
+                delay = min(self.max_delay_seconds, self.base_delay_seconds * 2 ** attempt)
+                delay = self._random.uniform(delay / 2, delay)
+                retry_after = retry_after_seconds(e)
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                attempt += 1
+                self._count("pontifex_sheets_retries_total", operation=operation, status=status)
+                logging.warning(f"Sheets {operation} failed with {status}, retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _count(self, name, **labels):
+        if self.registry is not None:
+            self.registry.inc(name, **labels)
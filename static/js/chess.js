@@ -49,6 +49,52 @@ class ChessGame {
         this.startTime = Date.now();  // Store the start time of the experience
         this.IES = null; // Store the Inverse Efficiency Score
         this.saveResults = true; // Whether to save results to the server
+        this.positionQueue = []; // Positions generated by the server for positionQueueDifficulty
+        this.positionQueueDifficulty = null;
+        this.fetchingPositions = false;
+        this.positionSignature = null; // Signature of the current position when the server issued it
+    }
+
+    // Fetch a batch of server-generated positions for the current difficulty
+    prefetchPositions(count = 50) {
+        if (this.fetchingPositions) return;
+        const difficulty = this.difficulty;
+        this.fetchingPositions = true;
+
+        fetch(`/positions?difficulty=${encodeURIComponent(difficulty)}&count=${count}`)
+            .then(response => response.ok ? response.json() : null)
+            .then(data => {
+                if (data && data.success && difficulty === this.difficulty) {
+                    if (this.positionQueueDifficulty !== difficulty) {
+                        this.positionQueue = [];
+                        this.positionQueueDifficulty = difficulty;
+                    }
+                    this.positionQueue.push(...data.positions);
+                }
+            })
+            .catch(error => console.warn('Could not prefetch positions:', error))
+            .finally(() => {
+                this.fetchingPositions = false;
+            });
+    }
+
+    // Use a server-generated position when one is available, otherwise generate one locally
+    nextPosition() {
+        if (this.positionQueueDifficulty === this.difficulty && this.positionQueue.length > 0) {
+            const position = this.positionQueue.shift();
+            this.board = position.board;
+            this.attackingPiece = position.attackingPiece;
+            this.attackedPieces = position.attackedPieces;
+            this.blockedSquares = [];
+            this.positionSignature = position.signature ?? null;
+        } else {
+            this.generatePosition();
+            this.positionSignature = null;  // Only positions issued by the server are replayed exactly
+        }
+
+        if (this.positionQueue.length < 10) {
+            this.prefetchPositions();
+        }
     }
 
     initializeControls() {
@@ -87,12 +133,10 @@ class ChessGame {
                     return true;
                 }
             } else if (pieceType === 'P' || pieceType === 'p') {
-                // For pawns, use the correct movement pattern based on color
-                const pawnMovements = PIECE_MOVEMENTS[pieceType];
-                for (const [pawnDx, pawnDy] of pawnMovements) {
-                    if (endRow === startRow + pawnDy && endCol === startCol + pawnDx) {
-                        return true;
-                    }
+                // Pawns capture one row forward: white up the board (row - 1), black down (row + 1)
+                const forwardRow = color === 'w' ? startRow - 1 : startRow + 1;
+                if (endRow === forwardRow && endCol === startCol + dx) {
+                    return true;
                 }
             } else {
                 let currentRow = startRow + dy;
@@ -128,9 +172,9 @@ class ChessGame {
                     }
                 }
             } else if (pieceType === 'P' || pieceType === 'p') {
-                // For pawns, we need to check in the correct direction based on color
-                const newCol = color === 'w' ? col + 1 : col - 1;  // White moves up (-1), Black moves down (+1)
-                const newRow = row + dx;  // Use the dx from the movement pattern for diagonal direction
+                // Pawns capture one row forward: white up the board (row - 1), black down (row + 1)
+                const newRow = color === 'w' ? row - 1 : row + 1;
+                const newCol = col + dx;
                 if (newRow >= 0 && newRow < 8 && newCol >= 0 && newCol < 8) {
                     const target = this.board[newRow][newCol];
                     if (target !== null && target[0] !== color) {
@@ -404,6 +448,27 @@ class ChessGame {
         }
     }
 
+    // Piece placement of the current board in FEN notation (row 0 is the eighth rank)
+    boardToFen() {
+        const ranks = this.board.map(row => {
+            let rank = '';
+            let empty = 0;
+            for (const piece of row) {
+                if (!piece) {
+                    empty++;
+                    continue;
+                }
+                if (empty) {
+                    rank += empty;
+                    empty = 0;
+                }
+                rank += piece[0] === 'w' ? piece[1] : piece[1].toLowerCase();
+            }
+            return empty ? rank + empty : rank;
+        });
+        return `${ranks.join('/')} w - - 0 1`;
+    }
+
     logTrialData(responseTime, success, responsePosition) {
         const trialData = {
             trial: this.currentTrial,
@@ -414,7 +479,9 @@ class ChessGame {
                 `${String.fromCharCode(97 + col)}${8 - row}`).join(';'),
             responseTime,
             success,
-            responsePosition
+            responsePosition,
+            fen: this.boardToFen(),  // lets the server replay the answer
+            positionSignature: this.positionSignature
         };
         
         this.trialData.push(trialData);
@@ -507,7 +574,7 @@ class ChessGame {
             this.board[row][col] = '';
         }
         
-        this.generatePosition();
+        this.nextPosition();
         this.showBoard = true;
         this.showAttackingPiece = false;
         this.hasResponded = false;
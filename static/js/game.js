@@ -67,6 +67,20 @@ class GameUI {
     async loadImages() {
         this.images = {};
         const pieces = ['bP', 'bN', 'bB', 'bR', 'bQ', 'bK', 'wP', 'wN', 'wB', 'wR', 'wQ', 'wK'];
+
+        // All twelve SVGs in one cacheable request when the page links the asset pipeline's bundle
+        const bundle = document.getElementById('pieces-bundle');
+        if (bundle) {
+            try {
+                const response = await fetch(bundle.href);
+                if (response.ok) {
+                    Object.assign(this.images, await response.json());
+                    return;
+                }
+            } catch (error) {
+                console.error('Error loading the piece bundle, loading pieces one by one:', error);
+            }
+        }
         
         for (const piece of pieces) {
             try {
@@ -178,6 +192,9 @@ class GameUI {
                 this.isTrainingMode = false; // Clear training mode flag
                 break;
         }
+
+        // Server-generated positions arrive during the countdown
+        this.game.prefetchPositions();
         
         // Start countdown
         this.startCountdown();
@@ -209,7 +226,7 @@ class GameUI {
     }
 
     startNewTrial() {
-        this.game.generatePosition();
+        this.game.nextPosition();
         this.showBoard = true;
         this.showAttackingPiece = false;
         this.drawChessboard();
@@ -504,6 +521,49 @@ class GameUI {
         this.submitResults();
     }
 
+    // Columnar trials (see trial_payload.py): squares 0-63 from a8, piece codes, times in ms; null if a trial does not fit
+    encodeTrialColumns(trialData) {
+        const pieceCodes = ['wP', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bP', 'bN', 'bB', 'bR', 'bQ', 'bK'];
+        const squareIndex = name => (typeof name === 'string' && /^[a-h][1-8]$/.test(name))
+            ? (8 - Number(name[1])) * 8 + (name.charCodeAt(0) - 97)
+            : -1;
+        const milliseconds = value => (typeof value === 'number' && isFinite(value)) ? Math.round(value * 1000) : -1;
+
+        const columns = {
+            version: 1,
+            trial: trialData.map((trial, index) => trial.trial ?? index + 1),
+            trialTimeMs: trialData.map(trial => milliseconds(trial.trialTime)),
+            attackingPiece: trialData.map(trial => pieceCodes.indexOf(trial.attackingPiece)),
+            attackingSquare: trialData.map(trial => squareIndex(trial.attackingPosition)),
+            attackedSquares: trialData.map(trial => (trial.attackedPieces || '').split(';').filter(Boolean).map(squareIndex)),
+            responseTimeMs: trialData.map(trial => milliseconds(trial.responseTime)),
+            success: trialData.map(trial => (trial.success === 1 ? 1 : 0)),
+            responseSquare: trialData.map(trial => squareIndex(trial.responsePosition)),
+            fen: trialData.map(trial => trial.fen ?? null),
+            positionSignature: trialData.map(trial => trial.positionSignature ?? null)
+        };
+        const valid = columns.attackingPiece.every(code => code >= 0)
+            && columns.attackingSquare.every(square => square >= 0)
+            && columns.attackedSquares.every(squares => squares.every(square => square >= 0));
+        return valid ? columns : null;
+    }
+
+    // Request headers and body for /submit_results: columnar trials, gzip-compressed where the browser supports it
+    async encodeSubmission(fields, trialData) {
+        const trialColumns = this.encodeTrialColumns(trialData);
+        const payload = trialColumns ? { ...fields, trialColumns } : { ...fields, trialData };
+        const json = JSON.stringify(payload);
+        if (!trialColumns || typeof CompressionStream === 'undefined') {
+            return { headers: { 'Content-Type': 'application/json' }, body: json };
+        }
+
+        const stream = new Blob([json]).stream().pipeThrough(new CompressionStream('gzip'));
+        return {
+            headers: { 'Content-Type': 'application/json', 'Content-Encoding': 'gzip' },
+            body: await new Response(stream).blob()
+        };
+    }
+
     submitResults() {
         // Skip data submission in training mode
         if (this.isTrainingMode) {
@@ -511,20 +571,24 @@ class GameUI {
             return;
         }
 
+        // One key per finished session: if this request is sent again, the server answers with the
+        // first response instead of storing the session twice (without a key it hashes the payload)
+        if (!this.game.submissionKey && typeof crypto !== 'undefined' && crypto.randomUUID) {
+            this.game.submissionKey = crypto.randomUUID();
+        }
+
         // Submit the trial data to get server-calculated IES values
-        fetch('/submit_results', {
+        this.encodeSubmission({
+            patientName: this.patientName,
+            difficulty: this.game.difficulty,
+            duration: this.game.duration,
+            boardDisplayTime: this.game.boardDisplayTime
+        }, this.game.trialData)
+        .then(({ headers, body }) => fetch('/submit_results', {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                patientName: this.patientName,
-                trialData: this.game.trialData,
-                difficulty: this.game.difficulty,
-                duration: this.game.duration,
-                boardDisplayTime: this.game.boardDisplayTime
-            })
-        })
+            headers: this.game.submissionKey ? { ...headers, 'Idempotency-Key': this.game.submissionKey } : headers,
+            body: body
+        }))
         .then(response => response.json())
         .then(data => {
             if (data.success) {
@@ -592,6 +656,8 @@ class GameUI {
     }
 
     restartGame() {
+        this.closeLeaderboardStream();
+
         // Clear the leaderboard display
         const leaderboardContainer = document.getElementById('leaderboard-container');
         if (leaderboardContainer) {
@@ -656,7 +722,8 @@ class GameUI {
         
         try {
             console.log('Before fetch request');
-            const response = await fetch('/get_leaderboard');
+            // Only the top 10 is displayed unless the current user may be further down
+            const response = await fetch(highlightCurrentUser ? '/get_leaderboard' : '/get_leaderboard?limit=10');
             console.log('Fetch response status:', response.status);
             
             if (!response.ok) {
@@ -676,6 +743,9 @@ class GameUI {
             if (this.leaderboardLoading) {
                 this.leaderboardLoading.textContent = '';
             }
+
+            // Keep the board up to date while it is shown instead of fetching it again
+            this.openLeaderboardStream(highlightCurrentUser);
         } catch (error) {
             console.error('Error fetching leaderboard:', error);
             
@@ -686,6 +756,78 @@ class GameUI {
         }
     }
 
+    openLeaderboardStream(highlightCurrentUser = false) {
+        if (this.leaderboardStream || typeof EventSource === 'undefined') {
+            return;
+        }
+
+        // The server sends the board first (and again after a lag), then one delta per ranking change;
+        // like fetchLeaderboard, only the top 10 unless the current user may be further down
+        this.leaderboardLimit = highlightCurrentUser ? null : 10;
+        this.leaderboardStream = new EventSource(
+            this.leaderboardLimit === null ? '/leaderboard/stream' : `/leaderboard/stream?limit=${this.leaderboardLimit}`
+        );
+        this.leaderboardStream.addEventListener('snapshot', (event) => {
+            this.leaderboardData = JSON.parse(event.data).leaderboard;
+            this.displayLeaderboard(this.leaderboardData, highlightCurrentUser);
+        });
+        this.leaderboardStream.addEventListener('delta', (event) => {
+            if (!this.leaderboardData) {
+                return;
+            }
+            this.applyLeaderboardDelta(this.leaderboardData, JSON.parse(event.data), this.leaderboardLimit);
+            this.displayLeaderboard(this.leaderboardData, highlightCurrentUser);
+        });
+        this.leaderboardStream.addEventListener('error', () => {
+            // EventSource reconnects by itself unless the server refused the stream
+            if (this.leaderboardStream && this.leaderboardStream.readyState === EventSource.CLOSED) {
+                this.closeLeaderboardStream();
+            }
+        });
+    }
+
+    closeLeaderboardStream() {
+        if (this.leaderboardStream) {
+            this.leaderboardStream.close();
+            this.leaderboardStream = null;
+        }
+        this.leaderboardData = null;
+    }
+
+    applyLeaderboardDelta(leaderboardData, delta, limit = null) {
+        // Same as leaderboard.apply_leaderboard_delta on the server: the player key is case and
+        // spacing insensitive, and the entry goes after equal scores rather than at delta.rank,
+        // which lags behind when it comes from another worker
+        const playerKey = name => String(name ?? '').trim().split(/\s+/).join(' ').toLowerCase();
+        const score = value => {
+            const parsed = parseFloat(value);
+            return Number.isFinite(parsed) ? parsed : 999999;
+        };
+        const entries = leaderboardData[delta.difficulty] || (leaderboardData[delta.difficulty] = []);
+        const current = entries.findIndex(entry => playerKey(entry.name) === playerKey(delta.entry.name));
+        if (current >= 0) {
+            entries.splice(current, 1);
+        }
+        const entryScore = score(delta.entry.score);
+        let low = 0;
+        let high = entries.length;
+        while (low < high) {
+            const middle = (low + high) >> 1;
+            if (entryScore < score(entries[middle].score)) {
+                high = middle;
+            } else {
+                low = middle + 1;
+            }
+        }
+        entries.splice(low, 0, { ...delta.entry });
+        if (limit !== null) {
+            entries.splice(limit);
+        }
+        entries.forEach((entry, index) => {
+            entry.rank = index + 1;
+        });
+    }
+
     parseLeaderboardMetric(entry, key) {
         const value = entry?.[key];
         if (value === undefined || value === null || value === '') {
@@ -0,0 +1,585 @@
+import abc
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from leaderboard import column_letter, normalize_player_name, parse_data_row, parse_float
+
+
+class StorageBackend(abc.ABC):
+    """Persistence interface used by the app for sessions (Data rows) and trials (Trials rows).
+
+    Rows are passed around in sheet layout (lists ordered like DATA_SHEET_HEADERS and
+    TRIALS_SHEET_HEADERS) so every backend stores exactly what the Google Sheet would.
+    A backend missing one of the abstract methods cannot be constructed.
+    """
+
+    # Local backends answer queries in milliseconds and can be read on every request
+    is_local = False
+
+    def __init__(self, data_headers, trials_headers):
+        self.data_headers = list(data_headers)
+        self.trials_headers = list(trials_headers)
+
+    def append_session(self, data_row):
+        self.append_sessions([data_row])
+
+    @abc.abstractmethod
+    def append_sessions(self, data_rows):
+        """Store Data rows after the existing ones."""
+
+    @abc.abstractmethod
+    def append_trials(self, trial_rows):
+        """Store Trials rows after the existing ones."""
+
+    @abc.abstractmethod
+    def query_leaderboard(self):
+        """Return leaderboard entries (dicts with name, difficulty, ies, drift, stability, board_time)."""
+
+    @abc.abstractmethod
+    def query_user_history(self, patient_name):
+        """Return every Data row of a player, oldest first."""
+
+    @abc.abstractmethod
+    def read_trials_page(self, position, page_size):
+        """Return up to page_size (position, trial_row) pairs starting at position, in insertion order.
+
+        Positions are increasing integers; the page after the last returned pair starts at
+        its position + 1. A page shorter than page_size is the last one.
+        """
+
+    @abc.abstractmethod
+    def read_sessions(self):
+        """Return (session_ref, data_row) pairs for every stored session."""
+
+    @abc.abstractmethod
+    def update_sessions(self, updates):
+        """Overwrite stored sessions given (session_ref, data_row) pairs from read_sessions."""
+
+
+class SheetsStorage(StorageBackend):
+    """Google Sheets backed storage: the Data and Trials tabs of the configured spreadsheet."""
+
+    def __init__(self, spreadsheet_id, service_factory, metadata_cache, data_headers, trials_headers,
+                 data_sheet_name="Data", trials_sheet_name="Trials"):
+        super().__init__(data_headers, trials_headers)
+        self.spreadsheet_id = spreadsheet_id
+        self.service_factory = service_factory
+        self.metadata_cache = metadata_cache
+        self.data_sheet_name = data_sheet_name
+        self.trials_sheet_name = trials_sheet_name
+
+    def reconcile_headers(self, service=None):
+        """Create the Data and Trials sheets if needed and bring their header rows up to date."""
+        service = service or self.service_factory()
+        data_sheet_name = self.metadata_cache.ensure_sheet(service, self.data_sheet_name, self.data_headers)
+        trials_sheet_name = self.metadata_cache.ensure_sheet(service, self.trials_sheet_name, self.trials_headers)
+        return data_sheet_name, trials_sheet_name
+
+    def append_sessions(self, data_rows):
+        if data_rows:
+            service = self.service_factory()
+            data_sheet_name, _ = self.reconcile_headers(service)
+            self._append(service, data_sheet_name, data_rows)
+
+    def append_trials(self, trial_rows):
+        if trial_rows:
+            service = self.service_factory()
+            _, trials_sheet_name = self.reconcile_headers(service)
+            self._append(service, trials_sheet_name, trial_rows)
+
+    def read_data_rows(self, last_column="L"):
+        """All Data rows (header excluded), with no row limit."""
+        service = self.service_factory()
+        data_sheet_name = self.metadata_cache.resolve_title(service, self.data_sheet_name)
+        if not data_sheet_name:
+            return []
+        return service.spreadsheets().values().get(
+            spreadsheetId=self.spreadsheet_id,
+            range=f"{data_sheet_name}!A2:{last_column}"
+        ).execute().get("values", [])
+
+    def query_leaderboard(self):
+        entries = []
+        for row in self.read_data_rows():
+            entry = parse_data_row(row)
+            if entry:
+                entries.append(entry)
+        return entries
+
+    def query_user_history(self, patient_name):
+        player_key = normalize_player_name(patient_name)
+        last_column = column_letter(len(self.data_headers) - 1)
+        return [
+            row for row in self.read_data_rows(last_column)
+            if len(row) > 2 and normalize_player_name(row[2]) == player_key
+        ]
+
+    def read_trials_page(self, position, page_size):
+        service = self.service_factory()
+        trials_sheet_name = self.metadata_cache.resolve_title(service, self.trials_sheet_name)
+        if not trials_sheet_name:
+            return []
+
+        # Sheet row numbers are 1-based and row 1 holds the headers
+        first_row = position + 2
+        last_column = column_letter(len(self.trials_headers) - 1)
+        rows = service.spreadsheets().values().get(
+            spreadsheetId=self.spreadsheet_id,
+            range=f"{trials_sheet_name}!A{first_row}:{last_column}{first_row + page_size - 1}",
+            valueRenderOption="UNFORMATTED_VALUE"
+        ).execute().get("values", [])
+        return [(position + offset, row) for offset, row in enumerate(rows)]
+
+    def read_sessions(self):
+        service = self.service_factory()
+        data_sheet_name = self.metadata_cache.resolve_title(service, self.data_sheet_name)
+        if not data_sheet_name:
+            return []
+
+        last_column = column_letter(len(self.data_headers) - 1)
+        rows = service.spreadsheets().values().get(
+            spreadsheetId=self.spreadsheet_id,
+            range=f"{data_sheet_name}!A2:{last_column}",
+            valueRenderOption="UNFORMATTED_VALUE"
+        ).execute().get("values", [])
+        return [(index + 2, row) for index, row in enumerate(rows)]
+
+    def update_sessions(self, updates):
+        if not updates:
+            return
+        service = self.service_factory()
+        data_sheet_name = self.metadata_cache.resolve_title(service, self.data_sheet_name)
+        last_column = column_letter(len(self.data_headers) - 1)
+        service.spreadsheets().values().batchUpdate(
+            spreadsheetId=self.spreadsheet_id,
+            body={
+                "valueInputOption": "RAW",
+                "data": [
+                    {"range": f"{data_sheet_name}!A{sheet_row}:{last_column}{sheet_row}", "values": [list(row)]}
+                    for sheet_row, row in updates
+                ]
+            }
+        ).execute()
+
+    def _append(self, service, sheet_name, rows):
+        service.spreadsheets().values().append(
+            spreadsheetId=self.spreadsheet_id,
+            range=f"{sheet_name}!A:A",
+            valueInputOption="RAW",
+            body={"values": rows}
+        ).execute()
+
+
+SHARD_PERIOD_FORMATS = {'month': '%Y_%m', 'year': '%Y'}
+SHARD_MANIFEST_HEADERS = ['Kind', 'Period', 'Sheet', 'Sealed', 'Version']
+# Trials positions of consecutive shards are this far apart; a sheet holds far fewer rows
+SHARD_POSITION_STRIDE = 10 ** 7
+
+
+class ShardedSheetsStorage(SheetsStorage):
+    """Sheets storage with the Data and Trials rows split into one sheet per period (Data_2026_10, ...).
+
+    A manifest sheet lists the shards in creation order with a sealed flag and a version.
+    Rows are appended to the newest shard of their kind (late rows of an earlier period
+    included), so only that shard grows; creating a newer shard seals the older ones. Rows
+    of sealed shards are cached by this worker and read again only when their version
+    changes, which happens when update_sessions rewrites them (a backfill). The Data and
+    Trials sheets from before sharding become the first, sealed, shards.
+    """
+
+    def __init__(self, spreadsheet_id, service_factory, metadata_cache, data_headers, trials_headers,
+                 data_sheet_name="Data", trials_sheet_name="Trials", manifest_sheet_name="Shards",
+                 period="month", clock=datetime.now):
+        super().__init__(spreadsheet_id, service_factory, metadata_cache, data_headers, trials_headers,
+                         data_sheet_name, trials_sheet_name)
+        if period not in SHARD_PERIOD_FORMATS:
+            raise ValueError(f"Unknown shard period {period!r}, expected one of {sorted(SHARD_PERIOD_FORMATS)}")
+        self.manifest_sheet_name = manifest_sheet_name
+        self.period_format = SHARD_PERIOD_FORMATS[period]
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._manifest = None
+        self._sealed_rows = {}
+
+    def shard_period(self, row):
+        """Period of a Data or Trials row, from its Date column (today's when unreadable)."""
+        try:
+            played_on = datetime.strptime(str(row[0]), '%Y-%m-%d')
+        except (IndexError, ValueError):
+            played_on = self._clock()
+        return played_on.strftime(self.period_format)
+
+    # Manifest
+
+    def _base_names(self):
+        return {'data': self.data_sheet_name, 'trials': self.trials_sheet_name}
+
+    def _headers(self, kind):
+        return self.data_headers if kind == 'data' else self.trials_headers
+
+    def _read_manifest(self, service):
+        title = self.metadata_cache.resolve_title(service, self.manifest_sheet_name)
+        if title is None:
+            return None
+        rows = service.spreadsheets().values().get(
+            spreadsheetId=self.spreadsheet_id,
+            range=f"{title}!A2:E"
+        ).execute().get("values", [])
+
+        shards = []
+        seen = set()
+        for index, row in enumerate(rows):
+            row = list(row) + [""] * (5 - len(row))
+            kind, period, sheet = str(row[0]).lower(), str(row[1]), str(row[2])
+            # Two workers creating the same shard at once both register it; the first entry wins
+            if kind not in ('data', 'trials') or not sheet or sheet.lower() in seen:
+                continue
+            seen.add(sheet.lower())
+            shards.append({
+                'kind': kind,
+                'period': period,
+                'sheet': sheet,
+                'sealed': str(row[3]).upper() in ('1', 'TRUE'),
+                'version': int(parse_float(row[4], 0)),
+                'manifest_row': index + 2
+            })
+        return {'title': title, 'shards': shards}
+
+    def manifest(self, service=None, refresh=False):
+        """The manifest ({'title', 'shards'}), created with the pre-sharding sheets registered if missing."""
+        with self._lock:
+            if self._manifest is not None and not refresh:
+                return self._manifest
+
+            service = service or self.service_factory()
+            manifest = self._read_manifest(service)
+            if manifest is None or not manifest['shards']:
+                title = self.metadata_cache.ensure_sheet(service, self.manifest_sheet_name, SHARD_MANIFEST_HEADERS)
+                legacy = []
+                for kind, base_name in self._base_names().items():
+                    legacy_title = self.metadata_cache.resolve_title(service, base_name)
+                    if legacy_title is not None:
+                        legacy.append([kind, "", legacy_title, 1, 0])
+                if legacy:
+                    self._append(service, title, legacy)
+                manifest = self._read_manifest(service)
+
+            self._manifest = manifest
+            return manifest
+
+    def shards(self, kind, service=None, refresh=False):
+        """Shards of kind ('data' or 'trials'), oldest first."""
+        return [shard for shard in self.manifest(service, refresh)['shards'] if shard['kind'] == kind]
+
+    def _writable_shard(self, service, kind, period):
+        """Title of the shard taking new rows of period, created when period is newer than every shard."""
+        with self._lock:
+            for refresh in (False, True):
+                shards = self.shards(kind, service, refresh=refresh)
+                newest = shards[-1] if shards else None
+                if newest is not None and newest['period'] and newest['period'] >= period:
+                    return newest['sheet']
+            return self._create_shard(service, kind, period, shards)
+
+    def _create_shard(self, service, kind, period, older_shards):
+        title = f"{self._base_names()[kind]}_{period}"
+        try:
+            title = self.metadata_cache.ensure_sheet(service, title, self._headers(kind))
+        except Exception as e:
+            # Most likely another worker added the sheet since the titles were cached
+            logging.warning(f"Creating shard {title} failed ({e}), retrying with fresh sheet titles")
+            self.metadata_cache.invalidate()
+            title = self.metadata_cache.ensure_sheet(service, title, self._headers(kind))
+
+        manifest = self.manifest(service)
+        self._append(service, manifest['title'], [[kind, period, title, 0, 0]])
+        unsealed = [shard for shard in older_shards if not shard['sealed']]
+        if unsealed:
+            self._update_manifest_cells(service, manifest['title'], [(shard, 'D', 1) for shard in unsealed])
+        logging.info(f"Started shard {title}, sealed {[shard['sheet'] for shard in unsealed]}")
+        self._manifest = None
+        return title
+
+    def _update_manifest_cells(self, service, manifest_title, cells):
+        service.spreadsheets().values().batchUpdate(
+            spreadsheetId=self.spreadsheet_id,
+            body={
+                "valueInputOption": "RAW",
+                "data": [
+                    {"range": f"{manifest_title}!{column}{shard['manifest_row']}", "values": [[value]]}
+                    for shard, column, value in cells
+                ]
+            }
+        ).execute()
+
+    # Reads and writes
+
+    def _read_shard(self, service, shard, first_column_range, **request_kwargs):
+        """Rows of a shard from row 2 on; sealed shards are served from this worker's cache."""
+        key = (shard['sheet'].lower(), first_column_range, tuple(sorted(request_kwargs.items())))
+        cached = self._sealed_rows.get(key)
+        if shard['sealed'] and cached is not None and cached[0] == shard['version']:
+            return cached[1]
+
+        rows = service.spreadsheets().values().get(
+            spreadsheetId=self.spreadsheet_id,
+            range=f"{shard['sheet']}!{first_column_range}",
+            **request_kwargs
+        ).execute().get("values", [])
+        if shard['sealed']:
+            self._sealed_rows[key] = (shard['version'], rows)
+        return rows
+
+    def _append_rows(self, kind, rows):
+        if not rows:
+            return
+        service = self.service_factory()
+        by_shard = {}
+        for row in rows:
+            by_shard.setdefault(self._writable_shard(service, kind, self.shard_period(row)), []).append(row)
+        for title, shard_rows in by_shard.items():
+            self.metadata_cache.ensure_sheet(service, title, self._headers(kind))
+            self._append(service, title, shard_rows)
+
+    def reconcile_headers(self, service=None):
+        """Create the current period's shards if needed and bring their header rows up to date."""
+        service = service or self.service_factory()
+        period = self._clock().strftime(self.period_format)
+        return tuple(
+            self.metadata_cache.ensure_sheet(service, self._writable_shard(service, kind, period), self._headers(kind))
+            for kind in ('data', 'trials')
+        )
+
+    def append_sessions(self, data_rows):
+        self._append_rows('data', data_rows)
+
+    def append_trials(self, trial_rows):
+        self._append_rows('trials', trial_rows)
+
+    def read_data_rows(self, last_column="L"):
+        service = self.service_factory()
+        rows = []
+        for shard in self.shards('data', service, refresh=True):
+            rows.extend(self._read_shard(service, shard, f"A2:{last_column}"))
+        return rows
+
+    def read_sessions(self):
+        service = self.service_factory()
+        last_column = column_letter(len(self.data_headers) - 1)
+        sessions = []
+        for shard in self.shards('data', service, refresh=True):
+            rows = self._read_shard(service, shard, f"A2:{last_column}", valueRenderOption="UNFORMATTED_VALUE")
+            sessions.extend(((shard['sheet'], index + 2), row) for index, row in enumerate(rows))
+        return sessions
+
+    def read_trials_page(self, position, page_size):
+        service = self.service_factory()
+        shards = self.shards('trials', service, refresh=True)
+        last_column = column_letter(len(self.trials_headers) - 1)
+        ordinal, offset = divmod(position, SHARD_POSITION_STRIDE)
+
+        # A page continues into the next shard, so only the very last page comes back short
+        page = []
+        while ordinal < len(shards) and len(page) < page_size:
+            wanted = page_size - len(page)
+            first_row = offset + 2
+            rows = service.spreadsheets().values().get(
+                spreadsheetId=self.spreadsheet_id,
+                range=f"{shards[ordinal]['sheet']}!A{first_row}:{last_column}{first_row + wanted - 1}",
+                valueRenderOption="UNFORMATTED_VALUE"
+            ).execute().get("values", [])
+            page.extend((ordinal * SHARD_POSITION_STRIDE + offset + index, row) for index, row in enumerate(rows))
+            if len(rows) < wanted:
+                ordinal, offset = ordinal + 1, 0
+        return page
+
+    def update_sessions(self, updates):
+        if not updates:
+            return
+        service = self.service_factory()
+        last_column = column_letter(len(self.data_headers) - 1)
+        service.spreadsheets().values().batchUpdate(
+            spreadsheetId=self.spreadsheet_id,
+            body={
+                "valueInputOption": "RAW",
+                "data": [
+                    {"range": f"{sheet}!A{sheet_row}:{last_column}{sheet_row}", "values": [list(row)]}
+                    for (sheet, sheet_row), row in updates
+                ]
+            }
+        ).execute()
+
+        # Every worker reads rewritten sealed shards again once their version changed
+        updated_sheets = {sheet.lower() for (sheet, _), _ in updates}
+        manifest = self.manifest(service, refresh=True)
+        bumped = [
+            (shard, 'E', shard['version'] + 1)
+            for shard in manifest['shards'] if shard['sealed'] and shard['sheet'].lower() in updated_sheets
+        ]
+        if bumped:
+            self._update_manifest_cells(service, manifest['title'], bumped)
+            self._manifest = None
+
+
+class SQLiteStorage(StorageBackend):
+    """Local SQLite store in WAL mode, safe to share between the gunicorn workers of one host."""
+
+    is_local = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT,
+            time TEXT,
+            patient_name TEXT,
+            player_key TEXT,
+            difficulty TEXT,
+            duration REAL,
+            board_display_time REAL,
+            overall_ies REAL,
+            focus_drift REAL,
+            focus_stability REAL,
+            row_json TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS sessions_leaderboard ON sessions (difficulty, player_key, overall_ies);
+        CREATE INDEX IF NOT EXISTS sessions_player ON sessions (player_key, id);
+
+        CREATE TABLE IF NOT EXISTS trials (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT,
+            time TEXT,
+            patient_name TEXT,
+            trial INTEGER,
+            trial_time REAL,
+            attacking_piece TEXT,
+            attacking_position TEXT,
+            attacked_pieces TEXT,
+            response_time REAL,
+            success INTEGER,
+            response_position TEXT
+        );
+        CREATE INDEX IF NOT EXISTS trials_session ON trials (date, time, patient_name);
+    """
+
+    def __init__(self, path, data_headers, trials_headers):
+        super().__init__(data_headers, trials_headers)
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection().executescript(self.SCHEMA)
+
+    def connection(self):
+        """Connection owned by the calling thread (and process, so it survives a fork)."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def append_sessions(self, data_rows):
+        records = []
+        for row in data_rows:
+            padded = list(row) + [""] * max(0, 12 - len(row))
+            records.append((
+                padded[0], padded[1], padded[2], normalize_player_name(padded[2]), str(padded[3]).lower(),
+                parse_float(padded[4], None), parse_float(padded[5], None), parse_float(padded[6], 999999),
+                parse_float(padded[10], 0), parse_float(padded[11], 0), json.dumps(list(row))
+            ))
+
+        connection = self.connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "INSERT INTO sessions (date, time, patient_name, player_key, difficulty, duration, board_display_time, "
+                "overall_ies, focus_drift, focus_stability, row_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                records
+            )
+
+    def append_trials(self, trial_rows):
+        records = []
+        for row in trial_rows:
+            padded = list(row) + [""] * max(0, 11 - len(row))
+            records.append((
+                padded[0], padded[1], padded[2], padded[3], parse_float(padded[4], None), padded[5], padded[6],
+                padded[7], parse_float(padded[8], None), 1 if str(padded[9]) == '1' else 0, padded[10]
+            ))
+
+        connection = self.connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "INSERT INTO trials (date, time, patient_name, trial, trial_time, attacking_piece, attacking_position, "
+                "attacked_pieces, response_time, success, response_position) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                records
+            )
+
+    def query_leaderboard(self):
+        rows = self.connection().execute("""
+            SELECT patient_name, difficulty, overall_ies, focus_drift, focus_stability, board_display_time
+            FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY difficulty, player_key ORDER BY overall_ies, id) AS position
+                FROM sessions
+            )
+            WHERE position = 1
+            ORDER BY difficulty, overall_ies, id
+        """).fetchall()
+
+        return [
+            {
+                'name': name,
+                'difficulty': difficulty,
+                'ies': ies,
+                'drift': drift,
+                'stability': stability,
+                'board_time': board_time if board_time is not None else 0
+            }
+            for name, difficulty, ies, drift, stability, board_time in rows
+        ]
+
+    def query_user_history(self, patient_name):
+        rows = self.connection().execute(
+            "SELECT row_json FROM sessions WHERE player_key = ? ORDER BY id",
+            (normalize_player_name(patient_name),)
+        ).fetchall()
+        return [json.loads(row_json) for (row_json,) in rows]
+
+    def read_trials_page(self, position, page_size):
+        rows = self.connection().execute(
+            "SELECT id, date, time, patient_name, trial, trial_time, attacking_piece, attacking_position, "
+            "attacked_pieces, response_time, success, response_position FROM trials WHERE id >= ? ORDER BY id LIMIT ?",
+            (position, page_size)
+        ).fetchall()
+        return [
+            (row[0], ["" if value is None else value for value in row[1:]])
+            for row in rows
+        ]
+
+    def read_sessions(self):
+        rows = self.connection().execute("SELECT id, row_json FROM sessions ORDER BY id").fetchall()
+        return [(session_id, json.loads(row_json)) for session_id, row_json in rows]
+
+    def update_sessions(self, updates):
+        records = []
+        for session_id, row in updates:
+            padded = list(row) + [""] * max(0, 12 - len(row))
+            records.append((
+                parse_float(padded[6], 999999), parse_float(padded[10], 0), parse_float(padded[11], 0),
+                json.dumps(list(row)), session_id
+            ))
+
+        connection = self.connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "UPDATE sessions SET overall_ies = ?, focus_drift = ?, focus_stability = ?, row_json = ? WHERE id = ?",
+                records
+            )
@@ -0,0 +1,195 @@
+import collections
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+QUEUE_STREAMS = ('data', 'trials')
+FLUSH_HISTORY_SIZE = 100
+
+
+class SubmissionQueue:
+    """Durable append-only queue of submissions waiting to be written to Google Sheets.
+
+    Every submission is one JSON line in the queue file. Each output stream (the Data and
+    Trials sheets) keeps its own committed byte offset in a checkpoint file, so a batch that
+    reached one sheet is never appended to it twice if the other sheet fails. The file is
+    shared by all workers on the host: appends hold an exclusive lock on the queue file and
+    only one process flushes at a time. Once every stream has caught up, the file is truncated.
+    """
+
+    def __init__(self, path, streams=QUEUE_STREAMS, max_batch_records=500):
+        self.path = path
+        self.checkpoint_path = f"{path}.checkpoint"
+        self.flush_lock_path = f"{path}.flush.lock"
+        self.streams = tuple(streams)
+        self.max_batch_records = max_batch_records
+        self.flush_history = collections.deque(maxlen=FLUSH_HISTORY_SIZE)
+        self._thread_lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        open(self.path, 'a').close()
+
+    def enqueue(self, rows, meta=None):
+        """Durably append one submission; rows maps each stream name to its list of sheet rows."""
+        record = {
+            'id': uuid.uuid4().hex,
+            'enqueued_at': time.time(),
+            'rows': {stream: rows.get(stream, []) for stream in self.streams},
+            'meta': meta or {}
+        }
+        line = (json.dumps(record, separators=(',', ':')) + "\n").encode('utf-8')
+
+        with open(self.path, 'ab') as queue_file:
+            fcntl.flock(queue_file, fcntl.LOCK_EX)
+            try:
+                queue_file.write(line)
+                queue_file.flush()
+                os.fsync(queue_file.fileno())
+            finally:
+                fcntl.flock(queue_file, fcntl.LOCK_UN)
+
+        return record['id']
+
+    def depth(self):
+        """Number of submissions not yet written to every stream."""
+        offsets = self._read_checkpoint()
+        start = min(offsets.values())
+        return len(self._read_records(start)[0])
+
+    def flush(self, writers):
+        """Write pending records to every stream with one writer call per stream.
+
+        writers maps stream name to a callable taking the list of pending records.
+        Returns the number of records flushed, or None if another process is flushing.
+        """
+        with open(self.flush_lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+
+            try:
+                with self._thread_lock:
+                    return self._flush_locked(writers)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _flush_locked(self, writers):
+        offsets = self._read_checkpoint()
+        flushed = 0
+
+        for stream in self.streams:
+            records, end_offset = self._read_records(offsets[stream], self.max_batch_records)
+            if not records:
+                continue
+
+            started = time.perf_counter()
+            writers[stream](records)
+            elapsed = time.perf_counter() - started
+
+            offsets[stream] = end_offset
+            self._write_checkpoint(offsets)
+            flushed = max(flushed, len(records))
+
+            self.flush_history.append({
+                'stream': stream,
+                'records': len(records),
+                'rows': sum(len(record['rows'].get(stream, [])) for record in records),
+                'seconds': elapsed,
+                'flushed_at': time.time()
+            })
+            logging.info(f"Flushed {len(records)} queued submissions to {stream} in {elapsed * 1000:.1f} ms")
+
+        self._compact(offsets)
+        return flushed
+
+    def _read_records(self, offset, limit=None):
+        records = []
+        end_offset = offset
+
+        with open(self.path, 'rb') as queue_file:
+            queue_file.seek(offset)
+            for line in queue_file:
+                if not line.endswith(b"\n"):
+                    break  # partially written line, picked up on the next flush
+                end_offset += len(line)
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logging.error(f"Dropping corrupt submission queue line at offset {end_offset - len(line)}")
+                    continue
+                if limit and len(records) >= limit:
+                    break
+
+        return records, end_offset
+
+    def _compact(self, offsets):
+        with open(self.path, 'ab') as queue_file:
+            fcntl.flock(queue_file, fcntl.LOCK_EX)
+            try:
+                size = os.fstat(queue_file.fileno()).st_size
+                if size and all(offset >= size for offset in offsets.values()):
+                    queue_file.truncate(0)
+                    self._write_checkpoint({stream: 0 for stream in self.streams})
+            finally:
+                fcntl.flock(queue_file, fcntl.LOCK_UN)
+
+    def _read_checkpoint(self):
+        offsets = {stream: 0 for stream in self.streams}
+        try:
+            with open(self.checkpoint_path) as checkpoint_file:
+                saved = json.load(checkpoint_file)
+            offsets.update({stream: int(saved.get(stream, 0)) for stream in self.streams})
+        except (FileNotFoundError, ValueError):
+            pass
+        return offsets
+
+    def _write_checkpoint(self, offsets):
+        temp_path = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump(offsets, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+
+
+class SubmissionFlusher:
+    """Background thread that flushes a SubmissionQueue every interval_seconds."""
+
+    def __init__(self, queue, writers_factory, interval_seconds=5):
+        self.queue = queue
+        self.writers_factory = writers_factory
+        self.interval_seconds = interval_seconds
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the flusher thread in this process if it is not already running (fork-safe)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="submission-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def flush_now(self):
+        try:
+            return self.queue.flush(self.writers_factory())
+        except Exception as e:
+            logging.error(f"Error flushing submission queue: {e}")
+            return None
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            self.flush_now()
@@ -0,0 +1,23 @@
+"""Test setup: the repository root on sys.path, and an app that never touches Google Sheets."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Must be set before app is imported
+os.environ.setdefault("SHEETS_FAKE", "memory")
+os.environ.setdefault("SHEETS_SCHEDULER", "0")
+os.environ.setdefault("POSITION_POOL_SIZE", "0")
+os.environ.setdefault("WARMUP_ENABLED", "0")
+os.environ.setdefault("LEADERBOARD_STREAM", "0")
+os.environ.setdefault("SHARED_CACHE", "0")
+os.environ.setdefault("SUBMIT_IDEMPOTENCY", "0")
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    import app
+
+    return app
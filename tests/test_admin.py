@@ -0,0 +1,32 @@
+"""Admin endpoints answer 404 unless the request carries the right token header."""
+import pytest
+
+
+@pytest.fixture
+def profiler_token(app_module, monkeypatch):
+    monkeypatch.setattr(app_module.request_profiler, 'admin_token', 'profile-secret')
+    return 'profile-secret'
+
+
+def test_profiles_need_the_header_token(app_module, profiler_token):
+    client = app_module.app.test_client()
+
+    assert client.get('/admin/profiles').status_code == 404
+    assert client.get(f'/admin/profiles?token={profiler_token}').status_code == 404
+    assert client.get('/admin/profiles', headers={'X-Profile-Token': 'wrong'}).status_code == 404
+    assert client.get('/admin/profiles', headers={'X-Profile-Token': profiler_token}).status_code == 200
+
+
+def test_cache_stats_need_the_admin_token(app_module, profiler_token, monkeypatch):
+    client = app_module.app.test_client()
+
+    # Off until ADMIN_TOKEN is set, and the profiler token never opens it
+    assert client.get('/admin/cache', headers={'X-Admin-Token': ''}).status_code == 404
+    assert client.get('/admin/cache', headers={'X-Profile-Token': profiler_token}).status_code == 404
+
+    monkeypatch.setattr(app_module, 'ADMIN_TOKEN', 'admin-secret')
+    assert client.get('/admin/cache', headers={'X-Admin-Token': 'wrong'}).status_code == 404
+    assert client.get('/admin/cache?token=admin-secret').status_code == 404
+    response = client.get('/admin/cache', headers={'X-Admin-Token': 'admin-secret'})
+    # The tests run with SHARED_CACHE=0, so an authorized request reaches the disabled-cache answer
+    assert response.get_json()['message'] == "The shared cache is disabled"
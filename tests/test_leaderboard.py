@@ -0,0 +1,129 @@
+"""LeaderboardIndex ordering, the sorted structure behind it, and leaderboard deltas in the browser."""
+import copy
+import json
+import os
+import random
+import shutil
+import subprocess
+
+import pytest
+
+from leaderboard import LeaderboardIndex, SortedBuckets, apply_leaderboard_delta
+
+GAME_JS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static", "js", "game.js")
+
+# Applies every [leaderboard, deltas, limit] case read from stdin with GameUI.applyLeaderboardDelta, without a DOM
+NODE_SCRIPT = """
+const fs = require('fs');
+const vm = require('vm');
+globalThis.document = { addEventListener() {} };
+vm.runInThisContext(fs.readFileSync(process.argv[1], 'utf8') + '\\nglobalThis.GameUI = GameUI;');
+const cases = JSON.parse(fs.readFileSync(0, 'utf8'));
+const boards = cases.map(([leaderboard, deltas, limit]) => deltas.map(delta => {
+    GameUI.prototype.applyLeaderboardDelta.call({}, leaderboard, delta, limit);
+    return JSON.parse(JSON.stringify(leaderboard));
+}));
+process.stdout.write(JSON.stringify(boards));
+"""
+
+
+def test_sorted_buckets_match_a_sorted_list():
+    rng = random.Random(3)
+    buckets = SortedBuckets(load=4)
+    expected = []
+    for step in range(5000):
+        if expected and rng.random() < 0.45:
+            item = rng.choice(expected)
+            buckets.remove(item)
+            expected.remove(item)
+        else:
+            item = (rng.randint(0, 50), step)
+            buckets.add(item)
+            expected.append(item)
+            expected.sort()
+        assert len(buckets) == len(expected)
+        if step % 97 == 0:
+            assert list(buckets) == expected
+            assert [buckets.index(item) for item in expected] == list(range(len(expected)))
+    assert list(buckets) == expected
+
+
+def test_sorted_buckets_refuse_missing_items():
+    buckets = SortedBuckets([1, 3, 5, 7, 9], load=2)
+
+    for missing in (0, 4, 10):
+        with pytest.raises(ValueError):
+            buckets.remove(missing)
+        with pytest.raises(ValueError):
+            buckets.index(missing)
+
+
+def test_index_keeps_each_players_best_session_in_order():
+    rng = random.Random(4)
+    index = LeaderboardIndex()
+    best = {}
+    for _ in range(3000):
+        name = f"player {rng.randint(0, 400)}"
+        ies = round(rng.uniform(0.5, 5), 2)
+        index.add_entry(name, 'medium', ies, 0, 0)
+        best[name] = min(best.get(name, ies), ies)
+
+    ranked = index.ranked_entries('medium')
+    assert [entry['ies'] for entry in ranked] == sorted(best.values())
+    assert {entry['name']: entry['ies'] for entry in ranked} == best
+    assert [index.rank_of('medium', entry['name']) for entry in ranked] == list(range(len(ranked)))
+
+
+def test_rebuild_matches_incremental_updates():
+    rng = random.Random(5)
+    entries = [
+        {'name': f"Player {rng.randint(0, 300)}", 'difficulty': rng.choice(['easy', 'medium', 'hard', 'unknown']),
+         'ies': rng.choice([round(rng.uniform(0.5, 5), 2), 999999, 'n/a']), 'drift': 0, 'stability': 0}
+        for _ in range(4000)
+    ]
+    rebuilt = LeaderboardIndex()
+    rebuilt.load_entries(entries)
+    incremental = LeaderboardIndex()
+    for entry in entries:
+        incremental.add_entry(**entry)
+
+    assert rebuilt.to_sheet_rows() == incremental.to_sheet_rows()
+    # A rebuilt index keeps taking updates
+    rebuilt.add_entry('Player 1', 'easy', 0.01, 0, 0)
+    assert rebuilt.rank_of('easy', 'player 1') == 0
+
+
+def random_deltas(rng, count):
+    """Deltas for a few players with often equal scores, with ranks that may lag behind."""
+    deltas = []
+    for _ in range(count):
+        name = rng.choice(['Ada', 'ada ', 'Bob', 'Cy', 'Dee', 'Eve', 'Fay', 'Gus', 'Hal'])
+        rank = rng.randint(1, 9)
+        deltas.append({
+            'difficulty': rng.choice(['easy', 'hard']),
+            'change': 'moved',
+            'rank': rank,
+            'previous_rank': rng.choice([None, rng.randint(1, 9)]),
+            'entry': {'rank': rank, 'name': name, 'score': rng.choice([1.5, 2, 2, 3.25, 4]), 'drift': 0, 'stability': 90}
+        })
+    return deltas
+
+
+@pytest.mark.parametrize('limit', [None, 3])
+def test_browser_applies_deltas_like_the_server(limit):
+    if shutil.which("node") is None:
+        pytest.skip("node is not installed")
+    rng = random.Random(8)
+    initial = {'easy': [{'rank': 1, 'name': 'Zed', 'score': 2, 'drift': 0, 'stability': 80}], 'hard': []}
+    cases = [[copy.deepcopy(initial), random_deltas(rng, 200), limit] for _ in range(3)]
+
+    result = subprocess.run(
+        ["node", "-e", NODE_SCRIPT, GAME_JS], input=json.dumps(cases), capture_output=True, text=True, check=True
+    )
+
+    for (leaderboard, deltas, _), browser_boards in zip(copy.deepcopy(cases), json.loads(result.stdout)):
+        for delta, browser_board in zip(deltas, browser_boards):
+            assert browser_board == apply_leaderboard_delta(leaderboard, delta, limit)
+        for entries in leaderboard.values():
+            assert [entry['score'] for entry in entries] == sorted(entry['score'] for entry in entries)
+            assert limit is None or len(entries) <= limit
@@ -0,0 +1,75 @@
+"""/leaderboard/stream trims its snapshots and deltas to the difficulty and limit asked for."""
+import json
+import time
+
+import pytest
+
+from leaderboard_stream import EventHub, EventLog
+
+BOARD = {
+    difficulty: [{'rank': rank, 'name': f"{difficulty} {rank}", 'score': rank, 'drift': 0, 'stability': 90} for rank in range(1, 9)]
+    for difficulty in ('easy', 'medium', 'hard')
+}
+
+
+def delta(difficulty, rank, previous_rank):
+    return {
+        'difficulty': difficulty, 'change': 'moved', 'rank': rank, 'previous_rank': previous_rank,
+        'entry': {'rank': rank, 'name': f"{difficulty} {previous_rank}", 'score': rank, 'drift': 0, 'stability': 90}
+    }
+
+
+@pytest.fixture
+def hub(app_module, tmp_path, monkeypatch):
+    hub = EventHub(EventLog(str(tmp_path / 'events.jsonl')), poll_interval_seconds=0.02)
+    monkeypatch.setattr(app_module, 'leaderboard_hub', hub)
+    monkeypatch.setattr(app_module, 'current_leaderboard_snapshot', lambda: BOARD)
+    monkeypatch.setattr(app_module, 'LEADERBOARD_STREAM_MAX_SECONDS', 0.2)
+    monkeypatch.setattr(app_module, 'LEADERBOARD_STREAM_HEARTBEAT_SECONDS', 0.05)
+    return hub
+
+
+def publish(hub, *deltas):
+    """Publish deltas and wait until the hub holds them for replay."""
+    for data in deltas:
+        last_id = hub.publish('delta', data)['id']
+    deadline = time.monotonic() + 5
+    while hub.last_id < last_id and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def stream_events(app_module, query, last_event_id=None):
+    headers = {'Last-Event-ID': str(last_event_id)} if last_event_id is not None else {}
+    response = app_module.app.test_client().get(f'/leaderboard/stream{query}', headers=headers)
+    events = []
+    for message in response.get_data(as_text=True).split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in message.splitlines() if ': ' in line and not line.startswith(':'))
+        if 'event' in fields:
+            events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_snapshot_is_trimmed_like_get_leaderboard(app_module, hub):
+    events = stream_events(app_module, '?difficulty=hard&limit=3')
+
+    assert events == [('snapshot', {'leaderboard': {'hard': BOARD['hard'][:3]}, 'total': {'hard': 8}})]
+    assert app_module.app.test_client().get('/leaderboard/stream?limit=-1').status_code == 400
+
+
+def test_deltas_of_other_difficulties_are_not_sent(app_module, hub):
+    publish(hub, delta('easy', 1, 3), delta('hard', 1, 2), delta('easy', 2, None))
+
+    events = stream_events(app_module, '?difficulty=easy&limit=5', last_event_id=0)
+    assert [(event, data['difficulty'], data['rank']) for event, data in events] == [('delta', 'easy', 1), ('delta', 'easy', 2)]
+
+
+def test_an_entry_leaving_the_top_limit_sends_a_snapshot(app_module, hub):
+    publish(hub, delta('easy', 1, 3), delta('easy', 7, 2))
+
+    events = stream_events(app_module, '?limit=5', last_event_id=0)
+    assert [event for event, _ in events] == ['snapshot']
+    assert events[0][1]['leaderboard']['easy'] == BOARD['easy'][:5]
+
+    # Without a limit the client has every entry, so the delta is enough
+    events = stream_events(app_module, '', last_event_id=0)
+    assert [event for event, _ in events] == ['delta', 'delta']
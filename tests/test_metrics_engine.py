@@ -0,0 +1,81 @@
+"""The metrics engine against the reference implementation, app.calculate_session_metrics."""
+import json
+import random
+
+import pytest
+
+import metrics_engine
+
+RESPONSE_TIMES = [None, '', 'abc', '0', 0, -0.5, 'inf']
+SUCCESS_VALUES = [0, 1, '1', '0', 1.0, True, None, 'yes']
+TRIAL_TIMES = [None, '', 'x', 0, -3, '12.5']
+DURATIONS = [60, 180, '120', 0, '', None, 'abc', -30, 7.5, 1e-9]
+
+
+def fuzzed_session(rng):
+    """trialData and duration with realistic values mixed with malformed ones."""
+    count = rng.choice([0, 1, 2, 5, 6, 12, 40, 150, 400])
+    trials = []
+    for index in range(count):
+        trial = {}
+        if rng.random() < 0.95:
+            trial['responseTime'] = round(rng.lognormvariate(0.3, 0.5), 3) if rng.random() < 0.9 else rng.choice(RESPONSE_TIMES)
+        if rng.random() < 0.97:
+            trial['success'] = int(rng.random() < 0.75) if rng.random() < 0.9 else rng.choice(SUCCESS_VALUES)
+        if rng.random() < 0.95:
+            trial['trialTime'] = round(index * rng.uniform(1, 4), 3) if rng.random() < 0.9 else rng.choice(TRIAL_TIMES)
+        trials.append(trial)
+    if rng.random() < 0.2:
+        rng.shuffle(trials)
+    duration = rng.choice(DURATIONS) if rng.random() < 0.3 else count * 2.5
+    return trials, duration
+
+
+def outcome(calculate, *args):
+    """The metrics as canonical JSON, or the exception type when the reference rejects the input."""
+    try:
+        return json.dumps(calculate(*args), sort_keys=True)
+    except (ArithmeticError, TypeError, ValueError) as error:
+        return type(error).__name__
+
+
+@pytest.mark.filterwarnings('error::RuntimeWarning')
+def test_engine_matches_reference(app_module):
+    rng = random.Random(6)
+    for _ in range(3000):
+        trials, duration = fuzzed_session(rng)
+        expected = outcome(app_module.calculate_session_metrics, trials, duration)
+        assert outcome(metrics_engine.calculate_session_metrics, trials, duration) == expected, (trials, duration)
+
+
+@pytest.mark.filterwarnings('error::RuntimeWarning')
+def test_batch_matches_reference(app_module):
+    rng = random.Random(7)
+    for _ in range(20):
+        # Sessions the reference rejects were never stored, so backfill never sees them
+        sessions, expected = [], []
+        for _ in range(rng.randint(1, 150)):
+            trials, duration = fuzzed_session(rng)
+            result = outcome(app_module.calculate_session_metrics, trials, duration)
+            if not result.endswith('Error'):
+                sessions.append((trials, duration))
+                expected.append(result)
+        results = metrics_engine.calculate_batch_metrics(*metrics_engine.sessions_to_ragged(sessions))
+        for session, metrics, result in zip(sessions, results, expected):
+            assert json.dumps(metrics, sort_keys=True) == result, session
+        assert len(results) == len(sessions)
+
+
+def test_batch_of_empty_sessions():
+    assert metrics_engine.calculate_batch_metrics(*metrics_engine.sessions_to_ragged([])) == []
+    assert metrics_engine.calculate_batch_metrics(*metrics_engine.sessions_to_ragged([([], 60), ([], 0)])) == [None, None]
+
+
+def test_row_sums_replay_python_sum():
+    import numpy as np
+
+    rng = random.Random(8)
+    rows = [[rng.uniform(-1e6, 1e6) * 10 ** rng.randint(-8, 8) for _ in range(rng.randint(0, 60))] for _ in range(200)]
+    width = max(len(row) for row in rows)
+    matrix = np.array([row + [0.0] * (width - len(row)) for row in rows])
+    assert metrics_engine._row_sums(matrix).tolist() == [sum(row) for row in rows]
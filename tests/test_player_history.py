@@ -0,0 +1,40 @@
+"""Player history: sessions are identified by their Session ID, and the index is reloaded only on request."""
+from player_history import PlayerHistoryIndex
+
+SESSION_ID_COLUMN = 12
+
+
+def data_row(time, ies, session_id=None):
+    row = ['2026-10-18', time, 'Ada', 'Easy', 180, 2, ies, ies, ies, ies, 0.1, 0.9]
+    return row + [session_id] if session_id is not None else row
+
+
+def test_sessions_in_the_same_second_with_the_same_ies_are_kept():
+    history = PlayerHistoryIndex(session_id_column=SESSION_ID_COLUMN)
+
+    assert history.add_row(data_row('10:00:00', 900, 'a1')) is not None
+    assert history.add_row(data_row('10:00:00', 900, 'b2')) is not None
+    # The write-behind flush records the submitted session again
+    assert history.add_row(data_row('10:00:00', 900, 'a1')) is None
+
+    assert history.player_summary('Ada')['session_count'] == 2
+
+
+def test_rows_without_a_session_id_are_always_added():
+    history = PlayerHistoryIndex(session_id_column=SESSION_ID_COLUMN)
+    history.load_rows([data_row('10:00:00', 900), data_row('10:00:00', 900), data_row('10:00:00', 900, '')])
+
+    assert history.player_summary('Ada')['difficulties']['easy']['count'] == 3
+
+
+def test_player_history_is_not_reloaded_by_default(app_module, monkeypatch):
+    reloads = []
+    monkeypatch.setattr(app_module, 'load_session_indexes', lambda: reloads.append(True))
+    monkeypatch.setattr(app_module.player_history, 'loaded_at', 0.0)
+
+    app_module.current_player_history()
+    assert reloads == []
+
+    monkeypatch.setattr(app_module, 'PLAYER_HISTORY_MAX_AGE_SECONDS', 60)
+    app_module.current_player_history()
+    assert reloads == [True]
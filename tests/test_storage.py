@@ -0,0 +1,49 @@
+"""Storage backends: the abstract interface, and player history read through the local store."""
+import pytest
+
+from storage import SQLiteStorage, StorageBackend
+
+
+def data_row(date, time, name, difficulty, ies):
+    return [date, time, name, difficulty, 180, 2, ies, ies, ies, ies, 0.1, 0.9]
+
+
+def test_a_backend_missing_a_method_cannot_be_constructed():
+    class PartialStorage(StorageBackend):
+        def append_sessions(self, data_rows):
+            pass
+
+        def append_trials(self, trial_rows):
+            pass
+
+    with pytest.raises(TypeError, match='query_user_history'):
+        PartialStorage(['Date'], ['Date'])
+
+
+def test_sqlite_user_history_is_the_player_rows_in_order(app_module, tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'store.sqlite3'), app_module.DATA_SHEET_HEADERS, app_module.TRIALS_SHEET_HEADERS)
+    storage.append_sessions([
+        data_row('2026-10-01', '10:00:00', 'Ada', 'Easy', 900),
+        data_row('2026-10-01', '10:05:00', 'Bob', 'Easy', 800),
+        data_row('2026-10-02', '09:00:00', ' ada ', 'Hard', 1200),
+    ])
+
+    history = storage.query_user_history('ADA')
+    assert [row[:4] for row in history] == [['2026-10-01', '10:00:00', 'Ada', 'Easy'], ['2026-10-02', '09:00:00', ' ada ', 'Hard']]
+    assert storage.query_user_history('Eve') == []
+
+
+def test_player_history_is_read_through_a_local_backend(app_module, tmp_path, monkeypatch):
+    storage = SQLiteStorage(str(tmp_path / 'store.sqlite3'), app_module.DATA_SHEET_HEADERS, app_module.TRIALS_SHEET_HEADERS)
+    monkeypatch.setattr(app_module, 'storage_backend', storage)
+    client = app_module.app.test_client()
+
+    assert client.get('/player/Ada/history').status_code == 404
+    # Stored by another worker: this worker's history index never saw it
+    storage.append_sessions([data_row('2026-10-01', '10:00:00', 'Ada', 'Easy', 900)])
+    storage.append_sessions([data_row('2026-10-01', '10:07:00', 'Ada', 'Easy', 700)])
+
+    player = client.get('/player/Ada/history?limit=1').get_json()['player']
+    assert player['session_count'] == 2
+    assert player['difficulties']['easy']['best_ies'] == 700
+    assert [session['time'] for session in player['sessions']] == ['10:07:00']
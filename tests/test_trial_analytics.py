@@ -0,0 +1,43 @@
+"""/analytics/trials query validation and error handling."""
+import pytest
+
+import trial_analytics
+
+
+@pytest.fixture
+def invalidations(app_module, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module.sheet_metadata_cache, 'invalidate', lambda *args: calls.append(args))
+    return calls
+
+
+@pytest.mark.parametrize('group_by', ['', ',', ' , '])
+def test_empty_group_by_is_rejected(app_module, invalidations, group_by):
+    response = app_module.app.test_client().get('/analytics/trials', query_string={'group_by': group_by})
+
+    assert response.status_code == 400
+    assert 'group_by needs at least one' in response.get_json()['message']
+    assert invalidations == []
+
+
+def test_check_query_needs_a_dimension():
+    with pytest.raises(trial_analytics.AnalyticsQueryError):
+        trial_analytics.check_query([])
+
+
+def test_query_errors_leave_the_sheet_metadata_alone(app_module, invalidations, monkeypatch):
+    def failing_query(self, group_by, where=None, baseline=None):
+        raise ValueError("broken query")
+
+    monkeypatch.setattr(trial_analytics.TrialTable, 'query', failing_query)
+    response = app_module.app.test_client().get('/analytics/trials?group_by=piece')
+
+    assert response.status_code == 500
+    assert invalidations == []
+
+
+def test_grouped_query(app_module, invalidations):
+    response = app_module.app.test_client().get('/analytics/trials?group_by=difficulty,piece')
+
+    assert response.status_code == 200
+    assert response.get_json()['success'] is True
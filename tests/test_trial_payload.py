@@ -0,0 +1,157 @@
+"""trialColumns against the trialData it encodes, and the limits on what decode and decompress_body accept."""
+import gzip
+import json
+import random
+
+import pytest
+
+import metrics_engine
+import positions
+from trial_payload import MISSING, TrialColumns, TrialPayloadError, decompress_body, encode_trial_columns
+from trial_verifier import SQUARE_NAMES, PositionSigner, verify_trials
+
+
+def session_trials(rng, count, signer=None):
+    """trialData as ChessGame.logTrialData records it, with some unanswered trials."""
+    trials = []
+    elapsed = 0.0
+    for index in range(count):
+        position = positions.generate_position(rng.choice(list(positions.DIFFICULTY_LEVELS)), rng)
+        piece, row, col = position['attackingPiece']
+        attacked = [SQUARE_NAMES[r * 8 + c] for r, c in position['attackedPieces']]
+        trial = {
+            'trial': index + 1,
+            'trialTime': round(elapsed, 3),
+            'attackingPiece': piece,
+            'attackingPosition': SQUARE_NAMES[row * 8 + col],
+            'attackedPieces': ';'.join(attacked),
+            'fen': position['fen'],
+            'positionSignature': signer.sign(position['fen'], SQUARE_NAMES[row * 8 + col]) if signer else None
+        }
+        if rng.random() < 0.15:
+            # No click before the next trial: the browser logs neither a time nor a square
+            trial['success'] = 0
+        else:
+            correct = rng.random() < 0.8
+            trial['responseTime'] = round(rng.uniform(0.3, 3), 3)
+            trial['responsePosition'] = attacked[0] if correct else rng.choice([s for s in SQUARE_NAMES if s not in attacked])
+            trial['success'] = 1 if correct else 0
+        trials.append(trial)
+        elapsed += rng.uniform(1, 5)
+    return trials
+
+
+def decoded(trial_data):
+    """encode_trial_columns, through JSON as the browser sends it, then TrialColumns.decode."""
+    return TrialColumns.decode(json.loads(json.dumps(encode_trial_columns(trial_data))))
+
+
+def blank_missing(rows):
+    return [[value if value is not None else '' for value in row] for row in rows]
+
+
+@pytest.mark.parametrize('count', [0, 1, 4, 30, 120])
+def test_round_trip_gives_the_same_metrics_and_rows(app_module, count):
+    trial_data = session_trials(random.Random(count), count)
+    columns = decoded(trial_data)
+    duration = 180
+
+    # /submit_results scores trialData with the reference and trialColumns with the engine
+    expected = app_module.calculate_session_metrics(trial_data, duration)
+    engine = metrics_engine.compute_metrics(*columns.metric_arrays(), duration)
+    assert json.dumps(engine, sort_keys=True) == json.dumps(expected, sort_keys=True)
+
+    assert columns.trial_rows('2026-10-18', '12:00:00', 'Ada') == app_module.build_trial_rows('2026-10-18', '12:00:00', 'Ada', trial_data)
+    assert columns.successful_trials() == sum(trial['success'] for trial in trial_data)
+
+
+def test_missing_responses_round_trip(app_module):
+    trial_data = [
+        {'trial': 1, 'trialTime': 0.0, 'attackingPiece': 'wN', 'attackingPosition': 'e4', 'attackedPieces': 'f6',
+         'responseTime': None, 'success': 0, 'responsePosition': None},
+        {'trial': 2, 'attackingPiece': 'wB', 'attackingPosition': 'c1', 'attackedPieces': 'g5', 'success': 0},
+        {'trial': 3, 'trialTime': 4.25, 'attackingPiece': 'wK', 'attackingPosition': 'a1', 'attackedPieces': 'b2',
+         'responseTime': 1.408, 'success': 1, 'responsePosition': 'b2'},
+    ]
+    columns = decoded(trial_data)
+
+    assert columns.columns['responseTimeMs'].tolist() == [MISSING, MISSING, 1408]
+    assert columns.columns['responseSquare'].tolist() == [MISSING, MISSING, SQUARE_NAMES.index('b2')]
+    assert columns.columns['trialTimeMs'].tolist() == [0, MISSING, 4250]
+    response_times, rt_valid, _, trial_times = columns.metric_arrays()
+    assert rt_valid.tolist() == [False, False, True] and response_times[2] == 1.408
+    # A trial without a time is placed by its number, as calculate_session_metrics does
+    assert trial_times.tolist() == [0.0, 2.0, 4.25]
+    # A missing value is an empty cell either way
+    assert columns.trial_rows('d', 't', 'p') == blank_missing(app_module.build_trial_rows('d', 't', 'p', trial_data))
+    assert metrics_engine.compute_metrics(*columns.metric_arrays(), 60) == app_module.calculate_session_metrics(trial_data, 60)
+
+
+def test_round_trip_replays_the_same_answers():
+    signer = PositionSigner(b'payload test')
+    trial_data = session_trials(random.Random(5), 60, signer)
+    # Claim a wrong answer as correct
+    trial_data[3] = dict(trial_data[3], responsePosition=None, responseTime=None, success=1)
+    columns = decoded(trial_data)
+
+    replayed, summary = verify_trials(trial_data, signer)
+    assert columns.verify(signer) == summary
+    assert summary['mismatches'] >= 1
+    assert columns.columns['success'].tolist() == [trial['success'] for trial in replayed]
+
+
+@pytest.mark.parametrize('column, value', [
+    ('attackingSquare', 64),
+    ('attackingSquare', MISSING),
+    ('attackingPiece', 12),
+    ('responseSquare', -2),
+    ('responseTimeMs', -5),
+    ('trialTimeMs', -2),
+    ('success', 2),
+    ('success', True),
+    ('responseTimeMs', 1.5),
+    ('responseTimeMs', '1500'),
+])
+def test_out_of_range_values_are_refused(column, value):
+    payload = encode_trial_columns(session_trials(random.Random(1), 5))
+    payload[column][2] = value
+
+    with pytest.raises(TrialPayloadError):
+        TrialColumns.decode(payload)
+
+
+@pytest.mark.parametrize('change', [
+    lambda payload: payload['success'].pop(),
+    lambda payload: payload['fen'].pop(),
+    lambda payload: payload['positionSignature'].append(None),
+    lambda payload: payload['attackedSquares'].__setitem__(0, [64]),
+    lambda payload: payload.__setitem__('responseTimeMs', None),
+    lambda payload: payload.__setitem__('version', 2),
+])
+def test_malformed_columns_are_refused(change):
+    payload = encode_trial_columns(session_trials(random.Random(2), 5))
+    change(payload)
+
+    with pytest.raises(TrialPayloadError):
+        TrialColumns.decode(payload)
+
+
+def test_decompress_body_limits_the_inflated_size():
+    body = json.dumps({'trialColumns': encode_trial_columns(session_trials(random.Random(3), 40))}).encode()
+    compressed = gzip.compress(body)
+
+    assert decompress_body(compressed, len(body)) == body
+    with pytest.raises(TrialPayloadError, match='inflates beyond'):
+        decompress_body(compressed, len(body) - 1)
+    # A small body that inflates far beyond the limit is cut off at the limit, not inflated
+    with pytest.raises(TrialPayloadError, match='inflates beyond'):
+        decompress_body(gzip.compress(b' ' * (64 * 1024 * 1024)), 1024 * 1024)
+
+
+def test_decompress_body_refuses_broken_gzip():
+    compressed = gzip.compress(b'{"trialColumns": {}}')
+
+    with pytest.raises(TrialPayloadError, match='Truncated'):
+        decompress_body(compressed[:-10], 1024)
+    with pytest.raises(TrialPayloadError, match='Invalid gzip'):
+        decompress_body(b'not gzip at all', 1024)
@@ -0,0 +1,141 @@
+"""The server's answer replay against the browser's attack rule (ChessGame.findAttackedPieces)."""
+import json
+import os
+import random
+import shutil
+import subprocess
+
+import pytest
+
+import positions
+import trial_verifier
+from trial_verifier import SQUARE_NAMES, PositionSigner, replay_answer, verify_trials
+
+CHESS_JS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static", "js", "chess.js")
+
+# Runs findAttackedPieces for every [board, row, col] read from stdin, without a DOM or constructor
+NODE_SCRIPT = """
+const fs = require('fs');
+const vm = require('vm');
+vm.runInThisContext(fs.readFileSync(process.argv[1], 'utf8') + '\\nglobalThis.ChessGame = ChessGame;');
+const cases = JSON.parse(fs.readFileSync(0, 'utf8'));
+const attacked = cases.map(([board, row, col]) =>
+    ChessGame.prototype.findAttackedPieces.call({ board }, board[row][col], row, col));
+process.stdout.write(JSON.stringify(attacked));
+"""
+
+
+def client_attacked_squares(cases):
+    """Square names the browser marks as correct answers, per (board, row, col) case."""
+    if shutil.which("node") is None:
+        pytest.skip("node is not installed")
+    result = subprocess.run(
+        ["node", "-e", NODE_SCRIPT, CHESS_JS], input=json.dumps(cases), capture_output=True, text=True, check=True
+    )
+    return [sorted(SQUARE_NAMES[row * 8 + col] for row, col in squares) for squares in json.loads(result.stdout)]
+
+
+def board_of(pieces):
+    """8x8 browser board from {'e2': 'wP', ...}."""
+    board = [[None] * 8 for _ in range(8)]
+    for name, piece in pieces.items():
+        square = SQUARE_NAMES.index(name)
+        board[square // 8][square % 8] = piece
+    return board
+
+
+def replayed_squares(board, row, col):
+    """Squares the server accepts as correct answers in the same position."""
+    fen = positions.board_to_fen(board)
+    source = SQUARE_NAMES[row * 8 + col]
+    return sorted(name for name in SQUARE_NAMES if replay_answer(board[row][col], source, name, fen, None) == 1)
+
+
+def test_pawn_attacks_forward_diagonals():
+    white = board_of({'e2': 'wP', 'd3': 'bN', 'f3': 'bB', 'f1': 'bR', 'd1': 'bQ', 'e3': 'bK', 'a8': 'wK'})
+    black = board_of({'e7': 'bP', 'd6': 'wN', 'f6': 'wB', 'f8': 'wR', 'e6': 'wK', 'a1': 'bK'})
+    cases = [[white, 6, 4], [black, 1, 4]]
+
+    assert client_attacked_squares(cases) == [['d3', 'f3'], ['d6', 'f6']]
+    assert [replayed_squares(*case) for case in cases] == [['d3', 'f3'], ['d6', 'f6']]
+
+
+def test_sliders_stop_at_the_first_piece():
+    board = board_of({'d4': 'wQ', 'd7': 'bR', 'd8': 'bN', 'g7': 'bB', 'b4': 'wN', 'a4': 'bP', 'd2': 'bK', 'h1': 'wK'})
+    cases = [[board, 4, 3]]
+
+    assert client_attacked_squares(cases) == [['d2', 'd7', 'g7']]
+    assert replayed_squares(*cases[0]) == ['d2', 'd7', 'g7']
+
+
+def test_generated_positions_agree_with_the_client():
+    rng = random.Random(12)
+    cases = []
+    for difficulty in positions.DIFFICULTY_LEVELS:
+        for position in positions.generate_positions(difficulty, 150, rng):
+            _, row, col = position['attackingPiece']
+            cases.append([position['board'], row, col])
+
+    client = client_attacked_squares(cases)
+    assert [replayed_squares(*case) for case in cases] == client
+    assert any(board[row][col] == 'wP' for board, row, col in cases)
+
+
+def test_without_a_fen_only_the_client_list_is_checked():
+    board = board_of({'e2': 'wP', 'd3': 'bN', 'f3': 'bB', 'a8': 'wK', 'h8': 'bK'})
+    attacked = ';'.join(client_attacked_squares([[board, 6, 4]])[0])
+
+    assert replay_answer('wP', 'e2', 'd3', None, attacked) == 1
+    assert replay_answer('wP', 'e2', 'f3', None, attacked) == 1
+    # Geometrically attacked but not listed by the client
+    assert replay_answer('wP', 'e2', 'f3', None, 'd3') == 0
+    # Not a pawn attack at all
+    assert replay_answer('wP', 'e2', 'f1', None, 'f1') == 0
+    assert replay_answer('wP', 'e2', 'e3', None, attacked) == 0
+
+
+def test_only_issued_positions_are_replayed():
+    signer = PositionSigner(b'test key')
+    board = board_of({'e2': 'wP', 'd3': 'bN', 'a8': 'wK', 'h8': 'bK'})
+    fen = positions.board_to_fen(board)
+    # The client claims f3 holds an attacked piece; only the issued FEN shows that it does not
+    trial = {
+        'attackingPiece': 'wP', 'attackingPosition': 'e2', 'attackedPieces': 'f3', 'responsePosition': 'f3',
+        'success': 1, 'fen': positions.board_to_fen(board_of({'e2': 'wP', 'f3': 'bN', 'a8': 'wK', 'h8': 'bK'}))
+    }
+
+    forged, summary = verify_trials([dict(trial, positionSignature=signer.sign(fen, 'e2'))], signer)
+    assert forged[0]['success'] == 1 and summary['mismatches'] == 0
+
+    issued, summary = verify_trials([dict(trial, fen=fen, positionSignature=signer.sign(fen, 'e2'))], signer)
+    assert issued[0]['success'] == 0 and summary['mismatches'] == 1
+
+    other_server, _ = verify_trials([dict(trial, fen=fen, positionSignature=PositionSigner(b'other').sign(fen, 'e2'))], signer)
+    assert other_server[0]['success'] == 1
+
+
+def test_signing_key_is_shared_through_the_key_file(tmp_path):
+    path = str(tmp_path / 'keys' / 'position_signing.key')
+    first = PositionSigner.from_key_file(path)
+    second = PositionSigner.from_key_file(path)
+
+    assert first.key == second.key and len(first.key) == 32
+    assert second.issued('8/8/8/8/8/8/8/8 w - - 0 1', 'a1', first.sign('8/8/8/8/8/8/8/8 w - - 0 1', 'a1'))
+
+
+def test_served_positions_are_signed(app_module):
+    response = app_module.app.test_client().get('/positions?difficulty=Easy&count=5')
+    served = response.get_json()['positions']
+
+    assert len(served) == 5
+    for position in served:
+        _, row, col = position['attackingPiece']
+        assert app_module.position_signer.issued(position['fen'], SQUARE_NAMES[row * 8 + col], position['signature'])
+    assert trial_verifier.issued_fen(None, served[0]['fen'], 'a1', served[0]['signature']) is None
+
+
+def test_long_signing_keys_are_accepted():
+    signer = PositionSigner(b'k' * 100)
+
+    assert signer.issued('8/8/8/8/8/8/8/8 w - - 0 1', 'a1', signer.sign('8/8/8/8/8/8/8/8 w - - 0 1', 'a1'))
+    assert not PositionSigner(b'k' * 101).issued('8/8/8/8/8/8/8/8 w - - 0 1', 'a1', signer.sign('8/8/8/8/8/8/8/8 w - - 0 1', 'a1'))
@@ -0,0 +1,400 @@
+"""Per-condition statistics over every stored trial, for contrastive analyses.
+
+Trials are read from storage once into a columnar table: one NumPy array per column, the
+categorical ones (attacking piece, number of attacked pieces, and difficulty, taken from
+the session's Data row) stored as small integer codes into sorted label lists. The
+response times of all trials are also sorted once, up front, as the index medians are
+read from.
+
+A query groups by any combination of those dimensions. The codes are combined into one
+group code per trial and every statistic of every group comes out of the same pass:
+bincount sums for accuracy and lapse rate, and one stable (radix) sort of the group codes
+along the presorted response times for the medians. The cost does not depend on the
+number of groups.
+
+Metrics follow FOCUS_METRICS_README.md: accuracy is successful trials over trials, IES
+is the median response time of the successful trials over accuracy, and a lapse is a
+response slower than its own session's median RT + 2 SD.
+"""
+import logging
+import threading
+import time
+
+from backfill import RESPONSE_TIME_COLUMN, SUCCESS_COLUMN, TRIAL_NUMBER_COLUMN, session_key
+from leaderboard import LEADERBOARD_DIFFICULTIES, parse_float
+
+DEFAULT_PAGE_SIZE = 20000
+INSUFFICIENT_IES = 999999
+
+# Trials row columns (see backfill.py for the others)
+ATTACKING_PIECE_COLUMN = 5
+ATTACKED_PIECES_COLUMN = 7
+# Data row column holding the displayed difficulty (Easy, Medium, Hard)
+DIFFICULTY_COLUMN = 3
+
+DIMENSIONS = ('difficulty', 'piece', 'piece_type', 'attacked')
+UNKNOWN = 'unknown'
+
+
+class AnalyticsQueryError(ValueError):
+    """The query names an unknown dimension or label."""
+
+
+def _cell(row, index):
+    return row[index] if len(row) > index else ""
+
+
+def _sorted_labels(dimension, labels):
+    if dimension == 'difficulty':
+        order = {difficulty: index for index, difficulty in enumerate(LEADERBOARD_DIFFICULTIES)}
+        return sorted(labels, key=lambda label: (order.get(label, len(order)), label))
+    if dimension == 'attacked':
+        return sorted(labels)
+    return sorted(labels, key=lambda label: (label == UNKNOWN, label))
+
+
+def parse_label(dimension, value):
+    """Label of dimension given as a query string value."""
+    if dimension == 'attacked':
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise AnalyticsQueryError(f"attacked must be a number of pieces, not {value!r}")
+    if dimension == 'difficulty':
+        return str(value).lower()
+    return str(value)
+
+
+def check_query(group_by, where=None, baseline=None):
+    """Raise AnalyticsQueryError unless the query only uses known dimensions."""
+    if not group_by:
+        raise AnalyticsQueryError(f"group_by needs at least one of {', '.join(DIMENSIONS)}")
+    for dimension in list(group_by) + list(where or {}):
+        if dimension not in DIMENSIONS:
+            raise AnalyticsQueryError(f"Unknown dimension {dimension!r}, expected one of {', '.join(DIMENSIONS)}")
+    if len(set(group_by)) != len(group_by):
+        raise AnalyticsQueryError("group_by lists a dimension twice")
+    if baseline is not None and baseline[0] not in group_by:
+        raise AnalyticsQueryError("The baseline dimension must be one of the group_by dimensions")
+
+
+def group_medians(codes, values, group_count):
+    """Median of values per group, NaN for empty groups; values must already be sorted.
+
+    A stable sort by group keeps each group's values in sorted order, so only the one or
+    two values at each group's midpoint are read.
+    """
+    import numpy as np
+
+    # A single group is the values themselves, in order
+    order = np.argsort(codes, kind='stable') if group_count > 1 else np.arange(codes.size)
+    counts = np.bincount(codes, minlength=group_count)
+    starts = np.cumsum(counts) - counts
+    medians = np.full(group_count, np.nan)
+    present = counts > 0
+    lower = values[order[(starts + (counts - 1) // 2)[present]]]
+    upper = values[order[(starts + counts // 2)[present]]]
+    medians[present] = (lower + upper) / 2
+    return medians
+
+
+def _code_dtype(group_count):
+    import numpy as np
+
+    # Stable argsort of 16-bit integers is a radix sort
+    return np.int16 if group_count <= np.iinfo(np.int16).max else np.int64
+
+
+class TrialTable:
+    """Every trial as parallel arrays.
+
+    columns holds 'session' (index of the trial's session), 'response_time' (NaN when
+    missing), 'success', 'lapse' and one code array per dimension, indexing labels[dimension].
+    """
+
+    def __init__(self, columns, labels, session_count):
+        import numpy as np
+
+        self.columns = columns
+        self.labels = labels
+        self.session_count = session_count
+        self.size = int(columns['success'].size)
+        self.rt_valid = ~np.isnan(columns['response_time'])
+        # Trials with a response time, fastest first: the group index medians are read from
+        self.rt_order = np.flatnonzero(self.rt_valid)
+        self.rt_order = self.rt_order[np.argsort(columns['response_time'][self.rt_order], kind='stable')]
+        self.sorted_response_times = columns['response_time'][self.rt_order]
+        self.sorted_success = columns['success'][self.rt_order] == 1
+
+    @classmethod
+    def from_rows(cls, trial_rows, session_difficulties):
+        """Build the table from Trials rows in insertion order and {session_key: difficulty}.
+
+        Sessions are split like the backfill does: a new one starts when (Date, Time,
+        Patient Name) changes or the trial number stops increasing.
+        """
+        import numpy as np
+
+        sessions, response_times, success = [], [], []
+        codes = {dimension: [] for dimension in ('difficulty', 'piece', 'attacked')}
+        code_of = {dimension: {} for dimension in codes}
+
+        def code(dimension, label):
+            known = code_of[dimension]
+            if label not in known:
+                known[label] = len(known)
+            return known[label]
+
+        session_difficulty = []
+        current_key = None
+        previous_trial = None
+        for row in trial_rows:
+            key = session_key(row)
+            trial_number = parse_float(_cell(row, TRIAL_NUMBER_COLUMN), None)
+            restarted = trial_number is not None and previous_trial is not None and trial_number <= previous_trial
+            if key != current_key or restarted:
+                current_key = key
+                session_difficulty.append(code('difficulty', session_difficulties.get(key, UNKNOWN)))
+            previous_trial = trial_number
+
+            sessions.append(len(session_difficulty) - 1)
+            codes['difficulty'].append(session_difficulty[-1])
+            codes['piece'].append(code('piece', str(_cell(row, ATTACKING_PIECE_COLUMN)).strip() or UNKNOWN))
+            attacked = [name for name in str(_cell(row, ATTACKED_PIECES_COLUMN)).split(';') if name.strip()]
+            codes['attacked'].append(code('attacked', len(attacked)))
+            response_times.append(parse_float(_cell(row, RESPONSE_TIME_COLUMN), np.nan))
+            success.append(1 if parse_float(_cell(row, SUCCESS_COLUMN), 0) == 1 else 0)
+
+        columns = {
+            'session': np.array(sessions, dtype=np.int64),
+            'response_time': np.array(response_times, dtype=np.float64),
+            'success': np.array(success, dtype=np.int8)
+        }
+
+        # Codes were handed out in order of appearance; renumber them in label order
+        labels = {}
+        for dimension, known in code_of.items():
+            labels[dimension] = _sorted_labels(dimension, known)
+            remap = np.zeros(max(len(known), 1), dtype=np.int16)
+            for label, index in known.items():
+                remap[index] = labels[dimension].index(label)
+            columns[dimension] = remap[np.array(codes[dimension], dtype=np.int64)]
+
+        # White and black pieces of the same type share a piece type
+        piece_types = [label[1:] if len(label) == 2 else label for label in labels['piece']]
+        labels['piece_type'] = _sorted_labels('piece_type', set(piece_types))
+        type_of_piece = np.array([labels['piece_type'].index(piece_type) for piece_type in piece_types] or [0], dtype=np.int16)
+        columns['piece_type'] = type_of_piece[columns['piece']]
+
+        columns['lapse'] = cls._lapses(columns['session'], columns['response_time'], len(session_difficulty))
+        return cls(columns, labels, len(session_difficulty))
+
+    @staticmethod
+    def _lapses(sessions, response_times, session_count):
+        """Trials slower than their session's median RT + 2 SD (population SD, as in the session metrics)."""
+        import numpy as np
+
+        valid = ~np.isnan(response_times)
+        valid_sessions = sessions[valid]
+        valid_times = response_times[valid]
+        counts = np.bincount(valid_sessions, minlength=session_count)
+        divisor = np.maximum(counts, 1)
+        means = np.bincount(valid_sessions, weights=valid_times, minlength=session_count) / divisor
+        squares = np.bincount(valid_sessions, weights=(valid_times - means[valid_sessions]) ** 2, minlength=session_count)
+        deviations = np.sqrt(squares / divisor)
+
+        order = np.argsort(valid_times, kind='stable')
+        medians = group_medians(valid_sessions[order], valid_times[order], session_count)
+        thresholds = medians + 2 * deviations
+
+        lapse = np.zeros(sessions.size, dtype=np.int8)
+        lapse[valid] = valid_times > thresholds[valid_sessions]
+        return lapse
+
+    def query(self, group_by, where=None, baseline=None):
+        """Statistics of every non-empty group of trials, and of all of them.
+
+        group_by: dimensions to group by, in order. where: {dimension: label} keeping only
+        the matching trials. baseline: (dimension, label) with dimension in group_by; each
+        group is then compared with the group that differs only in that dimension, having
+        label, instead of with the overall statistics.
+        """
+        import numpy as np
+
+        group_by = list(group_by)
+        check_query(group_by, where, baseline)
+
+        mask = None
+        for dimension, label in (where or {}).items():
+            labels = self.labels[dimension]
+            matches = self.columns[dimension] == (labels.index(label) if label in labels else -1)
+            mask = matches if mask is None else mask & matches
+
+        shape = tuple(max(len(self.labels[dimension]), 1) for dimension in group_by)
+        group_count = int(np.prod(shape, dtype=np.int64))
+        codes = np.zeros(self.size, dtype=np.int64)
+        for dimension, size in zip(group_by, shape):
+            codes = codes * size + self.columns[dimension]
+        codes = codes.astype(_code_dtype(group_count))
+
+        stats = self._group_stats(codes, group_count, mask)
+        overall = self._group_stats(np.zeros(self.size, dtype=np.int16), 1, mask)
+
+        present = np.flatnonzero(stats['trials'])
+        if baseline is not None:
+            axis = group_by.index(baseline[0])
+            labels = self.labels[baseline[0]]
+            if baseline[1] not in labels:
+                raise AnalyticsQueryError(f"No trials with {baseline[0]} {baseline[1]!r}")
+            indexes = list(np.unravel_index(present, shape))
+            indexes[axis] = np.full(present.size, labels.index(baseline[1]))
+            reference = {name: values[np.ravel_multi_index(tuple(indexes), shape)] for name, values in stats.items()}
+        else:
+            reference = {name: np.repeat(values, present.size) for name, values in overall.items()}
+
+        groups = []
+        coordinates = np.unravel_index(present, shape)
+        for position, group in enumerate(present.tolist()):
+            entry = {
+                dimension: self.labels[dimension][int(coordinates[axis][position])]
+                for axis, dimension in enumerate(group_by)
+            }
+            entry.update(self._summary(stats, group))
+            entry.update(self._contrast(stats, group, reference, position))
+            groups.append(entry)
+
+        return {
+            'group_by': group_by,
+            'where': dict(where or {}),
+            'baseline': {baseline[0]: baseline[1]} if baseline is not None else None,
+            'overall': self._summary(overall, 0),
+            'groups': groups,
+            'sessions': self.session_count,
+            'table_trials': self.size
+        }
+
+    def _group_stats(self, codes, group_count, mask=None):
+        """Per-group arrays of every statistic over the trials in mask (None: all of them), in one pass."""
+        import numpy as np
+
+        columns = self.columns
+        success, lapse = columns['success'], columns['lapse']
+        sorted_codes = codes[self.rt_order]
+        sorted_times, sorted_success = self.sorted_response_times, self.sorted_success
+        if mask is not None:
+            codes, success, lapse = codes[mask], success[mask], lapse[mask]
+            kept = mask[self.rt_order]
+            sorted_codes, sorted_times, sorted_success = sorted_codes[kept], sorted_times[kept], sorted_success[kept]
+
+        trials = np.bincount(codes, minlength=group_count)
+        successes = np.bincount(codes, weights=success, minlength=group_count)
+        lapses = np.bincount(codes, weights=lapse, minlength=group_count)
+        timed = np.bincount(sorted_codes, minlength=group_count)
+        correct = np.bincount(sorted_codes[sorted_success], minlength=group_count)
+
+        # Both medians from the presorted response times, ordered by group with one stable sort each
+        median_rt = group_medians(sorted_codes, sorted_times, group_count)
+        median_correct_rt = group_medians(sorted_codes[sorted_success], sorted_times[sorted_success], group_count)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            accuracy = successes / trials
+            lapse_rate = lapses / timed
+            # IES as in the session metrics: accuracy counts successful trials with a response time
+            ies = np.where(correct > 0, median_correct_rt / (correct / trials), INSUFFICIENT_IES)
+
+        return {
+            'trials': trials,
+            'accuracy': accuracy,
+            'median_rt': median_rt,
+            'median_correct_rt': median_correct_rt,
+            'ies': ies,
+            'lapse_rate': lapse_rate
+        }
+
+    @staticmethod
+    def _summary(stats, group):
+        def rounded(value, scale=1):
+            value = float(value)
+            return None if value != value else round(value * scale, 2)
+
+        return {
+            'trials': int(stats['trials'][group]),
+            'accuracy_pct': rounded(stats['accuracy'][group], 100),
+            'median_rt': rounded(stats['median_rt'][group]),
+            'median_correct_rt': rounded(stats['median_correct_rt'][group]),
+            'ies': INSUFFICIENT_IES if stats['ies'][group] == INSUFFICIENT_IES else rounded(stats['ies'][group]),
+            'lapse_rate_pct': rounded(stats['lapse_rate'][group], 100)
+        }
+
+    @staticmethod
+    def _contrast(stats, group, reference, position):
+        """Ratios and percentage point differences against the reference group."""
+        def ratio(name):
+            value, base = float(stats[name][group]), float(reference[name][position])
+            if INSUFFICIENT_IES in (value, base) or not base or value != value or base != base:
+                return None
+            return round(value / base, 4)
+
+        def difference(name):
+            value, base = float(stats[name][group]), float(reference[name][position])
+            if value != value or base != base:
+                return None
+            return round((value - base) * 100, 2)
+
+        return {
+            'ies_ratio': ratio('ies'),
+            'median_rt_ratio': ratio('median_rt'),
+            'accuracy_delta_pp': difference('accuracy'),
+            'lapse_rate_delta_pp': difference('lapse_rate')
+        }
+
+
+def load_trial_table(storage, page_size=DEFAULT_PAGE_SIZE):
+    """Read every session and trial of a storage backend into a TrialTable."""
+    session_difficulties = {}
+    for _, row in storage.read_sessions():
+        if len(row) > DIFFICULTY_COLUMN:
+            session_difficulties.setdefault(session_key(row), str(row[DIFFICULTY_COLUMN]).strip().lower() or UNKNOWN)
+
+    rows = []
+    position = 0
+    while True:
+        page = storage.read_trials_page(position, page_size)
+        rows.extend(row for _, row in page)
+        if len(page) < page_size:
+            break
+        position = page[-1][0] + 1
+    return TrialTable.from_rows(rows, session_difficulties)
+
+
+class TrialAnalytics:
+    """The TrialTable of this process, loaded on first use and again once older than max_age_seconds.
+
+    Concurrent queries wait for a single load instead of each reading storage.
+    """
+
+    def __init__(self, storage, max_age_seconds=600, page_size=DEFAULT_PAGE_SIZE):
+        self.storage = storage
+        self.max_age_seconds = max_age_seconds
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._table = None
+        self.loaded_at = None
+
+    def table(self):
+        with self._lock:
+            stale = self.loaded_at is None or (
+                self.max_age_seconds and time.monotonic() - self.loaded_at >= self.max_age_seconds
+            )
+            if stale:
+                started = time.perf_counter()
+                self._table = load_trial_table(self.storage, self.page_size)
+                self.loaded_at = time.monotonic()
+                logging.info(
+                    f"Trial table loaded: {self._table.size} trials of {self._table.session_count} sessions "
+                    f"in {time.perf_counter() - started:.2f}s"
+                )
+            return self._table
+
+    def query(self, group_by, where=None, baseline=None):
+        return self.table().query(group_by, where, baseline)
@@ -0,0 +1,221 @@
+"""Compact columnar encoding of a session's trials for /submit_results.
+
+The trialData format repeats every key for every trial. The columnar format sends one array
+per field instead: squares as 0-63 (a8 = 0 ... h1 = 63, board rows top to bottom), pieces as
+indexes into PIECE_CODES and times in whole milliseconds, which is what the browser measures,
+so nothing is lost. The request body may also be gzip-compressed (Content-Encoding: gzip).
+
+    "trialColumns": {
+        "version": 1,
+        "trial": [1, 2, ...],                 # optional, 1..n by default
+        "trialTimeMs": [2012, 5120, ...],
+        "attackingPiece": [4, 7, ...],
+        "attackingSquare": [35, 12, ...],
+        "attackedSquares": [[19, 28], [27], ...],
+        "responseTimeMs": [1408, -1, ...],    # -1: no response
+        "success": [1, 0, ...],
+        "responseSquare": [28, -1, ...],      # -1: no response
+        "fen": ["8/8/...", ...],              # optional, lets the server replay the answers
+        "positionSignature": ["9f0c...", ...] # optional, /positions signature of each fen
+    }
+
+Columns are decoded straight into the integer arrays the metrics engine works on, and
+/submit_results scores them with metrics_engine.compute_metrics(*metric_arrays(), duration)
+without building a dict per trial. The Trials rows and the answer replay are produced from
+the same columns.
+"""
+import zlib
+
+from positions import PIECE_TYPES
+from trial_verifier import SQUARE_NAMES, claimed_success, issued_fen, replay_answer, verification_summary
+
+COLUMNS_VERSION = 1
+PIECE_CODES = tuple(color + piece_type for color in 'wb' for piece_type in PIECE_TYPES)
+MISSING = -1
+
+# Column name -> (smallest, largest) allowed value
+INTEGER_COLUMNS = {
+    'trialTimeMs': (MISSING, None),
+    'attackingPiece': (0, len(PIECE_CODES) - 1),
+    'attackingSquare': (0, 63),
+    'responseTimeMs': (MISSING, None),
+    'success': (0, 1),
+    'responseSquare': (MISSING, 63)
+}
+
+
+class TrialPayloadError(ValueError):
+    pass
+
+
+def decompress_body(body, max_bytes):
+    """Inflate a gzip request body, refusing bodies that inflate beyond max_bytes."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(body, max_bytes)
+    except zlib.error as e:
+        raise TrialPayloadError(f"Invalid gzip body: {e}")
+    if decompressor.unconsumed_tail:
+        raise TrialPayloadError(f"Body inflates beyond {max_bytes} bytes")
+    if not decompressor.eof:
+        raise TrialPayloadError("Truncated gzip body")
+    return data
+
+
+def square_index(name):
+    """'a8' -> 0, 'h1' -> 63, anything else -> MISSING."""
+    if isinstance(name, str) and len(name) == 2 and 'a' <= name[0] <= 'h' and '1' <= name[1] <= '8':
+        return (8 - int(name[1])) * 8 + ord(name[0]) - 97
+    return MISSING
+
+
+def _milliseconds(value):
+    try:
+        return round(float(value) * 1000)
+    except (TypeError, ValueError):
+        return MISSING
+
+
+def encode_trial_columns(trial_data):
+    """trialColumns payload of a trialData list (the browser does the same in GameUI)."""
+    return {
+        'version': COLUMNS_VERSION,
+        'trial': [trial.get('trial', index + 1) for index, trial in enumerate(trial_data)],
+        'trialTimeMs': [_milliseconds(trial.get('trialTime')) for trial in trial_data],
+        'attackingPiece': [PIECE_CODES.index(trial['attackingPiece']) for trial in trial_data],
+        'attackingSquare': [square_index(trial.get('attackingPosition')) for trial in trial_data],
+        'attackedSquares': [
+            [square_index(name) for name in str(trial.get('attackedPieces') or '').split(';') if name]
+            for trial in trial_data
+        ],
+        'responseTimeMs': [_milliseconds(trial.get('responseTime')) for trial in trial_data],
+        'success': [claimed_success(trial) for trial in trial_data],
+        'responseSquare': [square_index(trial.get('responsePosition')) for trial in trial_data],
+        'fen': [trial.get('fen') for trial in trial_data],
+        'positionSignature': [trial.get('positionSignature') for trial in trial_data]
+    }
+
+
+class TrialColumns:
+    """A decoded trialColumns payload: int64 arrays per column plus the per-trial lists."""
+
+    def __init__(self, columns, trial_numbers, attacked_squares, fens, signatures):
+        self.columns = columns
+        self.trial_numbers = trial_numbers
+        self.attacked_squares = attacked_squares
+        self.fens = fens
+        self.signatures = signatures
+        self.count = columns['success'].size
+
+    @classmethod
+    def decode(cls, payload):
+        import numpy as np
+
+        if not isinstance(payload, dict):
+            raise TrialPayloadError("trialColumns must be an object")
+        if payload.get('version', COLUMNS_VERSION) != COLUMNS_VERSION:
+            raise TrialPayloadError(f"Unsupported trialColumns version {payload.get('version')!r}")
+
+        columns = {}
+        count = None
+        for name, (smallest, largest) in INTEGER_COLUMNS.items():
+            values = payload.get(name)
+            if not isinstance(values, list):
+                raise TrialPayloadError(f"{name} must be a list")
+            try:
+                array = np.array(values)
+            except ValueError:
+                raise TrialPayloadError(f"{name} must be a list of integers")
+            # Floats, booleans, strings and nested lists all end up with another dtype, except
+            # booleans mixed with integers, which numpy turns into integers
+            if values and (array.ndim != 1 or array.dtype.kind != 'i' or any(value is True or value is False for value in values)):
+                raise TrialPayloadError(f"{name} must be a list of integers")
+            array = array.astype(np.int64)
+            if array.size and (array.min() < smallest or (largest is not None and array.max() > largest)):
+                raise TrialPayloadError(f"{name} values must be between {smallest} and {largest}")
+            if count is not None and array.size != count:
+                raise TrialPayloadError(f"{name} has {array.size} values, expected {count}")
+            count = array.size
+            columns[name] = array
+
+        trial_numbers = payload.get('trial', list(range(1, count + 1)))
+        attacked_squares = payload.get('attackedSquares', [[] for _ in range(count)])
+        fens = payload.get('fen', [None] * count)
+        signatures = payload.get('positionSignature', [None] * count)
+        for name, values in (
+            ('trial', trial_numbers), ('attackedSquares', attacked_squares), ('fen', fens), ('positionSignature', signatures)
+        ):
+            if not isinstance(values, list) or len(values) != count:
+                raise TrialPayloadError(f"{name} must be a list of {count} values")
+        for squares in attacked_squares:
+            if not isinstance(squares, list) or not all(type(square) is int and 0 <= square <= 63 for square in squares):
+                raise TrialPayloadError("attackedSquares must hold lists of squares 0-63")
+
+        return cls(columns, trial_numbers, attacked_squares, fens, signatures)
+
+    def attacked_pieces(self, index):
+        return ";".join(SQUARE_NAMES[square] for square in self.attacked_squares[index])
+
+    def verify(self, signer=None):
+        """Replay every answer (see trial_verifier.verify_trials), correcting the success column in place."""
+        success = self.columns['success'].tolist()
+        pieces = self.columns['attackingPiece'].tolist()
+        sources = self.columns['attackingSquare'].tolist()
+        responses = self.columns['responseSquare'].tolist()
+        verified = 0
+        mismatches = 0
+
+        for index in range(self.count):
+            response = SQUARE_NAMES[responses[index]] if responses[index] != MISSING else None
+            source = SQUARE_NAMES[sources[index]]
+            replayed = replay_answer(
+                PIECE_CODES[pieces[index]], source, response,
+                issued_fen(signer, self.fens[index], source, self.signatures[index]), self.attacked_pieces(index)
+            )
+            if replayed is None:
+                continue
+            verified += 1
+            if replayed != success[index]:
+                mismatches += 1
+                success[index] = replayed
+
+        self.columns['success'][:] = success
+        return verification_summary(self.count, verified, mismatches)
+
+    def successful_trials(self):
+        return int(self.columns['success'].sum())
+
+    def metric_arrays(self):
+        """(response_times, rt_valid, success, trial_times) for metrics_engine.compute_metrics."""
+        import numpy as np
+
+        response_time_ms = self.columns['responseTimeMs']
+        trial_time_ms = self.columns['trialTimeMs']
+        rt_valid = response_time_ms != MISSING
+        response_times = np.where(rt_valid, response_time_ms / 1000, 0.0)
+        # Trials without a time are placed by their index, as with trialData
+        trial_times = np.where(trial_time_ms != MISSING, trial_time_ms / 1000, np.arange(1, self.count + 1))
+        return response_times, rt_valid, self.columns['success'], trial_times
+
+    def trial_rows(self, current_date, current_time, patient_name):
+        """Trials sheet rows, identical to app.build_trial_rows for the equivalent trialData."""
+        columns = {name: array.tolist() for name, array in self.columns.items()}
+        rows = []
+        for index in range(self.count):
+            trial_time = columns['trialTimeMs'][index]
+            response_time = columns['responseTimeMs'][index]
+            response = columns['responseSquare'][index]
+            rows.append([
+                current_date,
+                current_time,
+                patient_name,
+                self.trial_numbers[index],
+                trial_time / 1000 if trial_time != MISSING else '',
+                PIECE_CODES[columns['attackingPiece'][index]],
+                SQUARE_NAMES[columns['attackingSquare'][index]],
+                self.attacked_pieces(index),
+                response_time / 1000 if response_time != MISSING else '',
+                columns['success'][index],
+                SQUARE_NAMES[response] if response != MISSING else ''
+            ])
+        return rows